@@ -0,0 +1,95 @@
+# llm_sentiment/api.py
+
+
+from llm_sentiment.config import Config
+from llm_sentiment.workflow import WorkFlow
+from llm_sentiment.streaming import StreamingWorkFlow
+
+
+CATEGORIES = ['pipeline_classifier', 'classifier_classifier', 'ensemble', 'cascade']
+DATAFRAME_TYPES = ['Regular', 'MultiIndex']
+
+
+def resolve_models(models):
+    '''
+    Resolves a list of model selections to the model configuration dictionaries used by the workflow.
+
+    Args:
+        models (list): each model is either a configuration dictionary as the ones in the Config class, the name of a model ('BERTweet', 'TwitterRoBERTa'),
+            the name of its Config attribute ('MODEL_1', 'MODEL_2') or its menu number ('1', '2'). 'Both' (or '3') selects both models.
+    Raises:
+        ValueError, if a model is not found.
+    Returns:
+        list: the model configuration dictionaries.
+    '''
+    known = {'1': Config.MODEL_1, '2': Config.MODEL_2,
+             'MODEL_1': Config.MODEL_1, 'MODEL_2': Config.MODEL_2,
+             Config.MODEL_1['NAME'].lower(): Config.MODEL_1, Config.MODEL_2['NAME'].lower(): Config.MODEL_2,
+             Config.MODEL_1['ID'].lower(): Config.MODEL_1, Config.MODEL_2['ID'].lower(): Config.MODEL_2}
+
+    model_list = []
+    for model in models:
+        if isinstance(model, dict):
+            model_list.append(model)
+        elif str(model).lower() in ('3', 'both'):
+            model_list.extend([Config.MODEL_1, Config.MODEL_2])
+        elif str(model) in known or str(model).lower() in known:
+            model_list.append(known.get(str(model)) or known[str(model).lower()])
+        else:
+            raise ValueError(f"Invalid model '{model}'. Allowed models are:  {Config.MODEL_1['NAME']},  {Config.MODEL_2['NAME']},  Both.")
+    return model_list
+
+
+def run_job(category, models, dataset_name=None, dataframe_type='Regular', output_path=None, save=True, **settings):
+    '''
+    Runs one sentiment analysis job without any prompt, the library counterpart of the Menu selections.
+
+    - Validates the category and DataFrame type and resolves the models
+    - Overrides the Config settings given as keyword arguments (e.g. BATCH_SIZE=32, NUM_WORKERS=4) for the duration of the job only
+    - Runs a WorkFlow, or a StreamingWorkFlow if Config.STREAMING is True, and exports its output if save is True
+
+    Models loaded by a job are kept in the shared ModelRegistry (up to Config.MODEL_REGISTRY_SIZE of them), so that the following jobs of the same process reuse them.
+
+    Args:
+        category (str): 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade'.
+        models (list): the models to be used (see resolve_models()).
+        dataset_name (str): the dataset to be loaded. Defaults to Config.DATASET_NAME.
+        dataframe_type (str): 'Regular' or 'MultiIndex'.
+        output_path (str): path of the output dataset. Defaults to Config.OUTPUT_DATASET_PATH.
+        save (bool): if False the output is returned but not exported. Ignored in streaming mode, where rows are exported while running.
+        **settings: Config settings overridden during the job.
+    Raises:
+        ValueError, if the category or the DataFrame type is not allowed.
+    Returns:
+        pd.DataFrame or int: the output DataFrame, or the number of exported rows in streaming mode.
+    '''
+    if category not in CATEGORIES:
+        raise ValueError(f"Invalid category '{category}'. Allowed categories are:  {',  '.join(CATEGORIES)}.")
+    if dataframe_type not in DATAFRAME_TYPES:
+        raise ValueError(f"Invalid DataFrame type '{dataframe_type}'. Allowed types are:  {',  '.join(DATAFRAME_TYPES)}.")
+
+    model_list = resolve_models(models)
+    saved_settings = Config.snapshot()
+    Config.override(**{k.upper(): v for k, v in settings.items()})
+    try:
+        workflow_class = StreamingWorkFlow if Config.STREAMING else WorkFlow
+        wf = workflow_class(category, model_list, dataset_name or Config.DATASET_NAME, dataframe_type, output_path)
+        result = wf.run()
+        if save or Config.STREAMING:
+            wf.save()
+    finally:
+        Config.override(**saved_settings)
+    return result
+
+
+def run_jobs(jobs, **settings):
+    '''
+    Runs several jobs one after the other in the same process, so that models and caches stay warm between them.
+
+    Args:
+        jobs (list): A list of dictionaries of run_job() keyword arguments.
+        **settings: Config settings shared by all the jobs, overridden by the settings of each job.
+    Returns:
+        list: the result of each job.
+    '''
+    return [run_job(**dict(settings, **job)) for job in jobs]
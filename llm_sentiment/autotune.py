@@ -0,0 +1,295 @@
+# llm_sentiment/autotune.py
+
+
+import os
+import json
+import time
+import hashlib
+import platform
+import argparse
+import numpy as np
+import torch
+from llm_sentiment.config import Config
+from llm_sentiment.batching import model_batch_size, model_max_batch_tokens
+from llm_sentiment.precision import model_precision
+from llm_sentiment.backends import model_backend
+
+
+TOKEN_BUDGETS = [1024, 2048, 4096, 8192, 16384, 32768]  # MAX_BATCH_TOKENS values searched for the classifier
+BATCH_SIZES = [1, 4, 8, 16, 32, 64, 128]  # BATCH_SIZE values searched for the pipeline
+TUNED_SETTINGS = {'classifier': 'MAX_BATCH_TOKENS', 'pipeline': 'BATCH_SIZE'}  # model setting tuned for each path
+
+
+def host_info():
+    '''
+    Returns:
+        dict: what the best settings of a model depend on besides the model: the platform, processor, number of CPU cores, torch version and accelerator.
+    '''
+    return {'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'torch_version': torch.__version__,
+            'accelerator': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None}
+
+
+def profile_path(model_choice, path_name):
+    '''
+    Returns:
+        str: the path of the tuned profile of the path of the model on this host, within the 'autotune' directory of Config.CACHE_DIR,
+        keyed by the model ID, revision, precision and backend, the path and the host (see host_info()).
+    '''
+    key = [model_choice['ID'], model_choice.get('REVISION'), model_precision(model_choice), model_backend(model_choice), path_name, host_info()]
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(Config.CACHE_DIR, 'autotune', f'{digest}.json')
+
+
+def load_profile(model_choice, path_name):
+    '''
+    Returns:
+        dict: the tuned profile of the path of the model on this host (see Autotuner.tune()), or None if it has not been tuned.
+    '''
+    path = profile_path(model_choice, path_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_profile(profile, model_choice, path_name):
+    '''
+    Saves the tuned profile atomically, by writing a temporary file which then replaces its path.
+
+    Returns:
+        str: the path of the profile.
+    '''
+    path = profile_path(model_choice, path_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def is_out_of_memory(error):
+    '''
+    Returns:
+        bool: True if the error is a host or accelerator out-of-memory error.
+    '''
+    return isinstance(error, MemoryError) or 'out of memory' in str(error).lower()
+
+
+def thread_candidates():
+    '''
+    Returns:
+        list: the torch intra-op thread counts searched: 1, a quarter, half and all of the CPU cores.
+    '''
+    cores = os.cpu_count() or 1
+    return sorted({1, max(1, cores // 4), max(1, cores // 2), cores})
+
+
+class Autotuner:
+    '''
+    This class searches the batch size (pipeline) or token budget (classifier) of a model together with the number of torch intra-op threads,
+    with short calibration passes over a sample of the dataset, so that the sequence lengths of the calibration match the ones of the runs.
+
+    - The sample holds Config.AUTOTUNE_ROWS examples evenly spread over the dataset, and is tokenized once for the classifier
+    - The thread counts (see thread_candidates()) are measured first with the configured batch size or token budget,
+      then the batch sizes or token budgets (TOKEN_BUDGETS or BATCH_SIZES) with the fastest thread count
+    - An out-of-memory error backs off: the configured value is halved until a pass fits, and larger values are not tried after the first one that does not fit
+    - Each pass is run self.repeats times and its best throughput is kept. The prediction and encoding caches are disabled while tuning
+
+    The number of inter-op threads is not searched, since torch only allows setting it once per process, before any parallel work.
+    '''
+    def __init__(self, model_choice, path_name='classifier', repeats=2):
+        '''
+        Args:
+            model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+            path_name (str): 'classifier' or 'pipeline'.
+            repeats (int): number of timed runs of each calibration pass.
+        Raises:
+            ValueError, if a path other than 'classifier' or 'pipeline' is passed as input.
+        '''
+        if path_name not in TUNED_SETTINGS:
+            raise ValueError(f"Invalid path '{path_name}'. Allowed paths are:  {',  '.join(TUNED_SETTINGS)}.")
+        self.model_choice = model_choice
+        self.path_name = path_name
+        self.setting = TUNED_SETTINGS[path_name]
+        self.repeats = repeats
+        self.trials = []
+
+    def sample(self, dataset):
+        '''
+        Returns:
+            datasets.Dataset: Config.AUTOTUNE_ROWS examples evenly spread over the dataset, or the dataset if it is smaller.
+        '''
+        if len(dataset) <= Config.AUTOTUNE_ROWS:
+            return dataset
+        return dataset.select(np.unique(np.linspace(0, len(dataset) - 1, Config.AUTOTUNE_ROWS).astype(np.int64)))
+
+    def measure(self, predictor, sample, encoding, value, threads):
+        '''
+        Runs the calibration pass of the predictor on the sample with the value of self.setting and the number of threads.
+
+        Returns:
+            float: the best throughput of the pass in examples per second.
+        '''
+        torch.set_num_threads(threads)
+        predictor.model_choice = dict(self.model_choice, **{self.setting: value})
+        best = float('inf')
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            if self.path_name == 'classifier':
+                predictor.inference(encoding, return_probabilities=False)
+            else:
+                predictor.compute_sentiment(sample)
+            best = min(best, time.perf_counter() - start)
+        return len(sample) / best
+
+    def trial(self, predictor, sample, encoding, value, threads):
+        '''
+        Measures a pass (see self.measure()) and records it in self.trials.
+
+        Returns:
+            float: the throughput of the pass, or None if it ran out of memory.
+        '''
+        try:
+            rows_per_sec = self.measure(predictor, sample, encoding, value, threads)
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            rows_per_sec = None
+        self.trials.append({self.setting: value, 'threads': threads, 'rows_per_sec': rows_per_sec, 'out_of_memory': rows_per_sec is None})
+        return rows_per_sec
+
+    def tune(self, dataset):
+        '''
+        Searches the best settings of the model on a sample of the dataset.
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Raises:
+            MemoryError, if a pass with a single example per batch still runs out of memory.
+        Returns:
+            dict: the profile, with the tuned 'settings' (self.setting and 'TORCH_THREADS'), their 'rows_per_sec', the 'host' (see host_info()) and all the 'trials'.
+        '''
+        saved_settings = Config.snapshot()
+        saved_threads = torch.get_num_threads()
+        Config.override(PREDICTION_CACHE=False, ENCODING_CACHE=False, OVERLAP_PIPELINE=False)
+        if self.path_name == 'classifier':
+            from llm_sentiment.classifier import Classifier
+            predictor = Classifier(self.model_choice)
+        else:
+            from llm_sentiment.pipeline_file import PipeLine
+            predictor = PipeLine(self.model_choice)
+
+        try:
+            sample = self.sample(dataset)
+            encoding = predictor.preprocess_inst.encoding(sample) if self.path_name == 'classifier' else None
+            value = model_max_batch_tokens(self.model_choice) if self.path_name == 'classifier' else model_batch_size(self.model_choice)
+
+            # warm-up pass, backing off until it fits in memory
+            while self.trial(predictor, sample, encoding, value, saved_threads) is None:
+                if value == 1:
+                    raise MemoryError(f"{self.model_choice['NAME']} runs out of memory with a single example per batch.")
+                value = max(1, value // 2)
+            self.trials.pop()
+
+            rates = {threads: self.trial(predictor, sample, encoding, value, threads) for threads in thread_candidates()}
+            best_threads = max((threads for threads in rates if rates[threads] is not None), key=rates.get, default=saved_threads)
+            best_value, best_rate = value, rates.get(best_threads)
+
+            for candidate in (TOKEN_BUDGETS if self.path_name == 'classifier' else BATCH_SIZES):
+                if candidate == value:
+                    continue
+                rate = self.trial(predictor, sample, encoding, candidate, best_threads)
+                if rate is None:
+                    if candidate > value:
+                        break
+                    continue
+                if best_rate is None or rate > best_rate:
+                    best_value, best_rate = candidate, rate
+        finally:
+            predictor.model_choice = self.model_choice
+            predictor.close()
+            torch.set_num_threads(saved_threads)
+            Config.override(**saved_settings)
+
+        return {'model': self.model_choice['ID'],
+                'path': self.path_name,
+                'host': host_info(),
+                'rows': len(sample),
+                'settings': {self.setting: best_value, 'TORCH_THREADS': best_threads},
+                'rows_per_sec': best_rate,
+                'trials': self.trials,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def tuned_model(model_choice, path_name, dataset=None):
+    '''
+    Applies the tuned profile of the path of the model on this host, tuning it first on the dataset (see Autotuner) if there is none yet.
+
+    - The tuned batch size or token budget is returned as the "BATCH_SIZE" or "MAX_BATCH_TOKENS" key of the model, unless the model already sets it
+    - The tuned number of torch intra-op threads is returned as the "TORCH_THREADS" key of the model, unless the model already sets it or the classifier
+      runs in worker processes (Config.NUM_WORKERS greater than 1). It is applied around each prediction of the model (see Prediction.predict_path()),
+      since the number of threads is process-wide
+
+    Args:
+        model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+        path_name (str): 'classifier' or 'pipeline'.
+        dataset (datasets.Dataset): the dataset the profile is tuned on if there is none. If None, an untuned model is returned as it is.
+    Returns:
+        dict: model_choice with its tuned setting.
+    '''
+    profile = load_profile(model_choice, path_name)
+    if profile is None:
+        if dataset is None or len(dataset) == 0:
+            return model_choice
+        print(f"Autotuning the {path_name} of {model_choice['NAME']}...")
+        profile = Autotuner(model_choice, path_name).tune(dataset)
+        path = save_profile(profile, model_choice, path_name)
+        print(f"Tuned {path_name} profile of {model_choice['NAME']}: {profile['settings']} ({profile['rows_per_sec']:.1f} rows/s), saved at {path}.")
+
+    settings = profile['settings']
+    tuned = {}
+    setting = TUNED_SETTINGS[path_name]
+    if not model_choice.get(setting):
+        tuned[setting] = settings[setting]
+    if (Config.NUM_WORKERS == 1 or path_name == 'pipeline') and not model_choice.get('TORCH_THREADS'):
+        tuned['TORCH_THREADS'] = settings['TORCH_THREADS']
+    return dict(model_choice, **tuned)
+
+
+def main(argv=None):
+    '''
+    Tunes the selected models and paths on the first rows of Config.DATASET_NAME and saves their profiles, replacing the existing ones.
+    '''
+    from llm_sentiment.api import resolve_models
+    from llm_sentiment.dataset_loader import DataSetLoader
+
+    parser = argparse.ArgumentParser(description='Tune the batch size or token budget and the torch thread count of each model on this host.')
+    parser.add_argument('--models', nargs='+', default=['Both'])
+    parser.add_argument('--paths', nargs='+', default=['classifier'], choices=list(TUNED_SETTINGS))
+    parser.add_argument('--dataset', default=Config.DATASET_NAME)
+    parser.add_argument('--rows', type=int, default=Config.AUTOTUNE_ROWS, help='number of examples of the calibration passes')
+    parser.add_argument('--repeats', type=int, default=2, help='number of timed runs of each calibration pass')
+    args = parser.parse_args(argv)
+
+    Config.override(AUTOTUNE_ROWS=args.rows)
+    dataset = DataSetLoader(args.dataset).dataset_load()
+    for model_i in resolve_models(args.models):
+        for path_name in args.paths:
+            profile = Autotuner(model_i, path_name, args.repeats).tune(dataset)
+            path = save_profile(profile, model_i, path_name)
+            print(f"\n{model_i['NAME']} {path_name} ({profile['rows']} rows)")
+            for trial in profile['trials']:
+                rate = f"{trial['rows_per_sec']:.1f} rows/s" if trial['rows_per_sec'] is not None else 'out of memory'
+                print(f"  {TUNED_SETTINGS[path_name]}={trial[TUNED_SETTINGS[path_name]]:<6} threads={trial['threads']:<3} {rate}")
+            print(f"  tuned: {profile['settings']} ({profile['rows_per_sec']:.1f} rows/s), saved at {path}")
+
+
+if __name__ == "__main__":
+    main()
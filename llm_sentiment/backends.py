@@ -0,0 +1,209 @@
+# llm_sentiment/backends.py
+
+
+import os
+import re
+import json
+import hashlib
+import inspect
+import numpy as np
+import torch
+import transformers
+from llm_sentiment.config import Config, BACKENDS
+from llm_sentiment.precision import model_precision
+from llm_sentiment.loading import model_revision
+
+
+def model_backend(model_choice):
+    '''
+    Returns:
+        str: the inference backend of the model, the "BACKEND" key of model_choice if it is set, otherwise Config.BACKEND.
+    '''
+    return model_choice.get('BACKEND') or Config.BACKEND
+
+
+class LogitsModule(torch.nn.Module):
+    '''
+    This module wraps a sequence classification model so that it takes positional 'input_ids' and 'attention_mask' tensors
+    and returns the logits tensor only, which is the form the TorchScript tracer and the ONNX exporter expect.
+    '''
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class EagerBackend(torch.nn.Module):
+    '''
+    This backend runs the PyTorch model of the ModelRegistry as it is.
+    '''
+    name = 'eager'
+
+    def __init__(self, model, device):
+        super().__init__()
+        self.model = LogitsModule(model)
+        self.device = device
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids.to(self.device), attention_mask.to(self.device))
+
+
+class TorchScriptBackend(torch.nn.Module):
+    '''
+    This backend runs the model traced with torch.jit.trace and optimized for inference with torch.jit.optimize_for_inference.
+    '''
+    name = 'torchscript'
+    extension = 'pt'
+
+    def __init__(self, path, device):
+        super().__init__()
+        self.module = torch.jit.optimize_for_inference(torch.jit.load(path, map_location=device).eval())
+        self.device = device
+
+    @staticmethod
+    def export(model, example_inputs, path):
+        '''
+        Traces the model with example_inputs and saves the traced graph to path.
+        '''
+        traced = torch.jit.trace(LogitsModule(model).eval(), example_inputs, strict=False, check_trace=False)
+        torch.jit.save(traced, path)
+
+    def forward(self, input_ids, attention_mask):
+        return self.module(input_ids.to(self.device), attention_mask.to(self.device))
+
+
+class OnnxBackend(torch.nn.Module):
+    '''
+    This backend runs the model exported to ONNX with the ONNX Runtime CPU execution provider and all graph optimizations enabled.
+    The onnxruntime package, and the onnx package the exporter of recent torch versions needs, are only needed when this backend is selected.
+    '''
+    name = 'onnx'
+    extension = 'onnx'
+
+    def __init__(self, path, device=None):
+        super().__init__()
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The 'onnx' backend requires the onnxruntime package: pip install onnxruntime")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.device = torch.device('cpu')
+
+    @staticmethod
+    def export(model, example_inputs, path):
+        '''
+        Exports the model to ONNX at path, with dynamic batch and sequence dimensions.
+        The TorchScript-based exporter is used since it honours dynamic_axes. Recent torch versions default to the dynamo exporter instead,
+        which also needs the onnxscript package, so dynamo=False is passed to the versions that have this argument.
+        '''
+        dynamic_axes = {'input_ids': {0: 'batch', 1: 'sequence'},
+                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                        'logits': {0: 'batch'}}
+        exporter = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        torch.onnx.export(LogitsModule(model).eval(), example_inputs, path,
+                          input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=14, **exporter)
+
+    def forward(self, input_ids, attention_mask):
+        logits = self.session.run(['logits'], {'input_ids': input_ids.cpu().numpy(),
+                                               'attention_mask': attention_mask.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def example_inputs(model, batch_size, seq_length, seed):
+    '''
+    Builds random 'input_ids' and 'attention_mask' tensors whose examples have different lengths, so that padding is part of the traced graph.
+
+    Returns:
+        tuple: A tuple containing the 'input_ids' and 'attention_mask' tensors, on the device of the model.
+    '''
+    generator = torch.Generator().manual_seed(seed)
+    device = next(model.parameters()).device
+    input_ids = torch.randint(5, model.config.vocab_size, (batch_size, seq_length), generator=generator)
+    lengths = torch.linspace(seq_length, max(seq_length // 2, 2), batch_size).long()
+    attention_mask = (torch.arange(seq_length)[None, :] < lengths[:, None]).long()
+    input_ids = input_ids.masked_fill(attention_mask == 0, model.config.pad_token_id or 0)
+    return input_ids.to(device), attention_mask.to(device)
+
+
+def artifact_path(model_choice, model_config, backend_class):
+    '''
+    Returns the path of the exported graph of the model in the artifact cache, Config.CACHE_DIR/artifacts.
+
+    The artifact is keyed by the model ID and revision (see loading.model_revision()), the precision, the backend and the torch and transformers versions, so that it is exported again whenever one of them changes.
+
+    Returns:
+        str: the path of the artifact.
+    '''
+    settings = [model_choice['ID'], model_revision(model_choice, model_config), model_precision(model_choice), backend_class.name, torch.__version__, transformers.__version__]
+    digest = hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()[:16]
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_choice['ID']).strip('_')
+    return os.path.join(Config.CACHE_DIR, 'artifacts', f'{name}-{digest}.{backend_class.extension}')
+
+
+def check_backend(backend, model, tolerance=None):
+    '''
+    Compares the logits of the backend with the logits of the eager model on random inputs of a shape different from the exported one.
+
+    Raises:
+        ValueError, if the logits differ by more than tolerance (defaults to Config.BACKEND_TOLERANCE).
+    Returns:
+        float: the maximum absolute difference of the logits.
+    '''
+    tolerance = Config.BACKEND_TOLERANCE if tolerance is None else tolerance
+    input_ids, attention_mask = example_inputs(model, 3, 13, seed=1)
+    with torch.no_grad():
+        expected = LogitsModule(model)(input_ids, attention_mask).float().cpu()
+        actual = backend(input_ids, attention_mask).float().cpu()
+    max_diff = float((expected - actual).abs().max())
+    if not np.isfinite(max_diff) or max_diff > tolerance:
+        raise ValueError(f"The '{backend.name}' backend differs from eager by {max_diff:.2e}, above the tolerance of {tolerance:.2e}.")
+    return max_diff
+
+
+def load_backend(model_choice, model, device):
+    '''
+    Returns the inference backend of the model, exporting its graph to the artifact cache on first use.
+
+    - The backend is given by the "BACKEND" key of model_choice, or by Config.BACKEND if it is not set
+    - 'torchscript' and 'onnx' graphs are exported once, written atomically to the artifact cache and loaded from it afterwards
+    - The logits of the loaded backend are checked against eager before it is used (see check_backend())
+
+    Args:
+        model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+        model (transformers.PreTrainedModel): the model of the ModelRegistry, in its precision.
+        device (torch.device): the device the model is run on.
+    Raises:
+        ValueError, if the backend is not allowed, or if 'onnx' is used with a precision other than 'fp32'.
+    Returns:
+        torch.nn.Module: the backend, taking 'input_ids' and 'attention_mask' tensors and returning the logits.
+    '''
+    name = model_backend(model_choice)
+    if name == 'eager':
+        return EagerBackend(model, device)
+    elif name == 'torchscript':
+        backend_class = TorchScriptBackend
+    elif name == 'onnx':
+        backend_class = OnnxBackend
+        if model_precision(model_choice) != 'fp32':
+            raise ValueError("The 'onnx' backend only supports the 'fp32' precision.")
+    else:
+        raise ValueError(f"Invalid backend '{name}'. Allowed backends are:  {',  '.join(BACKENDS)}.")
+
+    path = artifact_path(model_choice, model.config, backend_class)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with torch.no_grad():
+            backend_class.export(model, example_inputs(model, 2, 8, seed=0), tmp_path)
+        os.replace(tmp_path, path)
+
+    backend = backend_class(path, device)
+    check_backend(backend, model)
+    return backend
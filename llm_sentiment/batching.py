@@ -0,0 +1,70 @@
+# llm_sentiment/batching.py
+
+
+import numpy as np
+from llm_sentiment.config import Config
+
+
+def model_batch_size(model_choice):
+    '''
+    Returns:
+        int: the pipeline batch size of the model, the "BATCH_SIZE" key of model_choice if it is set (e.g. by the autotuner), otherwise Config.BATCH_SIZE.
+    '''
+    return model_choice.get('BATCH_SIZE') or Config.BATCH_SIZE
+
+
+def model_max_batch_tokens(model_choice):
+    '''
+    Returns:
+        int: the classifier token budget of the model, the "MAX_BATCH_TOKENS" key of model_choice if it is set (e.g. by the autotuner), otherwise Config.MAX_BATCH_TOKENS.
+    '''
+    return model_choice.get('MAX_BATCH_TOKENS') or Config.MAX_BATCH_TOKENS
+
+
+class LengthBatcher:
+    '''
+    This class groups examples of similar token length into batches, so that the padding added to each batch is minimal.
+
+    The examples are sorted by their token length and batches are formed greedily so that the number of padded tokens of a
+    batch (number of examples times the longest example of the batch) stays within max_tokens.
+    The batches are lists of example indices, which the Classifier pads with RaggedEncoding.collate().
+    '''
+    def __init__(self, lengths, max_tokens=None):
+        '''
+        Initializes the LengthBatcher class.
+
+        Args:
+            lengths (array-like): token length of each example.
+            max_tokens (int): maximum number of padded tokens per batch. Defaults to Config.MAX_BATCH_TOKENS.
+        '''
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens or Config.MAX_BATCH_TOKENS
+        self.batches = self.make_batches()
+
+    def make_batches(self):
+        '''
+        - Sorts the example indices by token length
+        - Appends examples to the current batch as long as the padded size of the batch stays within self.max_tokens
+        - A batch always contains at least one example, even if that example alone exceeds self.max_tokens
+
+        Returns:
+            list: A list of batches, each one being a list of example indices.
+        '''
+        order = np.argsort(self.lengths, kind='stable')
+        batches = []
+        batch = []
+        for idx in order:
+            longest = max(int(self.lengths[idx]), 1)
+            if batch and longest * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(int(idx))
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
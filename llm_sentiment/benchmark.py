@@ -0,0 +1,513 @@
+# llm_sentiment/benchmark.py
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import torch
+from datasets import Dataset
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import AutoConfig, AutoModelForSequenceClassification, PreTrainedTokenizerFast, RobertaConfig
+from llm_sentiment.config import Config, PRECISIONS, BACKENDS
+from llm_sentiment.pipeline_file import PipeLine
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.dataframe import DataFrameBuilder
+from llm_sentiment.instrumentation import peak_rss_mb
+from llm_sentiment.loading import ensure_bundle
+
+
+LABELS = ['negative', 'neutral', 'positive']
+HEAVY_MODULES = ['torch', 'transformers', 'datasets', 'pandas', 'numpy', 'pyarrow']  # libraries the startup of the CLI and the menu must not import
+STARTUP_CODE = {'cli': 'from llm_sentiment import cli; cli.build_parser()',
+                'menu': 'from llm_sentiment.menu import Menu; from llm_sentiment.workflow import WorkFlow; Menu()'}
+# run by each worker process of the loading path: loads the classifier of the model given as JSON, predicts one text, then waits for a line on stdin
+# so that the memory of every worker is measured while all of them hold the model
+LOADING_CODE = '''
+import sys, json, time
+start = time.perf_counter()
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.loading import memory_usage
+model_choice = json.loads(sys.argv[1])
+model_choice['ID2LABEL'] = {int(k): v for k, v in model_choice['ID2LABEL'].items()}
+Classifier(model_choice).compute_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: ['w1 w2 w3']}))
+print(json.dumps({'first_prediction_s': time.perf_counter() - start}), flush=True)
+sys.stdin.readline()
+print(json.dumps(memory_usage()), flush=True)
+'''
+
+
+def build_tiny_model(directory, vocab_size=1000, max_length=None, model_config_path=None, seed=0):
+    '''
+    Builds a randomly-initialized sentiment model and its tokenizer entirely offline and saves them to directory, so that it can be loaded like a Hub model.
+
+    - The tokenizer is a whitespace word-level tokenizer whose vocabulary is the special tokens followed by the words 'w0', 'w1', ...
+    - The model is built from the configuration file at model_config_path, or from a tiny RoBERTa configuration if it is None.
+
+    Args:
+        directory (str): directory the model and tokenizer are saved to.
+        vocab_size (int): number of words of the tokenizer vocabulary.
+        max_length (int): maximum number of tokens of the tiny model inputs. Defaults to Config.MAX_LENGTH.
+        model_config_path (str): optional path to a local model configuration file.
+        seed (int): seed of the random initialization of the model.
+    Returns:
+        dict: A model configuration dictionary, as the ones in the Config class, pointing to directory.
+    '''
+    special_tokens = ['<s>', '<pad>', '</s>', '<unk>']
+    vocab = {token: i for i, token in enumerate(special_tokens + [f'w{i}' for i in range(vocab_size)])}
+
+    tokenizer = Tokenizer(models.WordLevel(vocab=vocab, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single='<s> $A </s>',
+                                                             special_tokens=[('<s>', vocab['<s>']), ('</s>', vocab['</s>'])])
+
+    id2label = dict(enumerate(LABELS))
+    label2id = {label: i for i, label in id2label.items()}
+    if model_config_path:
+        model_config = AutoConfig.from_pretrained(model_config_path, num_labels=len(LABELS), id2label=id2label, label2id=label2id)
+    else:
+        model_config = RobertaConfig(vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                                     intermediate_size=128, max_position_embeddings=(max_length or Config.MAX_LENGTH) + 2,
+                                     pad_token_id=vocab['<pad>'], bos_token_id=vocab['<s>'], eos_token_id=vocab['</s>'],
+                                     num_labels=len(LABELS), id2label=id2label, label2id=label2id)
+
+    torch.manual_seed(seed)
+    model = AutoModelForSequenceClassification.from_config(model_config)
+    model.save_pretrained(directory)
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                            bos_token='<s>', eos_token='</s>', pad_token='<pad>', unk_token='<unk>',
+                            model_max_length=model_config.max_position_embeddings - 2).save_pretrained(directory)
+
+    return {"ID": directory,
+            "NAME": "Tiny",
+            "LABEL2ID": label2id,
+            "ID2LABEL": id2label}
+
+
+def synthetic_texts(num_rows, length_dist='lognormal', mean_words=25, max_words=200, vocab_size=1000, seed=0):
+    '''
+    Generates random texts of the words 'w0', 'w1', ... whose number of words follows length_dist.
+
+    Args:
+        num_rows (int): number of texts.
+        length_dist (str): distribution of the number of words, 'fixed', 'uniform' (between 1 and 2 x mean_words) or 'lognormal' (a long tail of long texts).
+        mean_words (int): mean number of words per text.
+        max_words (int): maximum number of words per text.
+        vocab_size (int): number of distinct words.
+        seed (int): seed of the random generator.
+    Returns:
+        list: the generated texts.
+    '''
+    rng = np.random.default_rng(seed)
+    if length_dist == 'fixed':
+        lengths = np.full(num_rows, mean_words)
+    elif length_dist == 'uniform':
+        lengths = rng.integers(1, 2 * mean_words + 1, size=num_rows)
+    elif length_dist == 'lognormal':
+        sigma = 0.6
+        lengths = rng.lognormal(np.log(mean_words) - sigma ** 2 / 2, sigma, size=num_rows).round()
+    else:
+        raise ValueError(f"Invalid length distribution '{length_dist}'. Allowed distributions are: fixed, uniform, lognormal.")
+
+    lengths = np.clip(lengths, 1, max_words).astype(int)
+    words = rng.integers(0, vocab_size, size=int(lengths.sum()))
+    texts = []
+    start = 0
+    for length in lengths:
+        texts.append(' '.join(f'w{w}' for w in words[start:start + length]))
+        start += length
+    return texts
+
+
+class ForwardTimer:
+    '''
+    This class measures the duration of each forward pass of a model with forward hooks, without modifying the model.
+    '''
+    def __init__(self, model):
+        self.durations = []
+        self.start = None
+        self.handles = [model.register_forward_pre_hook(self.pre_hook),
+                        model.register_forward_hook(self.hook)]
+
+    def pre_hook(self, module, inputs):
+        self.start = time.perf_counter()
+
+    def hook(self, module, inputs, outputs):
+        self.durations.append(time.perf_counter() - self.start)
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+
+
+def benchmark_path(predictor, path_name, dataset, settings):
+    '''
+    Runs one prediction of the dataset with predictor under settings and measures it.
+
+    - For the classifier, tokenization is timed separately from inference by calling the PreProcess and Classifier steps one by one
+    - For the pipeline, the time not spent in forward passes (tokenization, padding and post-processing) is reported as preprocessing time
+    - For the overlapped classifier (Config.OVERLAP_PIPELINE), the stages run concurrently, so the time not spent in forward passes is the part of the tokenization,
+      collation and post-processing that is not hidden behind them
+
+    Returns:
+        dict: the settings and measures of the run.
+    '''
+    Config.override(**settings)
+    timer = ForwardTimer(predictor.backend if path_name in ('classifier', 'overlap') else predictor.model)
+    try:
+        start = time.perf_counter()
+        if path_name == 'classifier':
+            encoding = predictor.preprocess_inst.encoding(dataset)
+            tokenize_time = time.perf_counter() - start
+            predictor.get_label(predictor.inference(encoding))
+        else:
+            predictor.compute_sentiment(dataset)
+            tokenize_time = None
+        total_time = time.perf_counter() - start
+    finally:
+        timer.remove()
+
+    latencies = np.array(timer.durations) * 1000
+    forward_time = float(np.sum(timer.durations))
+    return {'path': path_name,
+            'settings': settings,
+            'rows': len(dataset),
+            'batches': len(latencies),
+            'rows_per_sec': len(dataset) / total_time,
+            'total_s': total_time,
+            'tokenize_s': tokenize_time,
+            'forward_s': forward_time,
+            'other_s': total_time - forward_time - (tokenize_time or 0.0),
+            'latency_ms': {f'p{q}': float(np.percentile(latencies, q)) if len(latencies) else None for q in (50, 95, 99)},
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def concat_dataframe(predictor_obj):
+    '''
+    Builds the regular DataFrame of the 'pipeline_classifier' category as DataFrameBuilder did before it collected the columns first:
+    the text column is copied out of the dataset, and the columns of each model are concatenated and the whole DataFrame rounded after each model.
+    It is the baseline of the 'dataframe' benchmark.
+
+    Returns:
+        pd.DataFrame: the regular DataFrame.
+    '''
+    result_df = pd.DataFrame(predictor_obj.dataset, columns=[Config.COLUMN_TEXT]).copy()
+    for i, preds in enumerate(predictor_obj.pred_both):
+        pipe_df = pd.DataFrame({f'{predictor_obj.model_list[i]["NAME"]}_pipeline_sentiment': preds[0]['sentiment'],
+                                f'{predictor_obj.model_list[i]["NAME"]}_pipeline_score': preds[0]['score']})
+        cl_df = pd.DataFrame({f'{predictor_obj.model_list[i]["NAME"]}_classifier_sentiment': preds[1]['sentiment'],
+                              f'{predictor_obj.model_list[i]["NAME"]}_classifier_score': preds[1]['score']})
+        result_df = pd.concat([result_df, pipe_df, cl_df], axis=1)
+        result_df = result_df.round(Config.DECIMAL_PLACE)
+    return result_df
+
+
+def benchmark_dataframe(dataset, num_models, seed=0):
+    '''
+    Measures the time, the peak memory allocated and the memory of the result of building the output DataFrame of random 'pipeline_classifier'
+    predictions of num_models models for the dataset, with concat_dataframe() (the baseline) and with DataFrameBuilder, regular and MultiIndex,
+    with and without Config.COMPACT_DATAFRAME. Each frame is built twice: once timed, and once with its peak memory traced by tracemalloc,
+    which also traces the numpy and pandas buffers.
+
+    Returns:
+        list: the measures of each builder.
+    '''
+    rng = np.random.default_rng(seed)
+    labels = np.array(LABELS, dtype=object)
+
+    def random_preds():
+        return {'sentiment': labels[rng.integers(0, len(LABELS), size=len(dataset))],
+                'score': rng.random(len(dataset), dtype=np.float32)}
+
+    predictor_obj = SimpleNamespace(category='pipeline_classifier',
+                                    model_list=[{'NAME': f'model{i}', 'ID2LABEL': dict(enumerate(LABELS))} for i in range(num_models)],
+                                    dataset=dataset,
+                                    pred_both=[[random_preds(), random_preds()] for _ in range(num_models)],
+                                    ensemble_preds=None,
+                                    cascade_preds=None)
+
+    builders = [('concat', False, lambda: concat_dataframe(predictor_obj))]
+    builders += [(name, compact, build) for compact in (False, True)
+                 for name, build in [('regular', lambda: DataFrameBuilder(predictor_obj).regular()),
+                                     ('multi_index', lambda: DataFrameBuilder(predictor_obj).multi_index())]]
+    saved_compact = Config.COMPACT_DATAFRAME
+    results = []
+    try:
+        for name, compact, build in builders:
+            Config.override(COMPACT_DATAFRAME=compact)
+            # timed without tracing, since tracemalloc slows down every allocation
+            start = time.perf_counter()
+            df = build()
+            elapsed = time.perf_counter() - start
+            del df
+            tracemalloc.start()
+            df = build()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({'path': 'dataframe',
+                            'settings': {'builder': name, 'models': num_models, 'COMPACT_DATAFRAME': compact},
+                            'rows': len(dataset),
+                            'rows_per_sec': len(dataset) / elapsed,
+                            'total_s': elapsed,
+                            'peak_alloc_mb': peak / 1024 ** 2,
+                            'frame_mb': float(df.memory_usage(deep=True).sum()) / 1024 ** 2,
+                            'peak_rss_mb': peak_rss_mb()})
+            del df
+    finally:
+        Config.override(COMPACT_DATAFRAME=saved_compact)
+    return results
+
+
+def benchmark_startup(repeats, budget_ms):
+    '''
+    Measures the startup time of the command line interface (importing it and building its parser) and of the interactive menu,
+    each in a new Python process, as the best of repeats runs minus the startup time of an empty Python process.
+    It also lists the heavy libraries of HEAVY_MODULES that are imported at startup, which should be none since they are imported lazily.
+
+    Args:
+        repeats (int): number of runs of each startup.
+        budget_ms (float): maximum startup time in milliseconds.
+    Returns:
+        list: the measures of each startup, whose 'within_budget' is False if its time exceeds budget_ms or if it imports a heavy library.
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+
+    def run(code):
+        durations = []
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env).stdout
+            durations.append(time.perf_counter() - start)
+        return min(durations) * 1000, output
+
+    baseline_ms, _ = run('pass')
+    check = f"; import sys, json; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    results = []
+    for name, code in STARTUP_CODE.items():
+        elapsed_ms, output = run(code + check)
+        heavy = json.loads(output.strip().splitlines()[-1])
+        startup_ms = elapsed_ms - baseline_ms
+        results.append({'path': 'startup',
+                        'settings': {'entry_point': name},
+                        'startup_ms': startup_ms,
+                        'python_startup_ms': baseline_ms,
+                        'heavy_modules': heavy,
+                        'budget_ms': budget_ms,
+                        'within_budget': startup_ms <= budget_ms and not heavy})
+    return results
+
+
+def benchmark_loading(model_choice, num_workers, precisions, cache_dir):
+    '''
+    Measures the time to the first prediction and the memory of num_workers worker processes started together, each one loading the classifier of the model,
+    with the model loaded by from_pretrained and from its memory-mapped bundle (see loading.load_model()). The bundle is converted once beforehand, in cache_dir,
+    and its conversion is timed separately. The memory is measured once every worker has predicted: the total PSS of the workers counts the weights they share once.
+
+    Args:
+        model_choice (dict): the model loaded by the workers.
+        num_workers (int): number of worker processes started together.
+        precisions (list): the PRECISION values measured.
+        cache_dir (str): the Config.CACHE_DIR of the workers, where the bundle is converted.
+    Returns:
+        list: the measures of each precision, with and without the bundle.
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])),
+               LLM_SENTIMENT_CACHE_DIR=cache_dir, LLM_SENTIMENT_PREDICTION_CACHE='false', LLM_SENTIMENT_ENCODING_CACHE='false')
+
+    saved_settings = Config.snapshot()
+    Config.override(CACHE_DIR=cache_dir)
+    try:
+        start = time.perf_counter()
+        ensure_bundle(model_choice['ID'])
+        conversion_s = time.perf_counter() - start
+    finally:
+        Config.override(**saved_settings)
+
+    def read_json(process):
+        # the first JSON line printed by the worker, skipping its other messages
+        for line in iter(process.stdout.readline, ''):
+            if line.startswith('{'):
+                return json.loads(line)
+        raise RuntimeError(f'A loading worker has exited with status {process.wait()}.')
+
+    results = []
+    for precision in precisions:
+        for bundles in (False, True):
+            worker_env = dict(env, LLM_SENTIMENT_MODEL_BUNDLES=json.dumps(bundles), LLM_SENTIMENT_PRECISION=precision)
+            processes = [subprocess.Popen([sys.executable, '-c', LOADING_CODE, json.dumps(model_choice)],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=worker_env)
+                         for _ in range(max(1, num_workers))]
+            try:
+                first = [read_json(process)['first_prediction_s'] for process in processes]
+                for process in processes:
+                    process.stdin.write('\n')
+                    process.stdin.flush()
+                memory = [read_json(process) for process in processes]
+            finally:
+                for process in processes:
+                    process.kill()
+                    process.wait()
+
+            pss = [usage['pss_mb'] for usage in memory]
+            results.append({'path': 'loading',
+                            'settings': {'MODEL_BUNDLES': bundles, 'PRECISION': precision, 'workers': len(processes)},
+                            'first_prediction_s': max(first),
+                            'conversion_s': conversion_s if bundles else None,
+                            'rss_mb': float(np.mean([usage['rss_mb'] for usage in memory])),
+                            'pss_mb': sum(pss) if None not in pss else None})
+    return results
+
+
+def git_commit():
+    '''
+    Returns:
+        str: the current git commit of the repository, or None if it is not available.
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    '''
+    Runs the pipeline and/or classifier paths over the benchmark texts for every combination of the settings in args and writes the results as JSON.
+    The 'overlap' path runs the classifier with its stages overlapped (see OverlappedInference), to be compared with the 'classifier' path.
+    The 'dataframe' path measures the assembly of the output DataFrame of random predictions instead (see benchmark_dataframe()),
+    the 'startup' path the startup time of the command line interface and of the menu (see benchmark_startup()),
+    and the 'loading' path the time to the first prediction and the memory of worker processes loading the model (see benchmark_loading()).
+
+    Returns:
+        dict: the benchmark results.
+    '''
+    Config.override(PREDICTION_CACHE=False, ENCODING_CACHE=False)
+
+    if args.texts:
+        with open(args.texts) as f:
+            texts = [line.strip() for line in f if line.strip()][:args.rows]
+    else:
+        texts = synthetic_texts(args.rows, args.length_dist, args.mean_words, args.max_words, args.vocab_size, args.seed)
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: texts})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.model:
+            model_choice = {"ID": args.model, "NAME": args.model, "LABEL2ID": Config.MODEL_1['LABEL2ID'], "ID2LABEL": Config.MODEL_1['ID2LABEL']}
+        else:
+            model_choice = build_tiny_model(tmp_dir, args.vocab_size, max(args.max_lengths), args.model_config, args.seed)
+
+        results = []
+        for path_name in args.paths:
+            if path_name == 'startup':
+                for result in benchmark_startup(args.repeats, args.import_budget_ms):
+                    results.append(result)
+                    print(f"startup    {json.dumps(result['settings']):<45} {result['startup_ms']:>8.1f} ms  "
+                          f"budget {result['budget_ms']:.0f} ms  heavy modules {result['heavy_modules'] or 'none'}")
+                continue
+            if path_name == 'loading':
+                for result in benchmark_loading(model_choice, args.loading_workers, args.precisions, os.path.join(tmp_dir, 'cache')):
+                    results.append(result)
+                    pss = f"{result['pss_mb']:.0f} MB" if result['pss_mb'] is not None else 'n/a'
+                    print(f"loading    {json.dumps(result['settings']):<45} {result['first_prediction_s']:>8.2f} s to first prediction  "
+                          f"rss {result['rss_mb']:.0f} MB per worker  pss {pss} in total")
+                continue
+            if path_name == 'dataframe':
+                for result in benchmark_dataframe(dataset, args.dataframe_models, args.seed):
+                    results.append(result)
+                    print(f"dataframe  {json.dumps(result['settings']):<45} {result['total_s']:>8.2f} s  "
+                          f"peak {result['peak_alloc_mb']:.0f} MB allocated  frame {result['frame_mb']:.0f} MB")
+                continue
+            if path_name == 'pipeline':
+                grid = [{'BATCH_SIZE': b, 'MAX_LENGTH': m} for b in args.batch_sizes for m in args.max_lengths]
+            else:
+                grid = [{'MAX_BATCH_TOKENS': t, 'BACKEND': b, 'OVERLAP_PIPELINE': path_name == 'overlap'} for b in args.backends for t in args.max_batch_tokens]
+            grid = [dict(settings, PRECISION=p) for p in args.precisions for settings in grid]
+
+            predictor, predictor_key = None, None
+            for settings in grid:
+                Config.override(**settings)
+                # the model is loaded again only when the precision or the backend changes
+                if (settings['PRECISION'], settings.get('BACKEND')) != predictor_key:
+                    if predictor is not None:
+                        predictor.close()
+                    predictor = PipeLine(model_choice) if path_name == 'pipeline' else Classifier(model_choice)
+                    predictor_key = (settings['PRECISION'], settings.get('BACKEND'))
+                predictor.compute_sentiment(dataset.select(range(min(len(dataset), args.warmup_rows))))
+                for repeat in range(args.repeats):
+                    result = benchmark_path(predictor, path_name, dataset, settings)
+                    result['repeat'] = repeat
+                    results.append(result)
+                    print(f"{path_name:<10} {json.dumps(settings):<45} {result['rows_per_sec']:>10.1f} rows/s  "
+                          f"p50 {result['latency_ms']['p50'] or 0:.1f} ms  p99 {result['latency_ms']['p99'] or 0:.1f} ms")
+            predictor.close()
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'git_commit': git_commit(),
+              'host': {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+              'torch_version': torch.__version__,
+              'torch_threads': torch.get_num_threads(),
+              'model': model_choice['ID'] if args.model else 'tiny',
+              'args': vars(args),
+              'results': results}
+
+    output_path = args.output or os.path.join(Config.OUTPUT_DIR, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nBenchmark results have been saved at {output_path}.\n')
+    return report
+
+
+def parse_args(argv=None):
+    '''
+    Parses the command line arguments of the benchmark.
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the throughput, latency and memory of the pipeline and classifier paths.')
+    parser.add_argument('--paths', nargs='+', default=['pipeline', 'classifier'], choices=['pipeline', 'classifier', 'overlap', 'dataframe', 'startup', 'loading'])
+    parser.add_argument('--rows', type=int, default=2000, help='number of texts')
+    parser.add_argument('--texts', help='optional local text file with one text per line, instead of synthetic texts')
+    parser.add_argument('--length-dist', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--mean-words', type=int, default=25)
+    parser.add_argument('--max-words', type=int, default=200)
+    parser.add_argument('--vocab-size', type=int, default=1000)
+    parser.add_argument('--model', help='ID or local path of a model to benchmark instead of a tiny random model')
+    parser.add_argument('--model-config', help='local model configuration file the tiny random model is built from')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[Config.BATCH_SIZE], help='pipeline BATCH_SIZE values')
+    parser.add_argument('--max-lengths', nargs='+', type=int, default=[Config.MAX_LENGTH], help='pipeline MAX_LENGTH values')
+    parser.add_argument('--max-batch-tokens', nargs='+', type=int, default=[Config.MAX_BATCH_TOKENS], help='classifier MAX_BATCH_TOKENS values')
+    parser.add_argument('--precisions', nargs='+', default=[Config.PRECISION], choices=PRECISIONS, help='PRECISION values')
+    parser.add_argument('--backends', nargs='+', default=[Config.BACKEND], choices=BACKENDS, help='classifier BACKEND values')
+    parser.add_argument('--dataframe-models', type=int, default=2, help='number of models of the dataframe path predictions')
+    parser.add_argument('--loading-workers', type=int, default=4, help='number of worker processes started together by the loading path')
+    parser.add_argument('--import-budget-ms', type=float, default=500, help='maximum startup time of the startup path, the benchmark fails above it')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--warmup-rows', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON results file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''
+    Runs the benchmark, and exits with an error status if a startup exceeds its budget, so that the import-time budget can be checked in CI.
+    '''
+    report = run_benchmark(parse_args(argv))
+    over_budget = [result['settings']['entry_point'] for result in report['results'] if result['path'] == 'startup' and not result['within_budget']]
+    if over_budget:
+        sys.exit(f"Startup over budget or importing heavy modules: {', '.join(over_budget)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# llm_sentiment/cache.py
+
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import numpy as np
+from llm_sentiment.config import Config
+from llm_sentiment.precision import model_precision
+from llm_sentiment.backends import model_backend
+from llm_sentiment.loading import model_revision
+from llm_sentiment.encoding import text_bytes
+
+
+class PredictionCache:
+    '''
+    This class keeps the predictions of a model in a persistent SQLite database, so that texts already scored in previous runs are not sent to the model again.
+
+    Each prediction is keyed by the hash of the text together with a namespace identifying everything the prediction depends on:
+    the model ID, revision and labels, the prediction path ('pipeline' or 'classifier'), the precision, the classifier backend and the tokenizer settings (Config.MAX_LENGTH, Config.TRUNCATION).
+    The least recently used predictions are evicted once the database holds more than Config.PREDICTION_CACHE_MAX_ENTRIES predictions.
+    '''
+    QUERY_SIZE = 500  # number of keys per SQL query, below the SQLite limit of host parameters
+
+    def __init__(self, model_choice, path_name, model_config, with_probabilities=None):
+        '''
+        Initializes the PredictionCache class.
+
+        Args:
+            model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+            path_name (str): name of the prediction path, either 'pipeline' or 'classifier'.
+            model_config (transformers.PretrainedConfig): the configuration of the model whose predictions are cached, used to obtain its revision (see loading.model_revision()).
+            with_probabilities (bool): if True the probabilities of all labels are cached and returned, and cached predictions without them are treated as misses.
+                Defaults to Config.RETURN_PROBABILITIES for the classifier path and False for the pipeline path.
+        '''
+        settings = [model_choice['ID'], model_revision(model_choice, model_config), model_choice['ID2LABEL'], path_name, model_precision(model_choice),
+                    model_backend(model_choice) if path_name == 'classifier' else 'eager', Config.MAX_LENGTH, Config.TRUNCATION]
+        self.namespace = hashlib.sha256(json.dumps(settings).encode('utf-8')).digest()
+        self.db_path = os.path.join(Config.CACHE_DIR, 'predictions.sqlite')
+        if with_probabilities is None:
+            with_probabilities = path_name == 'classifier' and Config.RETURN_PROBABILITIES
+        self.with_probabilities = with_probabilities
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        '''
+        Opens the cache database, creating it and its tables if they do not exist.
+
+        The number of predictions is kept in the single row of the cache_size table by triggers, so that store() does not count the predictions table.
+        The rows replaced by INSERT OR REPLACE only fire the delete trigger with recursive triggers enabled.
+
+        Returns:
+            sqlite3.Connection: the connection to the cache database.
+        '''
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA recursive_triggers=ON')
+        connection.execute('''CREATE TABLE IF NOT EXISTS predictions (
+                                  key BLOB PRIMARY KEY,
+                                  sentiment TEXT NOT NULL,
+                                  label_id INTEGER NOT NULL,
+                                  score REAL NOT NULL,
+                                  probabilities BLOB,
+                                  accessed INTEGER NOT NULL)''')
+        connection.execute('CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)')
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL)')
+            # counts the predictions once, when the database is created or was created without the cache_size table
+            connection.execute('INSERT OR IGNORE INTO cache_size SELECT 0, COUNT(*) FROM predictions WHERE NOT EXISTS (SELECT 1 FROM cache_size)')
+            connection.execute('''CREATE TRIGGER IF NOT EXISTS predictions_insert AFTER INSERT ON predictions
+                                  BEGIN UPDATE cache_size SET entries = entries + 1; END''')
+            connection.execute('''CREATE TRIGGER IF NOT EXISTS predictions_delete AFTER DELETE ON predictions
+                                  BEGIN UPDATE cache_size SET entries = entries - 1; END''')
+        return connection
+
+    @staticmethod
+    def size(connection):
+        '''
+        Returns:
+            int: the number of predictions in the cache database.
+        '''
+        return connection.execute('SELECT entries FROM cache_size').fetchone()[0]
+
+    def keys(self, dataset):
+        '''
+        Computes the cache key of each text of the dataset, hashing the UTF-8 bytes of the texts directly from the Arrow buffers.
+
+        Returns:
+            list: the cache key of each text.
+        '''
+        namespace = hashlib.sha256(self.namespace)
+        keys = []
+        for text in text_bytes(dataset):
+            digest = namespace.copy()
+            digest.update(text)
+            keys.append(digest.digest())
+        return keys
+
+    def lookup(self, connection, keys):
+        '''
+        Fetches the cached predictions of the keys and marks them as recently used.
+
+        Returns:
+            dict: A dictionary mapping each cached key to its (sentiment, label_id, score, probabilities) row.
+        '''
+        rows = {}
+        now = time.time_ns()
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), self.QUERY_SIZE):
+            chunk = unique_keys[start:start + self.QUERY_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            query = f'SELECT key, sentiment, label_id, score, probabilities FROM predictions WHERE key IN ({placeholders})'
+            for key, sentiment, label_id, score, probabilities in connection.execute(query, chunk):
+                if probabilities is None and self.with_probabilities:
+                    continue
+                rows[key] = (sentiment, label_id, score, probabilities)
+            connection.execute(f'UPDATE predictions SET accessed = ? WHERE key IN ({placeholders})', [now] + chunk)
+        return rows
+
+    def store(self, connection, keys, preds):
+        '''
+        Stores the predictions of the keys and evicts the least recently used predictions beyond Config.PREDICTION_CACHE_MAX_ENTRIES.
+        '''
+        now = time.time_ns()
+        probabilities = preds.get('probabilities')
+        rows = [(key,
+                 str(preds['sentiment'][i]),
+                 int(preds['label_ids'][i]),
+                 float(preds['score'][i]),
+                 probabilities[i].tobytes() if probabilities is not None else None,
+                 now)
+                for i, key in enumerate(keys)]
+        connection.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+        excess = self.size(connection) - Config.PREDICTION_CACHE_MAX_ENTRIES
+        if excess > 0:
+            # the index on accessed finds the least recently used predictions without scanning the table
+            connection.execute('DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY accessed LIMIT ?)', (excess,))
+
+    def get_sentiment(self, dataset, compute):
+        '''
+        - Computes the cache key of each text of the dataset and fetches the cached predictions
+        - Passes only the examples that are not cached (cache misses) to compute() and stores their predictions
+        - Assembles the cached and computed predictions in the original order of the examples
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+            compute (callable): a function returning the dictionary of prediction arrays of a dataset.
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids'
+            (and 'probabilities' for the classifier if Config.RETURN_PROBABILITIES is True).
+        '''
+        keys = self.keys(dataset)
+
+        connection = self.connect()
+        try:
+            with connection:
+                rows = self.lookup(connection, keys)
+            miss_indices = [i for i, key in enumerate(keys) if key not in rows]
+            hit_indices = [i for i, key in enumerate(keys) if key in rows]
+            self.hits += len(hit_indices)
+            self.misses += len(miss_indices)
+
+            if miss_indices:
+                miss_preds = compute(dataset.select(miss_indices))
+                with connection:
+                    self.store(connection, [keys[i] for i in miss_indices], miss_preds)
+        finally:
+            connection.close()
+
+        num_examples = len(keys)
+        all_preds = {'sentiment': np.empty(num_examples, dtype=object),
+                     'score': np.empty(num_examples, dtype=np.float32),
+                     'label_ids': np.empty(num_examples, dtype=np.int64)}
+        if self.with_probabilities and num_examples:
+            num_labels = len(rows[keys[hit_indices[0]]][3]) // 4 if hit_indices else miss_preds['probabilities'].shape[1]
+            all_preds['probabilities'] = np.empty((num_examples, num_labels), dtype=np.float32)
+
+        if miss_indices:
+            for name in all_preds:
+                all_preds[name][miss_indices] = miss_preds[name]
+
+        if hit_indices:
+            hit_rows = [rows[keys[i]] for i in hit_indices]
+            all_preds['sentiment'][hit_indices] = [row[0] for row in hit_rows]
+            all_preds['label_ids'][hit_indices] = [row[1] for row in hit_rows]
+            all_preds['score'][hit_indices] = [row[2] for row in hit_rows]
+            if self.with_probabilities:
+                all_preds['probabilities'][hit_indices] = np.frombuffer(b''.join(row[3] for row in hit_rows),
+                                                                        dtype=np.float32).reshape(len(hit_rows), -1)
+
+        return all_preds
+
+    def stats(self):
+        '''
+        Returns:
+            dict: A dictionary with the number of cache hits and misses and the hit rate.
+        '''
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
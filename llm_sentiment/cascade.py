@@ -0,0 +1,208 @@
+# llm_sentiment/cascade.py
+
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from llm_sentiment.config import Config
+
+
+DEFAULT_SWEEP_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99]
+
+
+def model_threshold(model_choice):
+    '''
+    Returns:
+        float: the confidence threshold of the model in a cascade, the "CASCADE_THRESHOLD" key of model_choice if it is set, otherwise Config.CASCADE_THRESHOLD.
+    '''
+    threshold = model_choice.get('CASCADE_THRESHOLD')
+    return Config.CASCADE_THRESHOLD if threshold is None else threshold
+
+
+def deciding_stages(scores, thresholds):
+    '''
+    Returns the stage deciding each example when the predictions of every stage are known, as the cascade would decide them.
+
+    Args:
+        scores (list): the scores of each stage, one array with one entry per example each.
+        thresholds (list): the confidence threshold of each stage but the last one.
+    Returns:
+        np.ndarray: the index of the first stage whose score reaches its threshold for each example, the last stage if none does.
+    '''
+    stage = np.full(len(scores[0]), len(scores) - 1, dtype=np.int64)
+    pending = np.ones(len(scores[0]), dtype=bool)
+    for i, threshold in enumerate(thresholds[:len(scores) - 1]):
+        confident = pending & (np.asarray(scores[i]) >= threshold)
+        stage[confident] = i
+        pending &= ~confident
+    return stage
+
+
+class Cascade:
+    '''
+    This class predicts a dataset with the classifiers of the models of model_list as a confidence-gated cascade, instead of running every model over every example.
+
+    - The models are stages run in the order of model_list, so the cheapest model (e.g. a model with an "int8" "PRECISION" key) should come first
+    - Each stage predicts the examples the previous stages were not confident about, and decides the examples whose score, the maximum softmax probability,
+      reaches its threshold (see model_threshold()). The last stage decides all the examples left
+    - The predictions hold the sentiment and score of the deciding stage and the name of its model, and the number of examples scored and decided by each stage are counted
+    '''
+    def __init__(self, model_list, thresholds=None):
+        '''
+        Args:
+            model_list (list): the models of the stages, in the order they are run.
+            thresholds (list): the confidence threshold of each stage but the last one. Defaults to the threshold of each model (see model_threshold()).
+        '''
+        self.model_list = model_list
+        self.thresholds = list(thresholds) if thresholds is not None else [model_threshold(model_i) for model_i in model_list[:-1]]
+        self.rows = 0
+        self.scored = [0] * len(model_list)
+        self.decided = [0] * len(model_list)
+
+    def predict(self, dataset, predict_model):
+        '''
+        Predicts the dataset stage-by-stage.
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+            predict_model (callable): predict_model(model_i, dataset) returns the classifier predictions of model_i on a dataset, with its 'sentiment' and 'score'.
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the 'sentiment' and 'score' of the deciding stage and the 'stage', the name of its model.
+        '''
+        num_rows = len(dataset)
+        sentiment = np.empty(num_rows, dtype=object)
+        score = np.zeros(num_rows, dtype=np.float32)
+        stage = np.empty(num_rows, dtype=object)
+        pending = np.arange(num_rows)
+
+        for i, model_i in enumerate(self.model_list):
+            if not len(pending):
+                break
+            preds = predict_model(model_i, dataset if len(pending) == num_rows else dataset.select(pending))
+            scores = np.asarray(preds['score'], dtype=np.float32)
+            if i == len(self.model_list) - 1:
+                confident = np.ones(len(pending), dtype=bool)
+            else:
+                confident = scores >= self.thresholds[i]
+            decided = pending[confident]
+            sentiment[decided] = np.asarray(preds['sentiment'], dtype=object)[confident]
+            score[decided] = scores[confident]
+            stage[decided] = model_i['NAME']
+            self.scored[i] += len(pending)
+            self.decided[i] += len(decided)
+            pending = pending[~confident]
+
+        self.rows += num_rows
+        return {'sentiment': sentiment, 'score': score, 'stage': stage}
+
+    def stats(self):
+        '''
+        Returns:
+            dict: the number of 'rows' predicted, the number of examples 'scored' and 'decided' by each stage, and the fraction of the model work saved
+            ('work_saved') compared with running every model over every example.
+        '''
+        total = self.rows * len(self.model_list)
+        return {'rows': self.rows,
+                'stages': {model_i['NAME']: {'scored': scored, 'decided': decided}
+                           for model_i, scored, decided in zip(self.model_list, self.scored, self.decided)},
+                'work_saved': 1 - sum(self.scored) / total if total else 0.0}
+
+
+def threshold_sweep(model_list, dataset, thresholds=None):
+    '''
+    Measures the compute saved and the accuracy lost by a cascade of the models of model_list on a labeled dataset, for each threshold.
+
+    The classifier of each model predicts the whole dataset once and is timed, then the cascade of each threshold (the same threshold for every stage)
+    is computed from these predictions (see deciding_stages()). The cost of a cascade is the time each stage takes per example times the number of examples
+    it scores, and it is compared with the last model run alone over the whole dataset. The prediction and encoding caches are disabled while the sweep is computed.
+
+    Args:
+        model_list (list): the models of the stages, in the order they are run.
+        dataset (datasets.Dataset): a HuggingFace dataset with a Config.COLUMN_LABEL column.
+        thresholds (list): the thresholds swept. Defaults to DEFAULT_SWEEP_THRESHOLDS.
+    Raises:
+        ValueError, if the dataset has no Config.COLUMN_LABEL column.
+    Returns:
+        dict: A dictionary with the accuracy and time per example of each model and, for each threshold, the 'accuracy' and 'accuracy_lost' of the cascade,
+        the fraction of examples decided by each stage and the 'compute_saved'.
+    '''
+    from llm_sentiment.classifier import Classifier
+    from llm_sentiment.dataset_loader import DataSetLoader
+
+    true_labels = DataSetLoader.label_names(dataset)
+    if true_labels is None:
+        raise ValueError(f"The dataset has no '{Config.COLUMN_LABEL}' column, the cascade thresholds cannot be swept.")
+    names = [model_i['NAME'] for model_i in model_list]
+    report = {'models': names, 'rows': len(dataset), 'stages': {}, 'thresholds': []}
+
+    saved_settings = Config.snapshot()
+    Config.override(PREDICTION_CACHE=False, ENCODING_CACHE=False)
+    try:
+        member_preds, seconds_per_row = [], []
+        for model_i in model_list:
+            cl = Classifier(model_i)
+            start = time.perf_counter()
+            member_preds.append(cl.get_sentiment(dataset))
+            seconds_per_row.append((time.perf_counter() - start) / max(1, len(dataset)))
+            cl.close()
+    finally:
+        Config.override(**saved_settings)
+
+    sentiments = np.stack([np.asarray(preds['sentiment'], dtype=object) for preds in member_preds])
+    scores = [np.asarray(preds['score'], dtype=np.float32) for preds in member_preds]
+    for name, model_sentiments, seconds in zip(names, sentiments, seconds_per_row):
+        report['stages'][name] = {'accuracy': float(np.mean(model_sentiments == true_labels)), 'seconds_per_row': seconds}
+
+    reference_accuracy = report['stages'][names[-1]]['accuracy']
+    reference_cost = seconds_per_row[-1] * len(dataset)
+    for threshold in thresholds or DEFAULT_SWEEP_THRESHOLDS:
+        stage = deciding_stages(scores, [threshold] * (len(model_list) - 1))
+        accuracy = float(np.mean(sentiments[stage, np.arange(len(dataset))] == true_labels)) if len(dataset) else 0.0
+        cost = sum(seconds * np.sum(stage >= i) for i, seconds in enumerate(seconds_per_row))
+        report['thresholds'].append({'threshold': threshold,
+                                     'accuracy': accuracy,
+                                     'accuracy_lost': reference_accuracy - accuracy,
+                                     'decided': {name: float(np.mean(stage == i)) if len(dataset) else 0.0 for i, name in enumerate(names)},
+                                     'compute_saved': float(1 - cost / reference_cost) if reference_cost else 0.0})
+    return report
+
+
+def main(argv=None):
+    '''
+    Sweeps the cascade thresholds of the selected models on the first rows of Config.DATASET_NAME, prints the report and saves it as JSON in Config.OUTPUT_DIR.
+    '''
+    from llm_sentiment.api import resolve_models
+    from llm_sentiment.dataset_loader import DataSetLoader
+
+    parser = argparse.ArgumentParser(description='Report the compute saved and the accuracy lost by a model cascade for each threshold on the labeled dataset.')
+    parser.add_argument('--models', nargs='+', default=['Both'], help='the models of the cascade, cheapest first')
+    parser.add_argument('--thresholds', nargs='+', type=float, default=DEFAULT_SWEEP_THRESHOLDS)
+    parser.add_argument('--dataset', default=Config.DATASET_NAME)
+    parser.add_argument('--rows', type=int, help='number of examples used, all of them if not set')
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args(argv)
+
+    dataset = DataSetLoader(args.dataset).dataset_load()
+    if args.rows:
+        dataset = dataset.select(range(min(args.rows, len(dataset))))
+
+    report = threshold_sweep(resolve_models(args.models), dataset, args.thresholds)
+    print(f"\nCascade {' -> '.join(report['models'])} ({report['rows']} rows)")
+    for name, measures in report['stages'].items():
+        print(f"  {name:<20} accuracy={measures['accuracy']:.4f}  ms_per_row={measures['seconds_per_row'] * 1000:.3f}")
+    for measures in report['thresholds']:
+        decided = '  '.join(f'{name}={fraction:.1%}' for name, fraction in measures['decided'].items())
+        print(f"  threshold={measures['threshold']:<5} accuracy={measures['accuracy']:.4f}  accuracy_lost={measures['accuracy_lost']:+.4f}  "
+              f"compute_saved={measures['compute_saved']:.1%}  decided: {decided}")
+
+    output_path = args.output or os.path.join(Config.OUTPUT_DIR, 'cascade_sweep.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nCascade sweep report has been saved at {output_path}.\n')
+
+
+if __name__ == "__main__":
+    main()
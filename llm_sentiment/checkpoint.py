@@ -0,0 +1,238 @@
+# llm_sentiment/checkpoint.py
+
+
+import os
+import json
+import shutil
+import numpy as np
+from llm_sentiment.config import Config
+from llm_sentiment.encoding import text_hash
+from llm_sentiment.precision import model_precision
+from llm_sentiment.backends import model_backend
+from llm_sentiment.cascade import model_threshold
+from llm_sentiment.loading import model_revision
+from llm_sentiment.instrumentation import Instrumentation
+
+
+def prediction_settings(category, model_list):
+    '''
+    Returns the settings the predictions of a run depend on, which a resumed run must share with the interrupted run to reuse or append to its predictions:
+    - the category, and the ID, revision (see loading.model_revision()), labels, precision and backend of each model,
+      where the precision and backend are resolved from Config.PRECISION and Config.BACKEND when the model does not set them
+    - the tokenization (Config.MAX_LENGTH, Config.TRUNCATION), deduplication (Config.DEDUPLICATION, Config.DEDUP_NORMALIZE) and Config.RETURN_PROBABILITIES settings
+    - the confidence threshold of each model but the last one for the 'cascade' category
+    The values are JSON types that compare equal to themselves once saved and loaded.
+
+    Returns:
+        dict: the settings.
+    '''
+    settings = {'category': category,
+                'models': [[model_i['ID'], model_revision(model_i, None), [model_i['ID2LABEL'][k] for k in sorted(model_i['ID2LABEL'])],
+                            model_precision(model_i), model_backend(model_i)] for model_i in model_list],
+                'tokenization': [Config.MAX_LENGTH, Config.TRUNCATION],
+                'deduplication': [Config.DEDUPLICATION, Config.DEDUP_NORMALIZE],
+                'return_probabilities': Config.RETURN_PROBABILITIES}
+    if category == 'cascade':
+        settings['cascade_thresholds'] = [model_threshold(model_i) for model_i in model_list[:-1]]
+    return settings
+
+
+def save_preds(preds, path):
+    '''
+    Saves a dictionary of prediction arrays to path atomically, by writing a temporary file which then replaces path.
+    Object arrays, such as the sentiments, are saved as unicode arrays so that the file can be loaded without pickle.
+    '''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **{k: np.asarray(v).astype(str) if np.asarray(v).dtype == object else np.asarray(v) for k, v in preds.items()})
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_preds(path):
+    '''
+    Returns:
+        dict: the dictionary of prediction arrays saved at path by save_preds(), with the unicode arrays converted back to object arrays.
+    '''
+    with np.load(path, allow_pickle=False) as data:
+        return {k: data[k].astype(object) if data[k].dtype.kind == 'U' else data[k] for k in data.files}
+
+
+def concat_preds(shard_preds):
+    '''
+    Returns:
+        dict: the prediction arrays of consecutive shards concatenated into the prediction arrays of the whole dataset.
+    '''
+    return {k: np.concatenate([preds[k] for preds in shard_preds]) for k in shard_preds[0]}
+
+
+class RunCheckpoint:
+    '''
+    This class makes a WorkFlow run resumable: the dataset is split into shards of Config.CHECKPOINT_SHARD_ROWS examples, and the predictions
+    of each (model, path, shard) are saved as soon as they are made, so that a run interrupted by an OOM kill or a preemption only predicts the missing shards when restarted.
+
+    - The checkpoint directory sits next to the output, in self.directory, and holds a manifest (manifest.json) and one .npz file per (model, path, shard)
+    - The manifest holds the signature of the run (the prediction_settings() of the run, the dataset and the shard size),
+      the hash of the texts of each shard and the completed (model, path, shard) units. A checkpoint with another signature is discarded,
+      and the units of a shard whose texts changed are predicted again
+    - Prediction files and the manifest are written atomically, so a run killed at any point leaves a consistent checkpoint
+    - Once every shard is predicted, the shards are merged into the predictions of the whole dataset
+    '''
+    def __init__(self, category, model_list, dataset_name, output_path, shard_rows=None):
+        '''
+        Initializes the RunCheckpoint class.
+
+        Args:
+            category (str): 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade'.
+            model_list (list): the models of the run.
+            dataset_name (str): the dataset of the run.
+            output_path (str): path of the output of the run, next to which the checkpoint directory is created.
+            shard_rows (int): number of examples per shard. Defaults to Config.CHECKPOINT_SHARD_ROWS.
+        '''
+        self.category = category
+        self.model_list = model_list
+        self.shard_rows = shard_rows or Config.CHECKPOINT_SHARD_ROWS
+        self.directory = output_path.rstrip(os.sep) + '.checkpoint'
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        self.signature = dict(prediction_settings(category, model_list),
+                              dataset=[dataset_name, Config.DATASET_CONFIG, Config.DATASET_SPLIT, Config.COLUMN_TEXT],
+                              shard_rows=self.shard_rows)
+
+    def units(self, paths):
+        '''
+        Returns:
+            list: the names of the (model, path) units predicted for each shard, '<NAME>.<path>', and 'ensemble.combined' for the 'ensemble' category,
+            or only 'cascade.combined' for the 'cascade' category.
+        '''
+        if self.category == 'cascade':
+            return ['cascade.combined']
+        units = [f'{model_i["NAME"]}.{path_name}' for model_i in self.model_list for path_name in paths]
+        if self.category == 'ensemble':
+            units.append('ensemble.combined')
+        return units
+
+    def unit_path(self, unit, shard):
+        '''
+        Returns:
+            str: the path of the predictions of the unit for the shard.
+        '''
+        return os.path.join(self.directory, f'{unit}-{shard:05d}.npz')
+
+    def load_manifest(self, num_rows):
+        '''
+        Returns:
+            dict: the manifest of an interrupted run with the same signature and number of rows, or the manifest of a new run,
+            with the 'signature', the 'rows', the text hash of each shard in 'shards' and the list of 'completed' units ('<unit>/<shard>').
+        '''
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('signature') == self.signature and manifest.get('rows') == num_rows:
+                return manifest
+            shutil.rmtree(self.directory)
+        return {'signature': self.signature, 'rows': num_rows, 'shards': {}, 'completed': []}
+
+    def save_manifest(self, manifest):
+        '''
+        Saves the manifest atomically by writing it to a temporary file which then replaces self.manifest_path.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def predict(self, predictor_obj):
+        '''
+        Predicts the dataset of a Prediction object shard-by-shard, skipping the units already completed by an interrupted run,
+        and sets the predictions of the whole dataset to the Prediction object as its predict() would.
+
+        Args:
+            predictor_obj (Prediction): the Prediction object of the run, whose dataset is the whole dataset.
+        Returns:
+            list: the predictions of each model in self.model_list, as returned by Prediction.predict().
+        '''
+        dataset = predictor_obj.dataset
+        paths = predictor_obj.paths()
+        units = self.units(paths)
+        manifest = self.load_manifest(len(dataset))
+        completed = set(manifest['completed'])
+        num_shards = max(1, -(-len(dataset) // self.shard_rows))
+        resumed = 0
+
+        try:
+            for shard in range(num_shards):
+                shard_dataset = dataset.select(range(shard * self.shard_rows, min((shard + 1) * self.shard_rows, len(dataset))))
+                shard_hash = text_hash(shard_dataset)
+                if manifest['shards'].get(str(shard)) != shard_hash:
+                    completed = {done for done in completed if not done.endswith(f'/{shard}')}
+                    manifest['shards'][str(shard)] = shard_hash
+                missing = [unit for unit in units if f'{unit}/{shard}' not in completed or not os.path.exists(self.unit_path(unit, shard))]
+                if not missing:
+                    resumed += 1
+                    continue
+
+                predictor_obj.dataset = shard_dataset
+                dedup = predictor_obj.deduplicate()
+                if self.category == 'ensemble':
+                    shard_preds = dict(zip(units, predictor_obj.predict_ensemble() + [predictor_obj.ensemble_preds]))
+                elif self.category == 'cascade':
+                    predictor_obj.predict_cascade()
+                    shard_preds = {'cascade.combined': predictor_obj.cascade_preds}
+                else:
+                    shard_preds = {}
+                    for model_i in self.model_list:
+                        for path_name in paths:
+                            unit = f'{model_i["NAME"]}.{path_name}'
+                            if unit in missing:
+                                shard_preds[unit] = predictor_obj.predict_path(model_i, path_name)
+
+                if dedup is not None:
+                    shard_preds = {unit: dedup.expand(preds) for unit, preds in shard_preds.items()}
+
+                with Instrumentation.stage('checkpoint'):
+                    os.makedirs(self.directory, exist_ok=True)
+                    for unit, preds in shard_preds.items():
+                        save_preds(preds, self.unit_path(unit, shard))
+                        completed.add(f'{unit}/{shard}')
+                    manifest['completed'] = sorted(completed)
+                    self.save_manifest(manifest)
+                print(f'Shard {shard + 1}/{num_shards} has been checkpointed ({len(shard_preds)} of {len(units)} predictions made).')
+        finally:
+            predictor_obj.dataset = dataset
+
+        if resumed:
+            print(f'{resumed} of {num_shards} shards have been resumed from the checkpoint at {self.directory}.')
+        return self.merge(predictor_obj, paths, units, num_shards)
+
+    def merge(self, predictor_obj, paths, units, num_shards):
+        '''
+        Loads the predictions of all shards and sets their concatenation to the pred_both (and ensemble_preds or cascade_preds) of the Prediction object.
+
+        Returns:
+            list: the predictions of each model in self.model_list, as returned by Prediction.predict().
+        '''
+        with Instrumentation.stage('checkpoint'):
+            merged = {unit: concat_preds([load_preds(self.unit_path(unit, shard)) for shard in range(num_shards)]) for unit in units}
+
+        pred_both = []
+        if self.category == 'cascade':
+            predictor_obj.cascade_preds = merged['cascade.combined']
+            predictor_obj.pred_both = pred_both
+            return pred_both
+        for model_i in self.model_list:
+            preds = [merged[f'{model_i["NAME"]}.{path_name}'] for path_name in paths]
+            pred_both.append(preds if len(paths) > 1 else preds[0])
+        if self.category == 'ensemble':
+            predictor_obj.ensemble_preds = merged['ensemble.combined']
+        predictor_obj.pred_both = pred_both
+        return pred_both
+
+    def clear(self):
+        '''
+        Removes the checkpoint directory, once the output of the run has been saved.
+        '''
+        shutil.rmtree(self.directory, ignore_errors=True)
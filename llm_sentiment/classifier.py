@@ -1,10 +1,14 @@
 # llm_sentiment/classifier.py
 
 
+import numpy as np
 import torch
-from torch.utils.data import DataLoader
 from llm_sentiment.config import Config
+from llm_sentiment.batching import LengthBatcher, model_max_batch_tokens
+from llm_sentiment.cache import PredictionCache
 from llm_sentiment.pre_process import PreProcess
+from llm_sentiment.backends import load_backend
+from llm_sentiment.instrumentation import Instrumentation
 
 class Classifier:
     
@@ -16,104 +20,161 @@ class Classifier:
         An instance of PreProcess is created by passing self.model_choice as input.
         The classifier model is assigned from the model attribute of the ModelManage object retrieved from the PreProcess instance.
         The classifier tokenizer is assigned from the model attribute of the ModelManage object retrieved from the PreProcess instance.
-        If GPU is available the self.device is set to GPU if not, it will use CPU.
-        The model is carried to self.device
+        The self.backend runs the forward passes: the eager model of the ModelRegistry, or its TorchScript or ONNX graph (see backends.load_backend()).
+        The self.device is the device the backend runs on, GPU if it is available and CPU if not, if the model runs in 'int8' precision or if the backend is 'onnx'.
+        If Config.PREDICTION_CACHE is True, a PredictionCache of the classifier predictions is created as self.cache.
         '''
         self.model_choice = model_choice
         self.preprocess_inst = PreProcess(self.model_choice)
         self.model_manage = self.preprocess_inst.model_manage
         self.tokenizer = self.model_manage.tokenizer
         self.model = self.model_manage.model
-        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        self.model = self.model.to(self.device)
+        self.backend = load_backend(self.model_choice, self.model, self.model_manage.device)
+        self.device = self.backend.device
+        self.cache = PredictionCache(self.model_choice, 'classifier', self.model.config) if Config.PREDICTION_CACHE else None
 
-    def inference(self, encoded_dataset):
+    def inference(self, encoding, return_probabilities=None):
         '''
         Performs model inference by passing encoded input data as input and obtaining predictions as output
         
-        - Formats the encoded_dataset by converting to pytorch and keeping only specified columns, 'input_ids' and 'attention_mask'.
-        - Loads a pytorch DataLoader object, enabling to run inference batch-by-batch
+        - Groups the examples of encoding into batches of similar token length with at most MAX_BATCH_TOKENS padded tokens each (see batching.model_max_batch_tokens())
+        - Preallocates the arrays holding the predicted label ids, scores and, if return_probabilities is True, probabilities of all examples
         - Disables gradient calculation while running inference within the loop
-        - Carries the each batch of data to self.device
-        - Passes 'input_ids' (containing encoded inputs) ans 'attention_mask' as inputs to the self.model
-        - Obtains the logits of the model outputs
+        - Pads each batch to its longest example, obtaining its 'input_ids' and 'attention_mask' tensors, and carries them to self.device
+        - Passes 'input_ids' (containing encoded inputs) ans 'attention_mask' as inputs to the self.backend, which returns the logits
         - Applies Softmax on last column to obtain probabilities
         - Obtains the maximum probabilities saved as pred_scores and label ids with maximum probability as pred_labels
         - Detaches the tensor from computation graph and carries outputs back to CPU 
-        - Repeat these steps for all batches of data, attaches predicted label ids to all_pred_labels and their scores to all_pred_scores lists
+        - Repeat these steps for all batches of data, scattering the outputs of each batch into the arrays at the original positions of its examples
+        - Each step of each batch is timed as a stage of the Instrumentation ('collate', 'host_to_device', 'forward', 'softmax_argmax', 'device_to_host') if it is enabled
         
         Args:
-            encoded_dataset (dict): A dictionary containing encoded tensors for the dataset with 'sentence', 'label', 'input_ids', 'attention_mask' keys.
+            encoding (RaggedEncoding): the token ids and token lengths of the examples of the dataset, returned by PreProcess.encoding().
+            return_probabilities (bool): if True the probabilities of all labels are returned too. Defaults to Config.RETURN_PROBABILITIES.
         Returns:
-            tuple: A tuple containing of:
-                1. A list of predicted label ids for all examples
-                2. A list of predicted scores associated with the predicted label ids for all examples
+            dict: A dictionary of arrays with one entry per example, containing:
+                - 'label_ids': predicted label ids
+                - 'score': predicted scores associated with the predicted label ids
+                - 'probabilities': probabilities of all labels, only if return_probabilities is True
         '''
-        encoded_dataset.set_format("torch", columns=['input_ids', 'attention_mask'])
-        dataloader = DataLoader(encoded_dataset, batch_size=Config.BATCH_SIZE, shuffle=False)
+        if return_probabilities is None:
+            return_probabilities = Config.RETURN_PROBABILITIES
+        batches = LengthBatcher(encoding.lengths, model_max_batch_tokens(self.model_choice)).batches
+        pad_token_id = self.tokenizer.pad_token_id or 0
 
-        all_pred_labels = []
-        all_pred_scores = []
+        num_examples = len(encoding)
+        all_preds = {'label_ids': np.empty(num_examples, dtype=np.int64),
+                     'score': np.empty(num_examples, dtype=np.float32)}
+        if return_probabilities:
+            all_preds['probabilities'] = np.empty((num_examples, self.model.config.num_labels), dtype=np.float32)
 
         with torch.no_grad():
-            for batch in dataloader:
+            for batch_indices in batches:
 
-                batch = {k: v.to(self.device) for k, v in batch.items()}
-                output = self.model(input_ids=batch['input_ids'], attention_mask=batch['attention_mask'])
-                output_logits= output.logits
+                with Instrumentation.stage('collate'):
+                    input_ids, attention_mask = encoding.collate(batch_indices, pad_token_id)
+                with Instrumentation.stage('host_to_device', self.device):
+                    batch = {'input_ids': input_ids.to(self.device), 'attention_mask': attention_mask.to(self.device)}
+                with Instrumentation.stage('forward', self.device):
+                    output_logits = self.backend(batch['input_ids'], batch['attention_mask'])
 
-    
-                pred_scores, pred_labels = torch.max(torch.softmax(output_logits, dim=-1), dim=-1)
-                pred_labels = pred_labels.detach().cpu()
-                pred_scores = pred_scores.detach().cpu()   
+                with Instrumentation.stage('softmax_argmax', self.device):
+                    probabilities = torch.softmax(output_logits.float(), dim=-1)
+                    pred_scores, pred_labels = torch.max(probabilities, dim=-1)
+
+                with Instrumentation.stage('device_to_host', self.device):
+                    all_preds['label_ids'][batch_indices] = pred_labels.detach().cpu().numpy()
+                    all_preds['score'][batch_indices] = pred_scores.detach().cpu().numpy()
+                    if return_probabilities:
+                        all_preds['probabilities'][batch_indices] = probabilities.detach().cpu().numpy()
 
-                all_pred_labels.extend(pred_labels)
-                all_pred_scores.extend(pred_scores)
+                Instrumentation.count('batches')
+                Instrumentation.count('examples', len(batch_indices))
+                Instrumentation.count('padded_tokens', input_ids.numel())
 
-        return all_pred_labels, all_pred_scores
+        return all_preds
+
+    def id2label_array(self):
+        '''
+        Returns:
+            np.ndarray: An array of the class labels of the model, indexed by label id.
+        '''
+        id2label = self.model.config.id2label
+        return np.array([id2label[i] for i in range(len(id2label))], dtype=object)
                             
     def get_label(self, all_preds):
         '''  
         - Customizes the model configuration by applying re_label() method on the ModelManage instance retrieved from PreProcess instance.
-        - loops over the all_pred_labels and all_pred_score lists together
-        - obtains the label id's and score's values from the tensor
-        - obtains the appropriate class label associated with the label id
-        - appends tuple of results (labels, scores) to all_preds_relabelled
+        - Maps all predicted label ids to their class labels at once by taking them from the id2label array of the model
+        - Adds the class labels to all_preds under the 'sentiment' key
         
         Args:
-            all_preds (tuple): A  tuple containing:
-                1. A list of predicted label ids for all examples
-                2. A list of predicted scores associated with the predicted label ids for all examples
+            all_preds (dict): A dictionary of arrays returned by self.inference(), with 'label_ids' and 'score' keys.
         Returns:
-            list: A list containing tuples associated with each example that includes:
-                1. Predicted label class
-                2. Predicted score associated with the predicted label class                   
+            dict: The all_preds dictionary of arrays with one entry per example, containing:
+                - 'sentiment': predicted label classes
+                - 'score': predicted scores associated with the predicted label classes
+                - 'label_ids': predicted label ids
+                - 'probabilities': probabilities of all labels, only if Config.RETURN_PROBABILITIES is True
         '''
-        self.model_manage.re_label()
-        all_pred_labels, all_pred_scores = all_preds
-        
-        all_preds_relabelled = []
-        for label, score in zip(all_pred_labels, all_pred_scores):
-            all_preds_relabelled.append([self.model.config.id2label[label.item()], score.item()])
+        with Instrumentation.stage('relabel'):
+            self.model_manage.re_label()
+            all_preds['sentiment'] = np.take(self.id2label_array(), all_preds['label_ids'])
             
-        return all_preds_relabelled
+        return all_preds
 
-    def get_sentiment(self, dataset):
+    def compute_sentiment(self, dataset):
         '''
         - Tokenizes the dataset by applying encoding() method on PreProcess object and saves them to encoded_inputs
         - Passes the encoded_inputs as input to self.inference() method to perform inference and saves the predictions to all_preds
         - Obtains the label class and score for each example by self.get_label() and saves results to all_preds_relabelled
+        - If Config.OVERLAP_PIPELINE is True, these steps run concurrently on successive blocks of the dataset instead (see OverlappedInference),
+          and the encoding cache is not used since the encoding of the whole dataset is never held at once
         
         Args:
             dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
         Returns:
-            list: A list containing tuples associated with each example that includes:
-                1. Predicted label class
-                2. Predicted score associated with the predicted label class 
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids' (see self.get_label()).
         '''
+        if Config.OVERLAP_PIPELINE:
+            from llm_sentiment.overlap import OverlappedInference
+            return OverlappedInference(self).run(dataset)
+
         encoded_inputs = self.preprocess_inst.encoding(dataset)        
         all_preds = self.inference(encoded_inputs)
         all_preds_relabelled = self.get_label(all_preds)
         
         return all_preds_relabelled
-   
\ No newline at end of file
+
+    def predict_texts(self, texts, return_probabilities=None):
+        '''
+        Predicts the sentiment of a list of texts, tokenized directly (see PreProcess.text_encoding()) instead of through a dataset.
+        Neither the encoding cache nor the prediction cache is used, so that a small batch costs little more than its forward passes.
+
+        Args:
+            texts (list): the texts to be predicted.
+            return_probabilities (bool): if True the probabilities of all labels are returned too. Defaults to Config.RETURN_PROBABILITIES.
+        Returns:
+            dict: A dictionary of arrays with one entry per text, containing the predicted 'sentiment', 'score' and 'label_ids' (see self.get_label()).
+        '''
+        return self.get_label(self.inference(self.preprocess_inst.text_encoding(texts), return_probabilities))
+
+    def get_sentiment(self, dataset):
+        '''
+        Predicts the sentiment of each example of the dataset with self.compute_sentiment().
+        If self.cache is set, only the examples whose predictions are not found in the cache are passed to self.compute_sentiment().
+        
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids' (see self.get_label()).
+        '''
+        if self.cache is not None:
+            return self.cache.get_sentiment(dataset, self.compute_sentiment)
+        return self.compute_sentiment(dataset)
+
+    def close(self):
+        '''
+        Releases the model held by the classifier in the shared ModelRegistry.
+        '''
+        self.model_manage.release()
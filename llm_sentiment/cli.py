@@ -0,0 +1,158 @@
+# llm_sentiment/cli.py
+
+
+import json
+import argparse
+from llm_sentiment.config import Config, PRECISIONS, BACKENDS, OUTPUT_FORMATS
+from llm_sentiment.api import CATEGORIES, DATAFRAME_TYPES, run_jobs
+
+
+# command line options mapped to the Config settings they override
+SETTING_OPTIONS = {'dataset_config': 'DATASET_CONFIG',
+                   'dataset_split': 'DATASET_SPLIT',
+                   'dataset_format': 'DATASET_FORMAT',
+                   'text_column': 'COLUMN_TEXT',
+                   'output_format': 'OUTPUT_FORMAT',
+                   'partition_rows': 'OUTPUT_PARTITION_ROWS',
+                   'batch_size': 'BATCH_SIZE',
+                   'tokenize_batch_size': 'TOKENIZE_BATCH_SIZE',
+                   'max_batch_tokens': 'MAX_BATCH_TOKENS',
+                   'autotune': 'AUTOTUNE',
+                   'max_length': 'MAX_LENGTH',
+                   'workers': 'NUM_WORKERS',
+                   'worker_threads': 'WORKER_THREADS',
+                   'model_bundles': 'MODEL_BUNDLES',
+                   'precision': 'PRECISION',
+                   'backend': 'BACKEND',
+                   'cache_dir': 'CACHE_DIR',
+                   'prediction_cache': 'PREDICTION_CACHE',
+                   'encoding_cache': 'ENCODING_CACHE',
+                   'streaming': 'STREAMING',
+                   'chunk_size': 'STREAMING_CHUNK_SIZE',
+                   'dedup': 'DEDUPLICATION',
+                   'dedup_normalize': 'DEDUP_NORMALIZE',
+                   'checkpoint': 'CHECKPOINT',
+                   'shard_rows': 'CHECKPOINT_SHARD_ROWS',
+                   'overlap': 'OVERLAP_PIPELINE',
+                   'tokenize_threads': 'OVERLAP_TOKENIZE_THREADS',
+                   'concurrent_models': 'CONCURRENT_MODELS',
+                   'cascade_threshold': 'CASCADE_THRESHOLD',
+                   'evaluate': 'EVALUATION',
+                   'instrument': 'INSTRUMENTATION',
+                   'profile': 'PROFILER'}
+
+
+def parse_setting(assignment):
+    '''
+    Parses a KEY=VALUE assignment of a Config setting, where VALUE is read as JSON when possible and as a string otherwise.
+
+    Returns:
+        tuple: the setting name and its value.
+    '''
+    key, sep, value = assignment.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Invalid setting '{assignment}', expected KEY=VALUE.")
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return key.strip().upper(), value
+
+
+def build_parser():
+    '''
+    Returns:
+        argparse.ArgumentParser: the parser of the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(description='Run sentiment analysis jobs without prompts.')
+    parser.add_argument('--config', help='JSON file with the settings and a "jobs" list, each job with the same keys as the options below')
+    parser.add_argument('--category', choices=CATEGORIES)
+    parser.add_argument('--models', nargs='+', help=f"models to be used: {Config.MODEL_1['NAME']}, {Config.MODEL_2['NAME']} or Both")
+    parser.add_argument('--dataset', dest='dataset_name', help='dataset to be loaded from the Hub, or path of a local file')
+    parser.add_argument('--dataset-config')
+    parser.add_argument('--dataset-split')
+    parser.add_argument('--dataset-format', choices=['csv', 'jsonl', 'parquet', 'arrow', 'disk'], help='format of a local dataset, inferred from the path if not set')
+    parser.add_argument('--text-column')
+    parser.add_argument('--dataframe-type', choices=DATAFRAME_TYPES)
+    parser.add_argument('--output', dest='output_path', help='path of the output dataset')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS)
+    parser.add_argument('--partition-rows', type=int, help='split the output into files of at most this number of rows')
+    parser.add_argument('--batch-size', type=int, help='pipeline batch size, unless a model sets its own "BATCH_SIZE" or is autotuned')
+    parser.add_argument('--tokenize-batch-size', type=int, help='number of examples tokenized at a time by the classifier')
+    parser.add_argument('--max-batch-tokens', type=int, help='maximum number of padded tokens per classifier batch')
+    parser.add_argument('--autotune', action='store_true', default=None, help='use the tuned batch settings and thread count of each model, tuning them first if needed')
+    parser.add_argument('--max-length', type=int)
+    parser.add_argument('--workers', type=int, help='number of classifier worker processes')
+    parser.add_argument('--worker-threads', type=int, help='number of torch threads per worker process')
+    parser.add_argument('--model-bundles', action='store_true', default=None, help='load the models from memory-mapped local safetensors bundles, shared by the worker processes')
+    parser.add_argument('--precision', choices=PRECISIONS, help='precision the models are run in')
+    parser.add_argument('--backend', choices=BACKENDS, help='classifier inference backend')
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--prediction-cache', action='store_true', default=None, help='reuse the predictions of texts scored in previous runs')
+    parser.add_argument('--encoding-cache', action='store_true', default=None, help='reuse the token ids of datasets tokenized in previous runs')
+    parser.add_argument('--chunk-size', type=int, help='number of examples per chunk in streaming mode')
+    parser.add_argument('--streaming', action='store_true', default=None)
+    parser.add_argument('--dedup', action='store_true', default=None, help='only predict the unique texts of the dataset')
+    parser.add_argument('--dedup-normalize', action='store_true', default=None, help='treat texts differing only by whitespace or case as duplicates')
+    parser.add_argument('--checkpoint', action='store_true', default=None, help='checkpoint the predictions shard-by-shard and resume interrupted runs')
+    parser.add_argument('--shard-rows', type=int, help='number of examples per checkpointed shard')
+    parser.add_argument('--overlap', action='store_true', default=None, help='overlap tokenization, inference, post-processing and writing')
+    parser.add_argument('--tokenize-threads', type=int, help='number of tokenizer threads of the overlapped pipeline')
+    parser.add_argument('--concurrent-models', action='store_true', default=None)
+    parser.add_argument('--cascade-threshold', type=float, help="minimum score a model of the 'cascade' category must reach to decide an example")
+    parser.add_argument('--evaluate', action='store_true', default=None, help='evaluate the predictions against the label column and save a report')
+    parser.add_argument('--instrument', action='store_true', default=None, help='time the workflow stages and export a report')
+    parser.add_argument('--profile', choices=['torch', 'cprofile'], help='profile the runs and save their traces')
+    parser.add_argument('--no-cache', action='store_true', help='disable the prediction and encoding caches')
+    parser.add_argument('--set', dest='settings', action='append', type=parse_setting, default=[], metavar='KEY=VALUE',
+                        help='override any Config setting, e.g. --set DECIMAL_PLACE=3 (can be repeated)')
+    return parser
+
+
+def build_jobs(args):
+    '''
+    Builds the list of jobs and their shared settings from the parsed arguments.
+
+    The jobs of the --config file are used if it is given, otherwise a single job is built from the options.
+    Options given on the command line override the corresponding values of every job of the --config file.
+
+    Raises:
+        ValueError, if no job can be built.
+    Returns:
+        tuple: A tuple containing the list of jobs and the dictionary of settings shared by the jobs.
+    '''
+    file_config = {}
+    if args.config:
+        with open(args.config) as f:
+            file_config = json.load(f)
+
+    settings = {k.upper(): v for k, v in file_config.get('settings', {}).items()}
+    settings.update({setting: getattr(args, option) for option, setting in SETTING_OPTIONS.items() if getattr(args, option) is not None})
+    settings.update(dict(args.settings))
+    if args.no_cache:
+        settings.update(PREDICTION_CACHE=False, ENCODING_CACHE=False)
+
+    job_options = {k: getattr(args, k) for k in ('category', 'models', 'dataset_name', 'dataframe_type', 'output_path') if getattr(args, k) is not None}
+    jobs = [dict(job, **job_options) for job in file_config.get('jobs', [])] or [job_options]
+
+    for job in jobs:
+        if 'category' not in job or 'models' not in job:
+            raise ValueError('Each job needs a category and models, given with --category and --models or in the --config file.')
+    return jobs, settings
+
+
+def main(argv=None):
+    '''
+    Parses the command line arguments and runs the jobs they describe in the same process.
+    '''
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        jobs, settings = build_jobs(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return run_jobs(jobs, **settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,38 +2,205 @@
 
 
 import os
+import json
+from dataclasses import dataclass, field, fields
+from typing import Optional
 
-class Config:
-    
+
+PRECISIONS = ['fp32', 'bf16', 'int8']  # allowed values of PRECISION
+BACKENDS = ['eager', 'torchscript', 'onnx']  # allowed values of BACKEND
+OUTPUT_FORMATS = ['csv', 'jsonl', 'parquet', 'arrow']  # allowed values of OUTPUT_FORMAT
+ENV_PREFIX = 'LLM_SENTIMENT_'  # prefix of the environment variables overriding the settings, e.g. LLM_SENTIMENT_BATCH_SIZE=32
+# settings derived from another setting when they are None: name -> (setting it is derived from, path within it)
+DERIVED_PATHS = {'OUTPUT_DIR': ('BASE_DIR', 'output'),
+                 'OUTPUT_DATASET_PATH': ('OUTPUT_DIR', 'output_dataset.csv'),
+                 'CACHE_DIR': ('BASE_DIR', 'cache'),
+                 'INSTRUMENTATION_DIR': ('OUTPUT_DIR', 'instrumentation')}
+
+
+def parse_value(value):
+    '''
+    Returns:
+        The value of a setting given as a string, read as JSON when possible and as a string otherwise.
+    '''
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+@dataclass
+class Settings:
+    '''
+    This class holds the settings of the package. Creating an instance has no side effect: the directories are only created when they are first written to.
+
+    The shared instance is Config, created by Settings.from_env() when the package is imported, whose settings are then read and overridden as Config.<SETTING>.
+    Other instances can be created with their own values, e.g. Settings(BATCH_SIZE=32), Settings.from_env() or Settings.from_file('settings.json').
+
+    The directories of DERIVED_PATHS left to None are derived from the base directory each time they are read, so that they follow BASE_DIR when it is overridden.
+    '''
 #     MODEL_MAX_LENGTH = 512  # maximum number of tokens for the model input. Use this if MAX_LENGTH is not working properly.
-    MAX_LENGTH = 512  # maximum number of output tokens
-    TASK = "sentiment-analysis"  # task performed by LLM model. (alias "text-classification")  
-    DEVICE_MAP = "auto"  # select appropriate available devices when using pipeline
-    TRUNCATION = True  # if True truncate the input to a maximum length specified by the max_length argument or the model_max_length if no max_length is provided 
-    PADDING = True # if True pads inputs to the longest sequence in the batch.
-    
-    DATASET_NAME = "takala/financial_phrasebank" # dataset name to be loaded from Hugging Face Hub
-    DATASET_SPLIT = 'train' # split of the dataset to be loaded
-    DATASET_CONFIG = "sentences_allagree" # dataset configuration to be used
-    COLUMN_TEXT = "sentence" # dataset column that contains the text to be used for the specified task
-    COLUMN_LABEL = "label" # dataset column that contains the ground truth label associated with the specified task
-
-    BATCH_SIZE = 10 # controls the batch size which is the number of examples to be processed at the same time
-    DECIMAL_PLACE = 2 # number of decimal places for rounding prediction scores displayed in DataFrame
-    
-    MODEL_1 = {"ID": "finiteautomata/bertweet-base-sentiment-analysis",
-               "NAME": "BERTweet",
-               "LABEL2ID": {'negative': 0, 'neutral': 1, 'positive': 2},
-               "ID2LABEL": {0: 'negative', 1: 'neutral', 2: 'positive'}}
-    # a dictionary containing the necessary information related to the first model   
-       
-    MODEL_2 = {"ID": "cardiffnlp/twitter-roberta-base-sentiment",
-               "NAME": "TwitterRoBERTa",
-               "LABEL2ID": {'negative': 0, 'neutral': 1, 'positive': 2},
-               "ID2LABEL": {0: 'negative', 1: 'neutral', 2: 'positive'}}
+    MAX_LENGTH: int = 512  # maximum number of output tokens
+    TASK: str = "sentiment-analysis"  # task performed by LLM model. (alias "text-classification")
+    DEVICE_MAP: str = "auto"  # select appropriate available devices when using pipeline
+    TRUNCATION: bool = True  # if True truncate the input to a maximum length specified by the max_length argument or the model_max_length if no max_length is provided
+    PADDING: bool = True # if True pads inputs to the longest sequence in the batch.
+
+    DATASET_NAME: str = "takala/financial_phrasebank" # dataset name to be loaded from Hugging Face Hub
+    DATASET_SPLIT: str = 'train' # split of the dataset to be loaded
+    DATASET_CONFIG: str = "sentences_allagree" # dataset configuration to be used
+    DATASET_FORMAT: Optional[str] = None # format of a local dataset file: "csv", "jsonl", "parquet", "arrow" or "disk" (save_to_disk directory). If None it is inferred from the path
+    COLUMN_TEXT: str = "sentence" # dataset column that contains the text to be used for the specified task
+    COLUMN_LABEL: str = "label" # dataset column that contains the ground truth label associated with the specified task
+
+    BATCH_SIZE: int = 10 # controls the batch size which is the number of examples to be processed at the same time
+    TOKENIZE_BATCH_SIZE: int = 1000 # number of examples tokenized at a time by the classifier
+    TOKENIZE_NUM_PROC: Optional[int] = None # number of processes used to tokenize with slow tokenizers. If None, 4 (at most the number of CPU cores). Fast tokenizers use parallel threads instead
+    STREAMING: bool = False # if True the dataset is streamed, predicted and exported chunk-by-chunk instead of being loaded in memory at once
+    STREAMING_CHUNK_SIZE: int = 10000 # number of examples read, predicted and exported at a time in streaming mode
+    DEDUPLICATION: bool = False # if True only the unique texts of the dataset are predicted, and their predictions are copied to the duplicate rows
+    DEDUP_NORMALIZE: bool = False # if True texts differing only by whitespace or case are duplicates
+    CHECKPOINT: bool = False # if True the predictions of each shard are saved as soon as they are made, so that an interrupted run only predicts the missing shards when restarted
+    CHECKPOINT_SHARD_ROWS: int = 50000 # number of examples per checkpointed shard
+    OVERLAP_PIPELINE: bool = False # if True the tokenization, collation, inference and post-processing of the classifier run concurrently on successive blocks of the dataset, and streaming chunks are written while the next chunk is predicted
+    OVERLAP_TOKENIZE_THREADS: Optional[int] = None # number of tokenizer threads of the overlapped pipeline. If None, 4 (at most the number of CPU cores)
+    OVERLAP_QUEUE_SIZE: int = 4 # maximum number of blocks, batches or chunks waiting between two stages of the overlapped pipeline
+    MAX_BATCH_TOKENS: int = 4096 # maximum number of padded tokens (examples x longest example) in a classifier inference batch
+    AUTOTUNE: bool = False # if True the batch size or token budget and the torch thread count of each model are taken from its tuned profile for this host, tuned on the dataset of the first run if there is none
+    AUTOTUNE_ROWS: int = 256 # number of examples of the autotuner calibration passes
+    NUM_WORKERS: int = 1 # number of worker processes the classifier inference is sharded across. If 1, inference runs in the main process
+    WORKER_THREADS: Optional[int] = None # number of torch intra-op threads of each worker process. If None, the CPU cores are split evenly between the workers
+    MP_START_METHOD: str = "spawn" # multiprocessing start method of the worker processes
+    MODEL_BUNDLES: bool = False # if True models and tokenizers are loaded from a local safetensors bundle in CACHE_DIR, converted on first use, whose fp32 weights are memory-mapped and shared by the worker processes
+    CONCURRENT_MODELS: bool = False # if True the models in the model list are run concurrently instead of one after the other
+    CASCADE_THRESHOLD: float = 0.9 # minimum score a model of the 'cascade' category must reach to decide an example, otherwise the example goes on to the next model. Can be set per model with a "CASCADE_THRESHOLD" key
+    DECIMAL_PLACE: int = 2 # number of decimal places for rounding prediction scores displayed in DataFrame
+    COMPACT_DATAFRAME: bool = False # if True the output DataFrame has float32 scores and categorical sentiments instead of float64 and object columns
+    RETURN_PROBABILITIES: bool = False # if True the classifier also returns the probabilities of all labels for each example
+    EVALUATION: bool = False # if True the predictions are evaluated against the COLUMN_LABEL column once they are made (chunk-by-chunk in streaming mode), and an evaluation report is saved next to the output
+    EVALUATION_BINS: int = 15 # number of confidence bins of the expected calibration error (ECE)
+
+    SERVER_HOST: str = "127.0.0.1"  # host the inference server listens on
+    SERVER_PORT: int = 8000  # port the inference server listens on
+    SERVER_MAX_BATCH_SIZE: int = 64  # maximum number of texts the inference server coalesces into a micro-batch
+    SERVER_MAX_WAIT_MS: int = 10  # maximum time in milliseconds a request waits for its micro-batch to fill
+
+    PRECISION: str = "fp32"  # precision the models are run in: "fp32", "bf16" or "int8" (dynamic int8 quantization of the Linear layers, CPU only). Can be set per model with a "PRECISION" key
+    BACKEND: str = "eager"  # classifier inference backend: "eager", "torchscript" or "onnx" (ONNX Runtime CPU). Can be set per model with a "BACKEND" key
+    BACKEND_TOLERANCE: float = 1e-3  # maximum absolute difference of the logits of an exported backend with the eager model
+    MODEL_REGISTRY_SIZE: int = 2  # maximum number of unused models kept loaded in the shared model registry
+    MODEL_REGISTRY_MAX_BYTES: Optional[int] = None  # optional maximum number of bytes taken by the unused models kept in the shared model registry
+
+    MODEL_1: dict = field(default_factory=lambda: {"ID": "finiteautomata/bertweet-base-sentiment-analysis",
+                                                   "NAME": "BERTweet",
+                                                   "LABEL2ID": {'negative': 0, 'neutral': 1, 'positive': 2},
+                                                   "ID2LABEL": {0: 'negative', 1: 'neutral', 2: 'positive'}})
+    # a dictionary containing the necessary information related to the first model
+
+    MODEL_2: dict = field(default_factory=lambda: {"ID": "cardiffnlp/twitter-roberta-base-sentiment",
+                                                   "NAME": "TwitterRoBERTa",
+                                                   "LABEL2ID": {'negative': 0, 'neutral': 1, 'positive': 2},
+                                                   "ID2LABEL": {0: 'negative', 1: 'neutral', 2: 'positive'}})
     # a dictionary containing the necessary information related to the second model
 
-    BASE_DIR = os.getcwd()  # base directory
-    OUTPUT_DIR = os.path.join(BASE_DIR, 'output')  # output directory within base directory
-    os.makedirs(OUTPUT_DIR, exist_ok=True)  # create a output directory if does not exist within data directory
-    OUTPUT_DATASET_PATH =  os.path.join(OUTPUT_DIR,'output_dataset.csv')  # path to the final output dataset containing the generated summaries
\ No newline at end of file
+    BASE_DIR: str = field(default_factory=os.getcwd)  # base directory
+    OUTPUT_DIR: Optional[str] = None  # output directory, 'output' within the base directory if None. Created when the output is saved
+    OUTPUT_DATASET_PATH: Optional[str] = None  # path to the final output dataset containing the generated summaries, 'output_dataset.csv' within the output directory if None
+    OUTPUT_FORMAT: str = "csv"  # format of the output dataset, "csv", "jsonl", "parquet" or "arrow"
+    OUTPUT_PARTITION_ROWS: Optional[int] = None  # if set, the output dataset is a directory of files holding at most this number of rows each
+    PARQUET_COMPRESSION: str = "zstd"  # compression codec of the Parquet output files
+    CACHE_DIR: Optional[str] = None  # directory of the persistent caches, 'cache' within the base directory if None. Created when first needed
+
+    ENCODING_CACHE: bool = False  # if True the token ids of the datasets are cached on disk, keyed by the tokenizer fingerprint and the hash of the texts
+    ENCODING_CACHE_MAX_BYTES: int = 2000000000  # maximum number of bytes of the encoding cache files, the least recently used are evicted first
+    PREDICTION_CACHE: bool = False  # if True the predictions are cached on disk and only texts not scored in previous runs are sent to the models
+    PREDICTION_CACHE_MAX_ENTRIES: int = 1000000  # maximum number of predictions kept in the prediction cache, the least recently used are evicted first
+
+    INSTRUMENTATION: bool = False  # if True the workflow stages are timed and counted, and a report is exported after each run
+    PROFILER: Optional[str] = None  # profiler the workflow runs are run under: None, "torch" (torch.profiler Chrome trace) or "cprofile"
+    INSTRUMENTATION_DIR: Optional[str] = None  # directory of the instrumentation reports and profiler traces, 'instrumentation' within the output directory if None
+
+    def __post_init__(self):
+        '''
+        Converts the label ids of the models to integers, since the keys of the "ID2LABEL" dictionaries are strings when they are read from JSON.
+        '''
+        for model_choice in (self.MODEL_1, self.MODEL_2):
+            model_choice['ID2LABEL'] = {int(k): v for k, v in model_choice['ID2LABEL'].items()}
+
+    @classmethod
+    def from_env(cls, environ=None, **settings):
+        '''
+        Creates the settings from the environment variables named ENV_PREFIX followed by the name of a setting, e.g. LLM_SENTIMENT_BATCH_SIZE=32,
+        whose values are read as JSON when possible and as strings otherwise. Other environment variables are ignored.
+
+        Args:
+            environ (dict): the environment variables. Defaults to os.environ.
+            **settings: settings taking precedence over the environment variables.
+        Returns:
+            Settings: the settings.
+        '''
+        environ = os.environ if environ is None else environ
+        names = {f.name for f in fields(cls)}
+        values = {k[len(ENV_PREFIX):]: parse_value(v) for k, v in environ.items() if k.startswith(ENV_PREFIX) and k[len(ENV_PREFIX):] in names}
+        values.update(settings)
+        return cls(**values)
+
+    @classmethod
+    def from_file(cls, path, environ=None):
+        '''
+        Creates the settings from a JSON file holding a dictionary of settings, whose names are case-insensitive, on top of the environment variables (see from_env()).
+
+        Raises:
+            AttributeError, if a setting does not exist.
+        Returns:
+            Settings: the settings.
+        '''
+        with open(path) as f:
+            settings = {k.upper(): v for k, v in json.load(f).items()}
+        names = {f.name for f in fields(cls)}
+        for k in settings:
+            if k not in names:
+                raise AttributeError(f"Unknown setting '{k}'.")
+        return cls.from_env(environ, **settings)
+
+    def snapshot(self):
+        '''
+        Returns:
+            dict: A dictionary of all the settings and their current values, where the derived directories (see DERIVED_PATHS) left to None are None,
+            so that they still follow BASE_DIR when the snapshot is restored with override().
+        '''
+        return {f.name: self.__dict__.get(f.name) if f.name in DERIVED_PATHS else getattr(self, f.name) for f in fields(self)}
+
+    def override(self, **settings):
+        '''
+        Overrides the values of existing settings.
+
+        Raises:
+            AttributeError, if a setting does not exist.
+        '''
+        for k, v in settings.items():
+            if not k.isupper() or not hasattr(self, k):
+                raise AttributeError(f"Unknown setting '{k}'.")
+            setattr(self, k, v)
+
+
+def derived_path(name, parent, path):
+    '''
+    Returns:
+        property: the property of the setting name, whose value is the one set, or the path within the parent setting if it is None.
+    '''
+    def get(self):
+        value = self.__dict__.get(name)
+        return os.path.join(getattr(self, parent), path) if value is None else value
+
+    def set(self, value):
+        self.__dict__[name] = value
+
+    return property(get, set)
+
+
+for name, (parent, path) in DERIVED_PATHS.items():
+    setattr(Settings, name, derived_path(name, parent, path))
+
+
+Config = Settings.from_env()
@@ -1,92 +1,120 @@
 # llm_sentiment/dataframe.py
 
 
+import numpy as np
 import pandas as pd
 from llm_sentiment.config import Config
-from llm_sentiment.prediction import Prediction
+from llm_sentiment.labels import label_categories
 
 class DataFrameBuilder:
     '''
     This class creates regular and multiIndex DataFrames of the output results.
+
+    The columns are collected first (see self.columns()) and the DataFrame is built once from them, with its regular or MultiIndex header set directly.
+    If Config.COMPACT_DATAFRAME is True, the scores are float32 and the sentiments are categoricals of the labels of all models.
     '''
     def __init__(self, predictor_obj):
-        
-        self.category = predictor_obj.category        
+
+        self.category = predictor_obj.category
         self.model_list = predictor_obj.model_list
         self.dataset = predictor_obj.dataset
         self.pred_list = predictor_obj.pred_both
-        
+        self.ensemble_preds = predictor_obj.ensemble_preds
+        self.cascade_preds = predictor_obj.cascade_preds
+        self.categories = label_categories(self.model_list)
+
+    def sentiment_column(self, values):
+        '''
+        Returns:
+            pd.Categorical or np.ndarray: the sentiments as a categorical of self.categories if Config.COMPACT_DATAFRAME is True, otherwise as they are.
+        Raises:
+            ValueError, if a sentiment is not one of self.categories.
+        '''
+        if not Config.COMPACT_DATAFRAME:
+            return values
+        column = pd.Categorical(values, categories=self.categories)
+        if (column.codes == -1).sum() != pd.isna(values).sum():
+            unknown = set(pd.unique(np.asarray(values, dtype=object))) - set(self.categories)
+            raise ValueError(f"Unknown sentiments {sorted(map(str, unknown))}. Known sentiments are:  {',  '.join(self.categories)}.")
+        return column
+
+    def score_column(self, values):
+        '''
+        Returns:
+            np.ndarray: the scores as float32 if Config.COMPACT_DATAFRAME is True, otherwise as float64, rounded to Config.DECIMAL_PLACE for the 'pipeline_classifier' category.
+        '''
+        values = np.asarray(values, dtype=np.float32 if Config.COMPACT_DATAFRAME else np.float64)
+        if self.category == 'pipeline_classifier':
+            values = values.round(Config.DECIMAL_PLACE)
+        return values
+
+    def columns(self):
+        '''
+        Collects the columns of the output: the text column, then the sentiment and score columns of each model and path, then the ensemble or cascade columns.
+
+        Returns:
+            list: A list of (header, values) pairs, where header is the (group, field) tuple of the MultiIndex column.
+        Raises:
+            ValueError, if a category other than 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade' is passed as input.
+        '''
+        if self.category == 'pipeline_classifier':
+            paths = ['pipeline', 'classifier']
+        elif self.category in ('classifier_classifier', 'ensemble', 'cascade'):
+            paths = ['classifier']
+        else:
+            raise ValueError(f"Invalid category '{self.category}'. Allowed categories are:  pipeline_classifier,  classifier_classifier,  ensemble,  cascade.")
+
+        texts = self.dataset.with_format('arrow')[Config.COLUMN_TEXT].to_numpy()
+        columns = [((Config.COLUMN_TEXT, ''), texts)]
+        for i, preds in enumerate(self.pred_list):
+            preds = preds if len(paths) > 1 else [preds]
+            for path_name, path_preds in zip(paths, preds):
+                group = f'{self.model_list[i]["NAME"]}_{path_name}'
+                columns.append(((group, 'sentiment'), self.sentiment_column(path_preds['sentiment'])))
+                columns.append(((group, 'score'), self.score_column(path_preds['score'])))
+
+        if self.category == 'ensemble':
+            columns.append((('ensemble', 'vote'), self.sentiment_column(self.ensemble_preds['vote'])))
+            columns.append((('ensemble', 'agreement'), self.score_column(self.ensemble_preds['agreement'])))
+            columns.append((('ensemble', 'sentiment'), self.sentiment_column(self.ensemble_preds['sentiment'])))
+            columns.append((('ensemble', 'score'), self.score_column(self.ensemble_preds['score'])))
+        elif self.category == 'cascade':
+            columns.append((('cascade', 'sentiment'), self.sentiment_column(self.cascade_preds['sentiment'])))
+            columns.append((('cascade', 'score'), self.score_column(self.cascade_preds['score'])))
+            columns.append((('cascade', 'stage'), self.cascade_preds['stage']))
+        return columns
+
+    def build(self, headers, values):
+        '''
+        Returns:
+            pd.DataFrame: a DataFrame whose columns are values, named by headers, built in a single allocation.
+        '''
+        df = pd.DataFrame(dict(zip(range(len(values)), values)), copy=False)
+        df.columns = headers
+        return df
+
     def regular(self):
         '''
         The output is a regular DataFrame with initial text data, sentiment predictions, scores using for each model.
-        
+
         Return:
             pd.DataFrame: a regular DataFrame with initial text data, sentiment predictions, scores using for each model.
         Raises:
-            ValueError, if a category other than 'pipeline_classifier' or 'classifier_classifier' is passed as input.     
+            ValueError, if a category other than 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade' is passed as input.
         '''
-        dataset_df = pd.DataFrame(self.dataset, columns = [Config.COLUMN_TEXT])
-        result_df = dataset_df.copy()
-        
-        if self.category == 'pipeline_classifier':   
-            for i, preds in enumerate(self.pred_list):
-                pipe_df = pd.DataFrame(preds[0])
-                pipe_df.columns=[f'{self.model_list[i]["NAME"]}_pipeline_sentiment',f'{self.model_list[i]["NAME"]}_pipeline_score']
-                
-                cl_df = pd.DataFrame(preds[1], columns=[f'{self.model_list[i]["NAME"]}_classifier_sentiment',f'{self.model_list[i]["NAME"]}_classifier_score'])
-                
-                result_df = pd.concat([result_df, pipe_df, cl_df], axis=1)
-                result_df = result_df.round(Config.DECIMAL_PLACE)
-            return result_df
-
-        elif self.category == 'classifier_classifier':
-            for i, preds in enumerate(self.pred_list):
-                cl_df = pd.DataFrame(preds, columns=[f'{self.model_list[i]["NAME"]}_classifier_sentiment',f'{self.model_list[i]["NAME"]}_classifier_score'])
-                result_df = pd.concat([result_df, cl_df], axis=1)
-                
-            return result_df
+        columns = self.columns()
+        headers = ['_'.join(filter(None, header)) for header, _ in columns]
+        return self.build(headers, [values for _, values in columns])
 
-        else:
-            raise ValueError(f"Invalid category '{self.category}'. Allowed categories are:  pipeline_classifier,  classifier_classifier.")
-            
     def multi_index(self):
         '''
         The output is a multiIndex DataFrame with initial text data, sentiment predictions, scores using for each model.
-        
+
         Return:
             pd.DataFrame: a multiIndex DataFrame with initial text data, sentiment predictions, scores using for each model.
         Raises:
-            ValueError, if a category other than 'pipeline_classifier' or 'classifier_classifier' is passed as input.           
+            ValueError, if a category other than 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade' is passed as input.
         '''
-        result_df = self.regular()
-        header_list = [(Config.COLUMN_TEXT, '')]
-        
-        if self.category == 'pipeline_classifier':
-            num_models = (len(result_df.columns) - 1)//4
-
-            for i in range(num_models): 
-                header_names = [(f'{self.model_list[i]["NAME"]}_pipeline', 'sentiment'),
-                                (f'{self.model_list[i]["NAME"]}_pipeline', 'score'),
-                                (f'{self.model_list[i]["NAME"]}_classifier', 'sentiment'),
-                                (f'{self.model_list[i]["NAME"]}_classifier', 'score')]
-                header_list.extend(header_names)                 
-            header_multi_index = pd.MultiIndex.from_tuples(header_list)
-            result_df.columns = header_multi_index
-            
-            return result_df
-        
-        elif self.category == 'classifier_classifier':
-            num_models = (len(result_df.columns) - 1)//2
-
-            for i in range(num_models):
-                header_names = [(f'{self.model_list[i]["NAME"]}_classifier', 'sentiment'),
-                                (f'{self.model_list[i]["NAME"]}_classifier', 'score')]
-                
-                header_list.extend(header_names)            
-            header_multi_index = pd.MultiIndex.from_tuples(header_list)
-            result_df.columns = header_multi_index
-
-            return result_df
-        
-        else:
-            raise ValueError(f"Invalid category '{self.category}'. Allowed categories are:  pipeline_classifier,  classifier_classifier.")
+        columns = self.columns()
+        headers = pd.MultiIndex.from_tuples([header for header, _ in columns])
+        return self.build(headers, [values for _, values in columns])
@@ -1,29 +1,206 @@
-# llm_sentiment/data_loader.py
+# llm_sentiment/dataset_loader.py
 
 
-from datasets import load_dataset
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datasets import ClassLabel, Dataset, load_dataset, load_from_disk
 from llm_sentiment.config import Config
 
 class DataSetLoader:
     '''
     This class loads the dataset needed for sentiment analysis.
+
+    The dataset is loaded from the Hugging Face Hub, unless self.dataset_name is the path of a local file or directory:
+    - 'csv', 'jsonl' and 'parquet' files are converted once to an Arrow file in the datasets cache, one batch at a time, which is then memory-mapped.
+      Parquet columns are compressed, so they cannot be used in place: the conversion keeps the memory bounded whatever the size of the file.
+      In streaming mode, 'parquet' files are read chunk-by-chunk instead (one record batch at a time, see parquet_chunks()), without conversion
+    - 'arrow' files (Arrow IPC files or streams, e.g. Feather files) and directories written by datasets.Dataset.save_to_disk() are memory-mapped without any copy
+    Only the Config.COLUMN_TEXT column, and the Config.COLUMN_LABEL column if it is present, are kept from local files.
     '''
-    def __init__(self, dataset_name):  
+    FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+    def __init__(self, dataset_name):
         '''
-        Initializes the self.dataset_name 
+        Initializes the self.dataset_name
         '''
         self.dataset_name = dataset_name
 
+    def local_format(self):
+        '''
+        Returns:
+            str: the format of the local dataset, given by Config.DATASET_FORMAT or inferred from the file extension ('disk' for a directory
+            written by save_to_disk()), or None if self.dataset_name is not a local path.
+        Raises:
+            ValueError, if the format of a local file cannot be inferred.
+        '''
+        if not os.path.exists(self.dataset_name):
+            return None
+        if Config.DATASET_FORMAT:
+            return Config.DATASET_FORMAT
+        if os.path.isdir(self.dataset_name):
+            return 'disk'
+        extension = os.path.splitext(self.dataset_name)[1].lower()
+        if extension not in self.FORMATS:
+            raise ValueError(f"Cannot infer the format of '{self.dataset_name}', set Config.DATASET_FORMAT to one of:  {',  '.join(sorted(set(self.FORMATS.values())))}.")
+        return self.FORMATS[extension]
+
+    @staticmethod
+    def projected_columns(column_names):
+        '''
+        Returns:
+            list: the columns kept from a local dataset, Config.COLUMN_TEXT and Config.COLUMN_LABEL if it is present.
+        Raises:
+            KeyError, if the Config.COLUMN_TEXT column is not found.
+        '''
+        if Config.COLUMN_TEXT not in column_names:
+            raise KeyError(f"The column '{Config.COLUMN_TEXT}' is not found in the dataset, whose columns are:  {',  '.join(column_names)}.")
+        return [column for column in (Config.COLUMN_TEXT, Config.COLUMN_LABEL) if column in column_names]
+
+    def arrow_load(self):
+        '''
+        Memory-maps a local Arrow IPC file or stream, without copying it.
+
+        Returns:
+            dataset (datasets.Dataset): a HuggingFace dataset backed by the memory-mapped file.
+        '''
+        source = pa.memory_map(self.dataset_name)
+        try:
+            table = pa.ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            # Arrow streams, such as the files written by datasets, are memory-mapped by datasets itself
+            return Dataset.from_file(self.dataset_name)
+        return Dataset(table)
+
+    def local_load(self, file_format):
+        '''
+        Loads the local dataset, keeping only the projected columns.
+
+        Args:
+            file_format (str): 'csv', 'jsonl', 'parquet', 'arrow' or 'disk'.
+        Raises:
+            ValueError, if the format is not allowed.
+        Returns:
+            dataset (datasets.Dataset): a HuggingFace dataset backed by a memory-mapped file.
+        '''
+        if file_format in ('csv', 'jsonl'):
+            dataset = load_dataset('csv' if file_format == 'csv' else 'json', data_files=self.dataset_name, split='train')
+        elif file_format == 'parquet':
+            columns = self.projected_columns(pq.read_schema(self.dataset_name).names)
+            dataset = load_dataset('parquet', data_files=self.dataset_name, columns=columns, split='train')
+        elif file_format == 'arrow':
+            dataset = self.arrow_load()
+        elif file_format == 'disk':
+            dataset = load_from_disk(self.dataset_name)
+            if Config.DATASET_SPLIT and not isinstance(dataset, Dataset):
+                dataset = dataset[Config.DATASET_SPLIT]
+        else:
+            raise ValueError(f"Invalid dataset format '{file_format}'. Allowed formats are:  csv,  jsonl,  parquet,  arrow,  disk.")
+
+        return dataset.select_columns(self.projected_columns(dataset.column_names))
+
     def dataset_load(self):
         '''
         Returns:
             dataset (datasets.Dataset): a HuggingFace dataset containing data to be used for predictions.
         Raises:
             FileNotFoundError if self.dataset_name is not found
-        '''  
+        '''
+        file_format = self.local_format()
+        if file_format is not None:
+            return self.local_load(file_format)
+
         dataset = load_dataset(self.dataset_name, Config.DATASET_CONFIG, split=Config.DATASET_SPLIT)
-        
+
         if dataset is None:
-            raise FileNotFoundError(f"The dataset '{self.dataset_name}' is not found.")        
-        
+            raise FileNotFoundError(f"The dataset '{self.dataset_name}' is not found.")
+
         return dataset
+
+    def dataset_chunks(self, chunk_size, skip=0):
+        '''
+        Loads the dataset in streaming mode and yields it chunk-by-chunk, so that only one chunk is held in memory at a time.
+
+        Local Parquet files are read one record batch at a time, and other local files are memory-mapped and sliced into chunks.
+
+        Args:
+            chunk_size (int): number of examples in each chunk.
+            skip (int): number of examples to skip at the beginning of the dataset.
+        Yields:
+            datasets.Dataset: a HuggingFace dataset containing the examples of the chunk.
+        '''
+        file_format = self.local_format()
+        if file_format == 'parquet':
+            yield from self.parquet_chunks(chunk_size, skip)
+            return
+        elif file_format is not None:
+            dataset = self.local_load(file_format)
+            for start in range(skip, len(dataset), chunk_size):
+                yield dataset.select(range(start, min(start + chunk_size, len(dataset))))
+            return
+
+        dataset = load_dataset(self.dataset_name, Config.DATASET_CONFIG, split=Config.DATASET_SPLIT, streaming=True)
+
+        if dataset is None:
+            raise FileNotFoundError(f"The dataset '{self.dataset_name}' is not found.")
+
+        if skip:
+            dataset = dataset.skip(skip)
+
+        for batch in dataset.iter(batch_size=chunk_size):
+            yield Dataset.from_dict(batch, features=dataset.features)
+
+    def parquet_chunks(self, chunk_size, skip=0):
+        '''
+        Reads the projected columns of a local Parquet file one record batch of chunk_size examples at a time.
+        Row groups lying entirely within the skipped examples are not read.
+
+        Yields:
+            datasets.Dataset: a HuggingFace dataset containing the examples of the chunk.
+        '''
+        parquet_file = pq.ParquetFile(self.dataset_name, memory_map=True)
+        columns = self.projected_columns(parquet_file.schema_arrow.names)
+
+        row_groups = []
+        for i in range(parquet_file.num_row_groups):
+            num_rows = parquet_file.metadata.row_group(i).num_rows
+            if skip >= num_rows and not row_groups:
+                skip -= num_rows
+            else:
+                row_groups.append(i)
+
+        pending = []
+        pending_rows = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups, columns=columns):
+            if skip:
+                dropped = min(skip, batch.num_rows)
+                batch = batch.slice(dropped)
+                skip -= dropped
+            if batch.num_rows == 0:
+                continue
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            # record batches do not cross row groups, so they are regrouped into chunks of exactly chunk_size examples
+            while pending_rows >= chunk_size:
+                table = pa.Table.from_batches(pending)
+                yield Dataset(table.slice(0, chunk_size).combine_chunks())
+                pending = table.slice(chunk_size).to_batches()
+                pending_rows -= chunk_size
+        if pending_rows:
+            yield Dataset(pa.Table.from_batches(pending).combine_chunks())
+
+    @staticmethod
+    def label_names(dataset):
+        '''
+        Returns:
+            np.ndarray: the ground truth label names of the Config.COLUMN_LABEL column of the dataset, or None if the dataset has no such column.
+            Integer labels of a ClassLabel feature are converted to their names.
+        '''
+        if Config.COLUMN_LABEL not in dataset.column_names:
+            return None
+        labels = dataset[Config.COLUMN_LABEL]
+        feature = dataset.features[Config.COLUMN_LABEL]
+        if isinstance(feature, ClassLabel):
+            labels = feature.int2str(labels)
+        return np.array(labels, dtype=object)
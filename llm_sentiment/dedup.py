@@ -0,0 +1,65 @@
+# llm_sentiment/dedup.py
+
+
+import numpy as np
+import pyarrow.compute as pc
+from llm_sentiment.config import Config
+
+
+def normalize_texts(column):
+    '''
+    Returns:
+        pa.Array: the texts with leading and trailing whitespace removed, inner runs of whitespace collapsed to one space and lowercased.
+    '''
+    column = pc.utf8_trim_whitespace(column)
+    column = pc.replace_substring_regex(column, pattern=r'\s+', replacement=' ')
+    return pc.utf8_lower(column)
+
+
+class TextDeduplicator:
+    '''
+    This class finds the duplicate texts of the Config.COLUMN_TEXT column of a dataset, so that only its unique texts are predicted.
+
+    - The texts are hashed by Arrow's dictionary encoding, which gives each row the index of its text among the unique texts (in order of first occurrence)
+    - self.unique is the dataset of the first row of each unique text, and self.inverse maps every row to its unique text
+    - expand() fans the predictions of the unique texts back out to every row with a single take on self.inverse
+    - If normalize is True, texts differing only by whitespace or case are duplicates, and are predicted with the text of their first occurrence
+    '''
+    def __init__(self, dataset, normalize=None):
+        '''
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+            normalize (bool): if True whitespace and case are normalized before hashing. Defaults to Config.DEDUP_NORMALIZE.
+        '''
+        normalize = Config.DEDUP_NORMALIZE if normalize is None else normalize
+        column = dataset.with_format('arrow')[Config.COLUMN_TEXT].combine_chunks()
+        if normalize:
+            column = normalize_texts(column)
+        encoded = pc.dictionary_encode(column, null_encoding='encode')
+
+        self.rows = len(dataset)
+        self.inverse = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+        self.num_unique = len(encoded.dictionary)
+        if self.num_unique < self.rows:
+            # writing the positions in reverse order leaves the position of the first occurrence of each text
+            first = np.empty(self.num_unique, dtype=np.int64)
+            first[self.inverse[::-1]] = np.arange(self.rows - 1, -1, -1)
+            self.unique = dataset.select(first)
+        else:
+            self.unique = dataset
+
+    def expand(self, preds):
+        '''
+        Returns:
+            dict: the prediction arrays of the unique texts expanded to one entry per row of the dataset.
+        '''
+        if self.num_unique == self.rows:
+            return preds
+        return {k: np.asarray(v)[self.inverse] for k, v in preds.items()}
+
+    def stats(self):
+        '''
+        Returns:
+            dict: the number of 'rows', of 'unique' texts and the 'dedup_ratio', the fraction of rows that are not predicted.
+        '''
+        return {'rows': self.rows, 'unique': self.num_unique, 'dedup_ratio': 1 - self.num_unique / self.rows if self.rows else 0.0}
@@ -0,0 +1,189 @@
+# llm_sentiment/encoding.py
+
+
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import torch
+from llm_sentiment.config import Config
+
+
+def text_buffers(dataset, batch_size=10000):
+    '''
+    Iterates over the Arrow buffers of the Config.COLUMN_TEXT column of the dataset batch-by-batch, without converting the texts to Python strings.
+
+    Args:
+        dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        batch_size (int): number of texts read at a time.
+    Yields:
+        tuple: the offsets of the texts of an Arrow chunk, followed by the end of the last text, and the UTF-8 data buffer of the chunk (None if all texts are empty).
+    '''
+    texts = dataset.select_columns([Config.COLUMN_TEXT]).with_format('arrow')
+    for batch in texts.iter(batch_size=batch_size):
+        for chunk in batch.column(0).chunks:
+            if len(chunk) == 0:
+                continue
+            offset_type = np.int64 if pa.types.is_large_string(chunk.type) else np.int32
+            offsets = np.frombuffer(chunk.buffers()[1], dtype=offset_type)[chunk.offset:chunk.offset + len(chunk) + 1]
+            yield offsets, chunk.buffers()[2]
+
+
+def text_bytes(dataset, batch_size=10000):
+    '''
+    Yields:
+        memoryview: the UTF-8 bytes of each text of the Config.COLUMN_TEXT column of the dataset, in order, read directly from the Arrow buffers.
+    '''
+    for offsets, data in text_buffers(dataset, batch_size):
+        view = memoryview(data) if data is not None else memoryview(b'')
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            yield view[start:end]
+
+
+def text_hash(dataset, batch_size=10000):
+    '''
+    Hashes the texts of the Config.COLUMN_TEXT column of the dataset batch-by-batch, directly from the Arrow buffers.
+
+    Args:
+        dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        batch_size (int): number of texts hashed at a time.
+    Returns:
+        str: the hexadecimal SHA-256 digest of the texts, in order.
+    '''
+    digest = hashlib.sha256()
+    for offsets, data in text_buffers(dataset, batch_size):
+        digest.update(np.diff(offsets).astype(np.int64).tobytes())
+        if data is not None:
+            digest.update(memoryview(data)[offsets[0]:offsets[-1]])
+    return digest.hexdigest()
+
+
+class RaggedEncoding:
+    '''
+    This class holds the token ids of a tokenized dataset without padding.
+
+    The token ids of all examples are concatenated in one int32 array, and the position of each example is given by self.offsets:
+    the token ids of example i are self.input_ids[self.offsets[i]:self.offsets[i + 1]] and its token length is self.lengths[i].
+    '''
+    def __init__(self, input_ids, offsets):
+        '''
+        Args:
+            input_ids (np.ndarray): the concatenated token ids of all examples.
+            offsets (np.ndarray): the start position of each example in input_ids, followed by the total number of tokens.
+        '''
+        self.input_ids = np.asarray(input_ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def from_arrow(cls, column):
+        '''
+        Builds a RaggedEncoding from an Arrow column of lists of token ids, without converting it to Python lists.
+
+        Args:
+            column (pyarrow.ChunkedArray): the 'input_ids' column of a tokenized dataset.
+        '''
+        list_array = pa.concat_arrays(column.chunks) if column.num_chunks else pa.array([], type=pa.list_(pa.int32()))
+        lengths = pc.list_value_length(list_array).to_numpy(zero_copy_only=False)
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        input_ids = list_array.flatten().to_numpy(zero_copy_only=False)
+        return cls(input_ids, offsets)
+
+    @classmethod
+    def from_lists(cls, token_ids):
+        '''
+        Builds a RaggedEncoding from the lists of token ids returned by a tokenizer.
+
+        Args:
+            token_ids (list): the list of token ids of each example.
+        '''
+        lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=len(token_ids))
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        input_ids = np.fromiter(itertools.chain.from_iterable(token_ids), dtype=np.int32, count=int(offsets[-1]))
+        return cls(input_ids, offsets)
+
+    def collate(self, indices, pad_token_id):
+        '''
+        Pads the examples of a batch to the longest example of the batch.
+
+        Args:
+            indices (list): indices of the examples of the batch.
+            pad_token_id (int): id of the padding token.
+        Returns:
+            tuple: A tuple containing the 'input_ids' and 'attention_mask' tensors of the batch.
+        '''
+        lengths = self.lengths[indices]
+        attention_mask = np.arange(lengths.max()) < lengths[:, None]
+        input_ids = np.full(attention_mask.shape, pad_token_id, dtype=np.int64)
+        input_ids[attention_mask] = np.concatenate([self.input_ids[self.offsets[i]:self.offsets[i + 1]] for i in indices])
+        return torch.from_numpy(input_ids), torch.from_numpy(attention_mask.astype(np.int64))
+
+    def save(self, path):
+        '''
+        Saves the encoding to path atomically, by writing a temporary file which then replaces path.
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, input_ids=self.input_ids, offsets=self.offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads an encoding saved by save().
+        '''
+        with np.load(path) as data:
+            return cls(data['input_ids'], data['offsets'])
+
+
+def evict_encodings(directory, max_bytes):
+    '''
+    Deletes the least recently used encodings of the encoding cache directory, by modification time, until their total size is at most max_bytes.
+    The most recently used encoding is always kept.
+
+    Args:
+        directory (str): the directory of the encoding cache.
+        max_bytes (int): maximum number of bytes of the encodings kept.
+    '''
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.npz'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries[:-1]:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already evicted by another process
+            pass
+        total -= size
+
+
+def tokenizer_fingerprint(tokenizer):
+    '''
+    Fingerprints everything the token ids depend on: the tokenizer class and vocabulary, its special tokens and maximum length, and Config.TRUNCATION.
+    Tokenizers with the same vocabulary and settings have the same fingerprint even when they belong to different models.
+
+    Returns:
+        str: the hexadecimal SHA-256 digest of the tokenizer.
+    '''
+    settings = [type(tokenizer).__name__,
+                sorted(tokenizer.get_vocab().items()),
+                tokenizer.all_special_tokens,
+                tokenizer.model_max_length,
+                Config.TRUNCATION]
+    return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
@@ -0,0 +1,152 @@
+# llm_sentiment/ensemble.py
+
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from llm_sentiment.config import Config
+from llm_sentiment.cache import PredictionCache
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.encoding import text_hash, tokenizer_fingerprint
+from llm_sentiment.instrumentation import Instrumentation
+from llm_sentiment.parallel import torch_threads, split_threads
+from llm_sentiment.labels import label_categories
+
+
+class EnsembleClassifier:
+    '''
+    This class scores a dataset with the classifiers of all the models of model_list in one pass and combines their predictions.
+
+    - Models whose tokenizers have the same fingerprint (same vocabulary and settings) share the tokenization of the dataset, which is computed once
+    - The models run concurrently, one thread each, since the forward passes release the GIL, and the torch threads of the process are split evenly between them
+    - The probabilities of each model are aligned on the union of the labels of all models (see labels.label_categories()), so that models whose label ids differ can be combined
+    - The ensemble predictions are the majority vote of the models (ties broken by the averaged probabilities), the fraction of models agreeing with the vote,
+      and the label and score of the averaged probabilities
+    '''
+    def __init__(self, model_list):
+        '''
+        Initializes the EnsembleClassifier class with a Classifier per model of model_list.
+        If Config.PREDICTION_CACHE is True, each model has a PredictionCache keeping its probabilities, so that cached predictions can be combined too.
+        '''
+        self.model_list = model_list
+        self.classifiers = [Classifier(model_i) for model_i in model_list]
+        self.caches = [PredictionCache(cl.model_choice, 'classifier', cl.model.config, with_probabilities=True) if Config.PREDICTION_CACHE else None
+                       for cl in self.classifiers]
+        self.labels = label_categories(model_list)
+        self.fingerprints = [tokenizer_fingerprint(cl.tokenizer) for cl in self.classifiers]
+        self.encodings = {}
+        self.lock = threading.Lock()
+
+    def encode(self, i, dataset):
+        '''
+        Returns the encoding of the dataset for the i-th model, tokenizing it only if no model with the same tokenizer fingerprint has done it already.
+        A model waiting for the encoding being computed by another model blocks until it is available.
+
+        Returns:
+            RaggedEncoding: the token ids of the dataset.
+        '''
+        key = (self.fingerprints[i], text_hash(dataset))
+        with self.lock:
+            future = self.encodings.get(key)
+            owner = future is None
+            if owner:
+                future = self.encodings[key] = Future()
+        if owner:
+            try:
+                future.set_result(self.classifiers[i].preprocess_inst.encoding(dataset))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            Instrumentation.count('shared_encodings')
+        return future.result()
+
+    def predict_model(self, i, dataset):
+        '''
+        Predicts the sentiment and the probabilities of all labels of each example of the dataset with the i-th model, using its cache if it is enabled.
+
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score', 'label_ids' and 'probabilities'.
+        '''
+        classifier = self.classifiers[i]
+
+        def compute(subset):
+            return classifier.get_label(classifier.inference(self.encode(i, subset), return_probabilities=True))
+
+        with Instrumentation.stage(f'predict.{classifier.model_choice["NAME"]}.ensemble'):
+            if self.caches[i] is not None:
+                return self.caches[i].get_sentiment(dataset, compute)
+            return compute(dataset)
+
+    def aligned_probabilities(self, i, probabilities):
+        '''
+        Returns:
+            np.ndarray: the probabilities of the i-th model with one column per label of self.labels, zero for the labels the model does not have.
+        '''
+        id2label = self.classifiers[i].model.config.id2label
+        aligned = np.zeros((len(probabilities), len(self.labels)), dtype=np.float32)
+        columns = [self.labels.index(id2label[label_id]) for label_id in range(probabilities.shape[1])]
+        aligned[:, columns] = probabilities
+        return aligned
+
+    def combine(self, member_preds):
+        '''
+        Combines the predictions of the models.
+
+        Args:
+            member_preds (list): the predictions of each model, returned by self.predict_model().
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing:
+                - 'vote': the label predicted by most models, ties broken by the averaged probabilities
+                - 'agreement': the fraction of models whose prediction is the vote
+                - 'sentiment' and 'score': the label with the highest averaged probability and its averaged probability
+                - 'probabilities': the averaged probabilities of all labels, in the order of self.labels
+        '''
+        with Instrumentation.stage('ensemble_combine'):
+            labels = np.array(self.labels, dtype=object)
+            probabilities = np.mean([self.aligned_probabilities(i, preds['probabilities']) for i, preds in enumerate(member_preds)], axis=0)
+
+            # label ids of each model in the order of self.labels, one row per model
+            votes = np.stack([np.searchsorted(labels.astype(str), preds['sentiment'].astype(str)) for preds in member_preds])
+            vote_counts = np.zeros_like(probabilities, dtype=np.int64)
+            for model_votes in votes:
+                vote_counts[np.arange(len(model_votes)), model_votes] += 1
+            # adding the averaged probabilities (< 1) breaks ties between labels with the same number of votes
+            vote = np.argmax(vote_counts + probabilities, axis=-1)
+            best = np.argmax(probabilities, axis=-1)
+
+            return {'vote': np.take(labels, vote),
+                    'agreement': (votes == vote).mean(axis=0).astype(np.float32),
+                    'sentiment': np.take(labels, best),
+                    'score': np.take_along_axis(probabilities, best[:, None], axis=-1)[:, 0],
+                    'probabilities': probabilities}
+
+    def get_sentiment(self, dataset):
+        '''
+        Predicts the sentiment of each example of the dataset with all the models concurrently and combines their predictions.
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Returns:
+            tuple: the list of the predictions of each model (see self.predict_model()) and the ensemble predictions (see self.combine()).
+        '''
+        self.encodings = {}
+        try:
+            with torch_threads(split_threads(len(self.classifiers))), ThreadPoolExecutor(max_workers=len(self.classifiers)) as executor:
+                member_preds = list(executor.map(lambda i: self.predict_model(i, dataset), range(len(self.classifiers))))
+        finally:
+            self.encodings = {}
+        return member_preds, self.combine(member_preds)
+
+    def stats(self):
+        '''
+        Returns:
+            dict: the prediction cache statistics of each model whose cache is enabled.
+        '''
+        return {f'{cl.model_choice["NAME"]}_ensemble': cache.stats() for cl, cache in zip(self.classifiers, self.caches) if cache is not None}
+
+    def close(self):
+        '''
+        Releases the models of all the classifiers.
+        '''
+        for cl in self.classifiers:
+            cl.close()
@@ -0,0 +1,210 @@
+# llm_sentiment/evaluation.py
+
+
+import os
+import json
+import itertools
+import numpy as np
+from llm_sentiment.config import Config
+from llm_sentiment.dataset_loader import DataSetLoader
+
+
+def prediction_columns(predictor_obj):
+    '''
+    Returns:
+        list: the (name, predictions) pairs of each model and path of a Prediction object whose predict() has been called, named as the columns
+        of the output DataFrame without their '_sentiment'/'_score' suffix, followed by ('ensemble', predictions) for the 'ensemble' category
+        or ('cascade', predictions) for the 'cascade' category.
+    '''
+    paths = predictor_obj.paths()
+    columns = []
+    for model_i, preds in zip(predictor_obj.model_list, predictor_obj.pred_both):
+        preds = preds if len(paths) > 1 else [preds]
+        columns.extend((f'{model_i["NAME"]}_{path_name}', path_preds) for path_name, path_preds in zip(paths, preds))
+    if predictor_obj.ensemble_preds is not None:
+        columns.append(('ensemble', predictor_obj.ensemble_preds))
+    if predictor_obj.cascade_preds is not None:
+        columns.append(('cascade', predictor_obj.cascade_preds))
+    return columns
+
+
+class Evaluator:
+    '''
+    This class evaluates the predictions of each model and path against the ground truth labels of the Config.COLUMN_LABEL column, batch-by-batch.
+
+    Only counts are accumulated, so its memory does not depend on the size of the dataset and it can follow a streaming run:
+    - a confusion matrix per prediction column (rows are the ground truth labels, columns the predicted labels)
+    - the number of examples, of correct predictions and the sum of the scores in each of Config.EVALUATION_BINS confidence bins, for the expected calibration error (ECE)
+    - the number of examples on which each pair of prediction columns agree, and on which all of them agree
+
+    Labels are matched by name. A ground truth label none of the models predicts is added to the labels when it is first seen, and examples without a label are skipped.
+    '''
+    def __init__(self, labels, num_bins=None):
+        '''
+        Args:
+            labels (list): the labels the models predict (see labels.label_categories()).
+            num_bins (int): number of equal-width confidence bins of the ECE. Defaults to Config.EVALUATION_BINS.
+        '''
+        self.labels = list(labels)
+        self.num_bins = num_bins or Config.EVALUATION_BINS
+        self.confusion = {}
+        self.calibration = {}
+        self.pair_matches = {}
+        self.all_matches = 0
+        self.rows = 0
+
+    def label_ids(self, values):
+        '''
+        Returns:
+            np.ndarray: the index in self.labels of each label of values, adding the labels not seen before to self.labels and growing the confusion matrices.
+        '''
+        values = np.asarray(values, dtype=object)
+        unique, inverse = np.unique(values.astype(str), return_inverse=True)
+        new_labels = [label for label in unique if label not in self.labels]
+        if new_labels:
+            self.labels.extend(new_labels)
+            for name, matrix in self.confusion.items():
+                self.confusion[name] = np.pad(matrix, ((0, len(new_labels)), (0, len(new_labels))))
+        index = {label: i for i, label in enumerate(self.labels)}
+        return np.array([index[label] for label in unique], dtype=np.int64)[inverse.reshape(-1)]
+
+    def update(self, columns, true_labels):
+        '''
+        Adds a batch of predictions to the counts.
+
+        Args:
+            columns (list): the (name, predictions) pairs of each prediction column (see prediction_columns()), whose predictions hold
+                the 'sentiment' and 'score' of each example of the batch.
+            true_labels (np.ndarray): the ground truth label of each example of the batch (see DataSetLoader.label_names()).
+        '''
+        known = np.array([label is not None and label == label for label in true_labels], dtype=bool)
+        if not known.any():
+            return
+        true_ids = self.label_ids(np.asarray(true_labels, dtype=object)[known])
+        pred_ids = {name: self.label_ids(np.asarray(preds['sentiment'], dtype=object)[known]) for name, preds in columns}
+        num_labels = len(self.labels)
+
+        for name, preds in columns:
+            matrix = self.confusion.get(name)
+            if matrix is None:
+                matrix = np.zeros((num_labels, num_labels), dtype=np.int64)
+            counts = np.bincount(true_ids * num_labels + pred_ids[name], minlength=num_labels * num_labels)
+            self.confusion[name] = matrix + counts.reshape(num_labels, num_labels)
+
+            scores = np.asarray(preds['score'], dtype=np.float64)[known]
+            bins = np.clip((scores * self.num_bins).astype(np.int64), 0, self.num_bins - 1)
+            correct = (pred_ids[name] == true_ids).astype(np.float64)
+            calibration = self.calibration.setdefault(name, np.zeros((3, self.num_bins), dtype=np.float64))
+            calibration[0] += np.bincount(bins, minlength=self.num_bins)
+            calibration[1] += np.bincount(bins, weights=correct, minlength=self.num_bins)
+            calibration[2] += np.bincount(bins, weights=scores, minlength=self.num_bins)
+
+        for a, b in itertools.combinations(pred_ids, 2):
+            self.pair_matches[f'{a}~{b}'] = self.pair_matches.get(f'{a}~{b}', 0) + int(np.sum(pred_ids[a] == pred_ids[b]))
+        stacked = np.stack(list(pred_ids.values()))
+        self.all_matches += int(np.sum(np.all(stacked == stacked[0], axis=0)))
+        self.rows += int(known.sum())
+
+    def evaluate(self, predictor_obj):
+        '''
+        Adds the predictions of a Prediction object whose predict() has been called to the counts, if its dataset has a Config.COLUMN_LABEL column.
+
+        Returns:
+            bool: True if the predictions have been evaluated, False if the dataset has no ground truth labels.
+        '''
+        true_labels = DataSetLoader.label_names(predictor_obj.dataset)
+        if true_labels is None:
+            return False
+        self.update(prediction_columns(predictor_obj), true_labels)
+        return True
+
+    def metrics(self, name):
+        '''
+        Returns:
+            dict: the number of 'rows', the 'accuracy', the 'macro_f1' over the labels that are predicted or in the ground truth, the 'ece'
+            and the count, accuracy and mean score of each non-empty confidence bin in 'calibration', the 'precision', 'recall', 'f1' and 'support'
+            of each label, and the 'confusion' matrix of the prediction column as nested lists.
+        '''
+        matrix = self.confusion[name]
+        tp = np.diag(matrix).astype(np.float64)
+        support = matrix.sum(axis=1)
+        predicted = matrix.sum(axis=0)
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(tp), where=precision + recall > 0)
+        present = (support + predicted) > 0
+        total = matrix.sum()
+
+        counts, correct, confidence = self.calibration[name]
+        ece = float(np.sum(np.abs(correct - confidence)) / total) if total else 0.0
+
+        return {'rows': int(total),
+                'accuracy': float(tp.sum() / total) if total else 0.0,
+                'macro_f1': float(f1[present].mean()) if present.any() else 0.0,
+                'ece': ece,
+                'calibration': [{'bin': [i / self.num_bins, (i + 1) / self.num_bins], 'count': int(counts[i]),
+                                 'accuracy': float(correct[i] / counts[i]), 'mean_score': float(confidence[i] / counts[i])}
+                                for i in range(self.num_bins) if counts[i]],
+                'per_class': {label: {'precision': float(precision[i]), 'recall': float(recall[i]), 'f1': float(f1[i]), 'support': int(support[i])}
+                              for i, label in enumerate(self.labels) if present[i]},
+                'confusion': {'labels': self.labels, 'matrix': matrix.tolist()}}
+
+    def report(self):
+        '''
+        Returns:
+            dict: the 'rows' evaluated, the metrics of each prediction column (see self.metrics()), and the pairwise and overall 'agreement'
+            of the predicted labels of the prediction columns.
+        '''
+        agreement = {pair: matches / self.rows for pair, matches in self.pair_matches.items()} if self.rows else {}
+        if self.rows and len(self.confusion) > 1:
+            agreement['all'] = self.all_matches / self.rows
+        return {'rows': self.rows,
+                'columns': {name: self.metrics(name) for name in self.confusion},
+                'agreement': agreement}
+
+    def state(self):
+        '''
+        Returns:
+            dict: the counts as JSON-serializable values, from which an interrupted evaluation is resumed with from_state().
+        '''
+        return {'labels': self.labels,
+                'num_bins': self.num_bins,
+                'confusion': {name: matrix.tolist() for name, matrix in self.confusion.items()},
+                'calibration': {name: calibration.tolist() for name, calibration in self.calibration.items()},
+                'pair_matches': self.pair_matches,
+                'all_matches': self.all_matches,
+                'rows': self.rows}
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        Returns:
+            Evaluator: an Evaluator holding the counts of state (see self.state()).
+        '''
+        evaluator = cls(state['labels'], state['num_bins'])
+        evaluator.confusion = {name: np.array(matrix, dtype=np.int64) for name, matrix in state['confusion'].items()}
+        evaluator.calibration = {name: np.array(calibration, dtype=np.float64) for name, calibration in state['calibration'].items()}
+        evaluator.pair_matches = dict(state['pair_matches'])
+        evaluator.all_matches = state['all_matches']
+        evaluator.rows = state['rows']
+        return evaluator
+
+    def export(self, path):
+        '''
+        Writes the report as JSON to path and prints the accuracy, macro-F1 and ECE of each prediction column.
+
+        Returns:
+            dict: the report.
+        '''
+        report = self.report()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        print(f"\nEvaluation against '{Config.COLUMN_LABEL}' ({report['rows']} labeled rows):")
+        for name, metrics in report['columns'].items():
+            print(f"  {name:<30} accuracy {metrics['accuracy']:.4f}  macro-F1 {metrics['macro_f1']:.4f}  ECE {metrics['ece']:.4f}")
+        for pair, value in report['agreement'].items():
+            print(f"  agreement {pair:<40} {value:.4f}")
+        print(f'Evaluation report has been saved at {path}.\n')
+        return report
@@ -0,0 +1,265 @@
+# llm_sentiment/instrumentation.py
+
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import contextlib
+from llm_sentiment.config import Config
+
+
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf')]  # upper bounds in seconds
+_DISABLED = contextlib.nullcontext()  # shared context of the stages while the instrumentation is disabled
+
+
+def peak_rss_mb():
+    '''
+    Returns:
+        float: the peak resident set size of the process so far, in MB.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimer:
+    '''
+    This class is the context of one timed execution of a stage. On a GPU device, the device is synchronized before and after the stage
+    so that its asynchronous kernels are timed within the stage.
+    torch is only imported when Config.PROFILER is 'torch', since a GPU device is only given once the models have imported it.
+    '''
+    def __init__(self, name, device=None):
+        self.name = name
+        self.cuda = device is not None and str(device).startswith('cuda')
+        self.profiler_range = None
+        if Config.PROFILER == 'torch':
+            import torch
+            self.profiler_range = torch.profiler.record_function(name)
+
+    def __enter__(self):
+        if self.cuda:
+            sys.modules['torch'].cuda.synchronize()
+        if self.profiler_range is not None:
+            self.profiler_range.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cuda:
+            sys.modules['torch'].cuda.synchronize()
+        duration = time.perf_counter() - self.start
+        if self.profiler_range is not None:
+            self.profiler_range.__exit__(*exc)
+        Instrumentation.record(self.name, duration)
+        return False
+
+
+class Instrumentation:
+    '''
+    This class is a process-wide collector of stage timings and counters of the workflow, enabled by Config.INSTRUMENTATION.
+
+    - stage(name) times a block of code. Every execution is added to the total, count, minimum and maximum of the stage
+      and to its histogram of durations (upper bounds in BUCKETS), so per-batch stages get a histogram of their batches.
+    - count(name, value) increments a counter, e.g. the number of examples or padded tokens.
+    - report() returns the stages, counters and peak memory as a dictionary, prometheus() in the Prometheus text format,
+      and export() writes both to Config.INSTRUMENTATION_DIR.
+    - profile(name) runs a block of code under torch.profiler or cProfile according to Config.PROFILER and saves the trace to Config.INSTRUMENTATION_DIR.
+
+    While Config.INSTRUMENTATION is False, stage() returns a shared no-op context and count() returns immediately, so the hot paths are not slowed down.
+    '''
+    _stages = {}
+    _counters = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def stage(cls, name, device=None):
+        '''
+        Args:
+            name (str): name of the stage.
+            device (torch.device): device the stage runs on, synchronized before and after the stage if it is a GPU.
+        Returns:
+            A context manager timing the stage.
+        '''
+        if not Config.INSTRUMENTATION:
+            return _DISABLED
+        return StageTimer(name, device)
+
+    @classmethod
+    def record(cls, name, duration):
+        '''
+        Adds a duration in seconds to the statistics of the stage.
+        '''
+        with cls._lock:
+            stats = cls._stages.get(name)
+            if stats is None:
+                stats = cls._stages[name] = {'count': 0, 'total': 0.0, 'min': float('inf'), 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['min'] = min(stats['min'], duration)
+            stats['max'] = max(stats['max'], duration)
+            stats['buckets'][next(i for i, bound in enumerate(BUCKETS) if duration <= bound)] += 1
+
+    @classmethod
+    def count(cls, name, value=1):
+        '''
+        Increments the counter name by value.
+        '''
+        if not Config.INSTRUMENTATION:
+            return
+        with cls._lock:
+            cls._counters[name] = cls._counters.get(name, 0) + value
+
+    @classmethod
+    def reset(cls):
+        '''
+        Removes all the recorded stages and counters.
+        '''
+        with cls._lock:
+            cls._stages = {}
+            cls._counters = {}
+
+    @classmethod
+    def drain(cls):
+        '''
+        Returns the recorded stages and counters and resets them, so that they can be merged into the collector of another process.
+
+        Returns:
+            dict: the raw 'stages' and 'counters'.
+        '''
+        with cls._lock:
+            raw = {'stages': cls._stages, 'counters': cls._counters}
+            cls._stages = {}
+            cls._counters = {}
+        return raw
+
+    @classmethod
+    def merge(cls, raw):
+        '''
+        Merges the stages and counters returned by drain() in another process, such as a ParallelClassifier worker.
+        '''
+        with cls._lock:
+            for name, other in raw['stages'].items():
+                stats = cls._stages.setdefault(name, {'count': 0, 'total': 0.0, 'min': float('inf'), 'max': 0.0, 'buckets': [0] * len(BUCKETS)})
+                stats['count'] += other['count']
+                stats['total'] += other['total']
+                stats['min'] = min(stats['min'], other['min'])
+                stats['max'] = max(stats['max'], other['max'])
+                stats['buckets'] = [a + b for a, b in zip(stats['buckets'], other['buckets'])]
+            for name, value in raw['counters'].items():
+                cls._counters[name] = cls._counters.get(name, 0) + value
+
+    @classmethod
+    def report(cls):
+        '''
+        Returns:
+            dict: A dictionary with, for each stage, its count, total and mean/min/max durations and the count of each histogram bucket,
+            the counters, and the peak resident memory of the process (and the peak GPU memory allocated if a GPU is used).
+            torch is not imported if no model has imported it.
+        '''
+        with cls._lock:
+            stages = {name: {'count': stats['count'],
+                             'total_s': stats['total'],
+                             'mean_ms': stats['total'] / stats['count'] * 1000,
+                             'min_ms': stats['min'] * 1000,
+                             'max_ms': stats['max'] * 1000,
+                             'histogram': {str(bound): n for bound, n in zip(BUCKETS, stats['buckets'])}}
+                      for name, stats in cls._stages.items()}
+            counters = dict(cls._counters)
+        report = {'stages': stages, 'counters': counters, 'peak_rss_mb': peak_rss_mb()}
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            report['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+        return report
+
+    @classmethod
+    def prometheus(cls):
+        '''
+        Returns:
+            str: the stages as a histogram, the counters and the peak memory in the Prometheus text format.
+        '''
+        report = cls.report()
+        lines = ['# HELP llm_sentiment_stage_seconds Duration of the workflow stages.',
+                 '# TYPE llm_sentiment_stage_seconds histogram']
+        with cls._lock:
+            stages = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in cls._stages.items()}
+        for name, stats in stages.items():
+            cumulative = 0
+            for bound, n in zip(BUCKETS, stats['buckets']):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'llm_sentiment_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'llm_sentiment_stage_seconds_sum{{stage="{name}"}} {stats["total"]}')
+            lines.append(f'llm_sentiment_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        for name, value in report['counters'].items():
+            lines.append(f'# TYPE llm_sentiment_{name}_total counter')
+            lines.append(f'llm_sentiment_{name}_total {value}')
+        lines.append('# TYPE llm_sentiment_peak_rss_bytes gauge')
+        lines.append(f'llm_sentiment_peak_rss_bytes {int(report["peak_rss_mb"] * 1024 ** 2)}')
+        if 'peak_cuda_mb' in report:
+            lines.append('# TYPE llm_sentiment_peak_cuda_bytes gauge')
+            lines.append(f'llm_sentiment_peak_cuda_bytes {int(report["peak_cuda_mb"] * 1024 ** 2)}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def export(cls, name='workflow'):
+        '''
+        Writes the report as JSON and the Prometheus text file to Config.INSTRUMENTATION_DIR and prints the total time of each stage.
+        Does nothing while the instrumentation is disabled.
+
+        Returns:
+            dict: the report, or None if the instrumentation is disabled.
+        '''
+        if not Config.INSTRUMENTATION:
+            return None
+        report = cls.report()
+        os.makedirs(Config.INSTRUMENTATION_DIR, exist_ok=True)
+        with open(os.path.join(Config.INSTRUMENTATION_DIR, f'{name}.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.join(Config.INSTRUMENTATION_DIR, f'{name}.prom'), 'w') as f:
+            f.write(cls.prometheus())
+
+        print('\nStage timings:')
+        for stage, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['total_s']):
+            print(f"  {stage:<40} {stats['total_s']:>9.3f} s  {stats['count']:>7} calls  {stats['mean_ms']:>9.2f} ms mean  {stats['max_ms']:>9.2f} ms max")
+        print(f"  peak RSS {report['peak_rss_mb']:.0f} MB. Report saved in {Config.INSTRUMENTATION_DIR}.\n")
+        return report
+
+    @classmethod
+    @contextlib.contextmanager
+    def profile(cls, name='workflow'):
+        '''
+        Runs the block under the profiler of Config.PROFILER and saves its trace to Config.INSTRUMENTATION_DIR:
+        - 'torch': a torch.profiler Chrome trace ({name}.trace.json), in which the stages appear as labelled ranges
+        - 'cprofile': a cProfile stats file ({name}.prof), readable with pstats or snakeviz
+        Does nothing if Config.PROFILER is None.
+        '''
+        if Config.PROFILER is None:
+            yield
+            return
+
+        os.makedirs(Config.INSTRUMENTATION_DIR, exist_ok=True)
+        if Config.PROFILER == 'torch':
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            with torch.profiler.profile(activities=activities) as profiler:
+                yield
+            path = os.path.join(Config.INSTRUMENTATION_DIR, f'{name}.trace.json')
+            profiler.export_chrome_trace(path)
+        elif Config.PROFILER == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            path = os.path.join(Config.INSTRUMENTATION_DIR, f'{name}.prof')
+            pstats.Stats(profiler).dump_stats(path)
+        else:
+            raise ValueError(f"Invalid profiler '{Config.PROFILER}'. Allowed profilers are:  torch,  cprofile.")
+        print(f'\nProfile has been saved at {path}.\n')
@@ -0,0 +1,9 @@
+# llm_sentiment/labels.py
+
+
+def label_categories(model_list):
+    '''
+    Returns:
+        list: the sorted labels of all the models of model_list, the categories of the sentiment columns of the output.
+    '''
+    return sorted({label for model_i in model_list for label in model_i['ID2LABEL'].values()})
@@ -0,0 +1,209 @@
+# llm_sentiment/loading.py
+
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import shutil
+import struct
+import resource
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+from llm_sentiment.config import Config
+
+
+SAFETENSORS_DTYPES = {'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+                      'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8, 'U8': torch.uint8, 'BOOL': torch.bool}
+BUNDLE_MANIFEST = 'bundle.json'  # written last, a bundle directory without it is incomplete
+
+
+def local_fingerprint(directory):
+    '''
+    Fingerprints a local model directory by the names, sizes and modification times of its files, without reading them.
+
+    Returns:
+        str: the hexadecimal SHA-256 digest of the files of the directory.
+    '''
+    files = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in os.scandir(directory) if entry.is_file())
+    return hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+
+
+def model_revision(model_choice, model_config):
+    '''
+    Returns the revision of the model keying its cached predictions and exported graphs: the "REVISION" key of model_choice if it is set,
+    otherwise the commit hash of the Hub checkpoint. A local model directory has no commit hash, so its revision is its local_fingerprint(),
+    which changes when its weights are retrained or overwritten at the same path.
+
+    Args:
+        model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+        model_config (transformers.PretrainedConfig): the configuration of the loaded model.
+    Returns:
+        str: the revision of the model, or None if it has none.
+    '''
+    revision = model_choice.get('REVISION') or getattr(model_config, '_commit_hash', None)
+    if revision is None and os.path.isdir(model_choice['ID']):
+        revision = local_fingerprint(model_choice['ID'])
+    return revision
+
+
+def bundle_dir(model_id):
+    '''
+    Returns:
+        str: the directory of the bundle of the model, within the 'models' directory of Config.CACHE_DIR.
+        The directory of a local model is suffixed with its local_fingerprint(), so that the model is converted again when its files change.
+    '''
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '--', model_id.strip('/'))
+    if os.path.isdir(model_id):
+        name = f'{name}-{local_fingerprint(model_id)[:16]}'
+    return os.path.join(Config.CACHE_DIR, 'models', name)
+
+
+def ensure_bundle(model_id):
+    '''
+    Converts the checkpoint of the model into a local bundle the first time it is used: its configuration, its fp32 weights in a single
+    safetensors file and its tokenizer, saved with save_pretrained(). The bundle is written to a temporary directory which is then renamed,
+    so that a bundle is either complete or absent, and processes converting the same model concurrently do not conflict: the first complete bundle is kept,
+    and is never removed, since other processes may already map its weights.
+
+    Args:
+        model_id (str): ID of the model to be loaded from the Hugging Face Hub, or path of a local model.
+    Returns:
+        str: the directory of the bundle.
+    '''
+    directory = bundle_dir(model_id)
+    if os.path.exists(os.path.join(directory, BUNDLE_MANIFEST)):
+        return directory
+
+    start = time.perf_counter()
+    model = AutoModelForSequenceClassification.from_pretrained(model_id, torch_dtype=torch.float32)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    tmp_dir = f'{directory}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    model.save_pretrained(tmp_dir, safe_serialization=True, max_shard_size='1000GB')
+    tokenizer.save_pretrained(tmp_dir)
+    with open(os.path.join(tmp_dir, BUNDLE_MANIFEST), 'w') as f:
+        json.dump({'model_id': model_id, 'commit_hash': getattr(model.config, '_commit_hash', None)}, f)
+
+    if not os.path.exists(os.path.join(directory, BUNDLE_MANIFEST)):
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            if not os.path.exists(os.path.join(directory, BUNDLE_MANIFEST)):
+                # a directory without manifest is left by an interrupted conversion
+                shutil.rmtree(directory, ignore_errors=True)
+                try:
+                    os.replace(tmp_dir, directory)
+                except OSError:
+                    pass
+    # the temporary directory still exists if another process has completed the same bundle meanwhile
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f'{model_id} has been converted to a model bundle at {directory} in {time.perf_counter() - start:.1f} s.')
+    return directory
+
+
+def mmap_safetensors(path):
+    '''
+    Maps a safetensors file in memory without reading it: the tensors are views of a private (copy-on-write) mapping of the file,
+    so their pages are read from disk when they are first used, and are shared through the page cache by all the processes mapping the same file.
+
+    Args:
+        path (str): path of the safetensors file.
+    Returns:
+        dict: the tensors of the file by name.
+    '''
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop('__metadata__', None)
+
+    size = os.path.getsize(path)
+    data = torch.empty(0, dtype=torch.uint8).set_(torch.UntypedStorage.from_file(path, shared=False, nbytes=size))
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        tensors[name] = data[data_start + begin:data_start + end].view(SAFETENSORS_DTYPES[info['dtype']]).reshape(info['shape'])
+    return tensors
+
+
+def empty_model(model_config):
+    '''
+    Returns:
+        transformers.PreTrainedModel: a model of the configuration whose weights are allocated but not initialized, since they are replaced by the bundle weights.
+    '''
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        return AutoModelForSequenceClassification.from_config(model_config, torch_dtype=torch.float32)
+    with no_init_weights():
+        return AutoModelForSequenceClassification.from_config(model_config, torch_dtype=torch.float32)
+
+
+def load_config(directory):
+    '''
+    Returns:
+        transformers.PretrainedConfig: the configuration of the bundle at directory, whose _commit_hash is the revision of the source checkpoint
+        read from the bundle manifest, since the configuration saved in the bundle has none.
+    '''
+    with open(os.path.join(directory, BUNDLE_MANIFEST)) as f:
+        manifest = json.load(f)
+    model_config = AutoConfig.from_pretrained(directory)
+    # the revision of the source checkpoint keys the prediction cache and the exported backends
+    model_config._commit_hash = manifest['commit_hash']
+    return model_config
+
+
+def load_model(model_id):
+    '''
+    Loads the fp32 model from its bundle (see ensure_bundle()), converting the checkpoint first if needed.
+    The weights are assigned as views of the memory-mapped safetensors file (see mmap_safetensors()) instead of being copied,
+    so loading does not read the weights, and worker processes loading the same bundle share one copy of them.
+    They are only copied when the model is converted to another precision or carried to a GPU.
+
+    Raises:
+        ValueError, if weights of the model are missing from the bundle.
+    Returns:
+        transformers.PreTrainedModel: the model, in eval mode.
+    '''
+    directory = ensure_bundle(model_id)
+    model_config = load_config(directory)
+    model = empty_model(model_config)
+    result = model.load_state_dict(mmap_safetensors(os.path.join(directory, 'model.safetensors')), strict=False, assign=True)
+    # tied weights are saved once, and are restored by tie_weights()
+    missing = [name for name in result.missing_keys if name not in (getattr(model, '_tied_weights_keys', None) or [])]
+    if missing:
+        raise ValueError(f"The bundle of {model_id} at {directory} has no weights for:  {',  '.join(missing)}.")
+    model.tie_weights()
+    # from_config() may copy the configuration, without its _commit_hash
+    model.config._commit_hash = model_config._commit_hash
+    return model.eval()
+
+
+def load_tokenizer(model_id):
+    '''
+    Returns:
+        transformers.PreTrainedTokenizer: the tokenizer of the model, loaded from its bundle (see ensure_bundle()).
+    '''
+    return AutoTokenizer.from_pretrained(ensure_bundle(model_id))
+
+
+def memory_usage():
+    '''
+    Returns:
+        dict: the resident set size of the process ('rss_mb') and, on Linux, its proportional set size ('pss_mb'), where the pages shared
+        with other processes are divided between them, in MB. The PSS is None on other platforms.
+    '''
+    usage = {'rss_mb': None, 'pss_mb': None}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('Rss', 'Pss'):
+                    usage[f'{name.lower()}_mb'] = int(value.split()[0]) / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage['rss_mb'] = peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+    return usage
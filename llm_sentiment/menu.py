@@ -12,7 +12,9 @@ class Menu:
         Initialize the menu options for each prompt
         '''
         self.categories = {'1': 'pipeline_classifier',
-                           '2': 'classifier_classifier'}
+                           '2': 'classifier_classifier',
+                           '3': 'ensemble',
+                           '4': 'cascade'}
         self.model_lists = {'1': Config.MODEL_1,
                             '2': Config.MODEL_2,
                             '3': 'Both'}
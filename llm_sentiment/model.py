@@ -1,8 +1,10 @@
 # llm_sentiment/model.py
 
 
-from transformers import AutoTokenizer, AutoModelForSequenceClassification 
+import torch
 from llm_sentiment.config import Config
+from llm_sentiment.registry import ModelRegistry
+from llm_sentiment.precision import model_precision
 
 
 class ModelManage:
@@ -13,19 +15,32 @@ class ModelManage:
         '''
         Initialize the model, model configuration, and tokenizer.
 
+        The model and tokenizer are acquired from the shared ModelRegistry, so a checkpoint used by several instances is loaded only once.
+        The model is run in the precision given by the "PRECISION" key of model_choice, or by Config.PRECISION if it is not set.
+        The 'int8' precision is always run on CPU.
+
         Args:
             model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
         '''
 #         self.model_max_length = Config.MODEL_MAX_LENGTH #Use this if MAX_LENGTH is not working properly.
         self.model_choice = model_choice
         self.model_id = self.model_choice['ID']
-        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_id)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
-        
+        self.precision = model_precision(self.model_choice)
+        self.device = torch.device("cpu") if self.precision == 'int8' else ModelRegistry.default_device()
+        self.model, self.tokenizer = ModelRegistry.acquire(self.model_id, self.precision, self.device)
+        self.released = False
+
     def re_label(self):
         '''
         Customizes the ID2LABEL and LABEL2ID configuration of the chosen model.
         '''
         self.model.config.id2label = self.model_choice['ID2LABEL']
         self.model.config.label2id = self.model_choice['LABEL2ID']
-        
\ No newline at end of file
+
+    def release(self):
+        '''
+        Releases the reference held on the model in the ModelRegistry. Calling it more than once has no effect.
+        '''
+        if not self.released:
+            ModelRegistry.release(self.model_id, self.precision, self.device)
+            self.released = True
@@ -0,0 +1,281 @@
+# llm_sentiment/overlap.py
+
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from llm_sentiment.config import Config
+from llm_sentiment.batching import LengthBatcher, model_max_batch_tokens
+from llm_sentiment.instrumentation import Instrumentation
+
+
+_DONE = object()  # last item put to a queue by a stage
+
+
+class Stopped(Exception):
+    '''
+    Raised within a stage of an OverlappedInference when another stage has failed.
+    '''
+
+
+class OverlappedInference:
+    '''
+    This class runs the tokenization, collation, inference and post-processing of a Classifier concurrently, as stages connected by bounded queues,
+    instead of tokenizing the whole dataset before the first forward pass and post-processing the predictions after the last one.
+
+    - The dataset is read in blocks of Config.TOKENIZE_BATCH_SIZE examples, tokenized in order by a pool of tokenizer threads (fast tokenizers release the GIL)
+    - A collator thread groups the examples of each block into batches of similar token length (see LengthBatcher) and pads them
+    - The calling thread runs the forward passes of the batches
+    - A consumer thread scatters the predictions of each batch at the positions of its examples and maps their label ids to labels
+    - Each queue holds at most Config.OVERLAP_QUEUE_SIZE items, so a stage running ahead blocks until the next one catches up,
+      and only a few blocks of the dataset are held in memory at a time
+    - If a stage fails, the other stages stop and its exception is raised by run()
+
+    The stages are timed as in Classifier.inference() when the Instrumentation is enabled, so their totals add up to more than the wall time of the run.
+    '''
+    def __init__(self, classifier, tokenize_threads=None, queue_size=None):
+        '''
+        Args:
+            classifier (Classifier): the classifier whose tokenizer, backend and labels are used.
+            tokenize_threads (int): number of tokenizer threads. Defaults to Config.OVERLAP_TOKENIZE_THREADS, or 4 (at most the number of CPU cores) if it is None.
+            queue_size (int): maximum number of items waiting between two stages. Defaults to Config.OVERLAP_QUEUE_SIZE.
+        '''
+        self.classifier = classifier
+        self.tokenize_threads = tokenize_threads or Config.OVERLAP_TOKENIZE_THREADS or min(4, os.cpu_count() or 1)
+        self.queue_size = queue_size or Config.OVERLAP_QUEUE_SIZE
+        self.stop = threading.Event()
+        self.errors = []
+
+    def put(self, q, item):
+        '''
+        Puts item to the queue q, waiting for a free slot unless a stage has failed.
+
+        Raises:
+            Stopped, if a stage has failed.
+        '''
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise Stopped()
+
+    def get(self, q):
+        '''
+        Returns the next item of the queue q, waiting for it unless a stage has failed.
+
+        Raises:
+            Stopped, if a stage has failed.
+        '''
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise Stopped()
+
+    def start(self, target, *args):
+        '''
+        Runs target(*args) in a new thread, recording its exception in self.errors and stopping the other stages if it fails.
+
+        Returns:
+            threading.Thread: the started thread.
+        '''
+        def run():
+            try:
+                target(*args)
+            except Stopped:
+                pass
+            except BaseException as e:
+                self.errors.append(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def produce(self, dataset, encoded):
+        '''
+        Tokenizer stage: submits the blocks of the dataset to the tokenizer threads and puts (start of the block, future of its encoding) to encoded, in order.
+        '''
+        texts = dataset.select_columns([Config.COLUMN_TEXT])
+        block_size = Config.TOKENIZE_BATCH_SIZE
+        with ThreadPoolExecutor(max_workers=self.tokenize_threads) as executor:
+            for start in range(0, len(dataset), block_size):
+                block = texts[start:start + block_size][Config.COLUMN_TEXT]
+                self.put(encoded, (start, executor.submit(self.classifier.preprocess_inst.text_encoding, block)))
+        self.put(encoded, _DONE)
+
+    def collate(self, encoded, batches):
+        '''
+        Collator stage: splits each encoded block into batches of similar token length and puts (example indices, input_ids, attention_mask) to batches.
+        The tensors are pinned when the classifier runs on a GPU, so that they are copied to the device asynchronously.
+        '''
+        pad_token_id = self.classifier.tokenizer.pad_token_id or 0
+        max_tokens = model_max_batch_tokens(self.classifier.model_choice)
+        pin = str(self.classifier.device).startswith('cuda')
+        while True:
+            item = self.get(encoded)
+            if item is _DONE:
+                break
+            start, future = item
+            encoding = future.result()
+            for batch_indices in LengthBatcher(encoding.lengths, max_tokens).batches:
+                with Instrumentation.stage('collate'):
+                    input_ids, attention_mask = encoding.collate(batch_indices, pad_token_id)
+                    if pin:
+                        input_ids, attention_mask = input_ids.pin_memory(), attention_mask.pin_memory()
+                self.put(batches, (start + np.asarray(batch_indices, dtype=np.int64), input_ids, attention_mask))
+        self.put(batches, _DONE)
+
+    def infer(self, batches, results, return_probabilities):
+        '''
+        Inference stage: runs the forward pass of each batch and puts (example indices, predictions of the batch) to results.
+        '''
+        device = self.classifier.device
+        with torch.no_grad():
+            while True:
+                item = self.get(batches)
+                if item is _DONE:
+                    break
+                indices, input_ids, attention_mask = item
+                with Instrumentation.stage('host_to_device', device):
+                    input_ids, attention_mask = input_ids.to(device, non_blocking=True), attention_mask.to(device, non_blocking=True)
+                with Instrumentation.stage('forward', device):
+                    output_logits = self.classifier.backend(input_ids, attention_mask)
+                with Instrumentation.stage('softmax_argmax', device):
+                    probabilities = torch.softmax(output_logits.float(), dim=-1)
+                    pred_scores, pred_labels = torch.max(probabilities, dim=-1)
+                with Instrumentation.stage('device_to_host', device):
+                    batch_preds = {'label_ids': pred_labels.cpu().numpy(), 'score': pred_scores.cpu().numpy()}
+                    if return_probabilities:
+                        batch_preds['probabilities'] = probabilities.cpu().numpy()
+                self.put(results, (indices, batch_preds))
+
+                Instrumentation.count('batches')
+                Instrumentation.count('examples', len(indices))
+                Instrumentation.count('padded_tokens', input_ids.numel())
+        self.put(results, _DONE)
+
+    def consume(self, results, all_preds):
+        '''
+        Consumer stage: scatters the predictions of each batch into all_preds at the positions of its examples and adds their labels under the 'sentiment' key.
+        '''
+        self.classifier.model_manage.re_label()
+        id2label = self.classifier.id2label_array()
+        while True:
+            item = self.get(results)
+            if item is _DONE:
+                break
+            indices, batch_preds = item
+            with Instrumentation.stage('relabel'):
+                for k, v in batch_preds.items():
+                    all_preds[k][indices] = v
+                all_preds['sentiment'][indices] = np.take(id2label, batch_preds['label_ids'])
+
+    def run(self, dataset, return_probabilities=None):
+        '''
+        Predicts the sentiment of each example of the dataset with the stages running concurrently.
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+            return_probabilities (bool): if True the probabilities of all labels are returned too. Defaults to Config.RETURN_PROBABILITIES.
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids' (see Classifier.get_label()).
+        '''
+        if return_probabilities is None:
+            return_probabilities = Config.RETURN_PROBABILITIES
+        num_examples = len(dataset)
+        all_preds = {'label_ids': np.empty(num_examples, dtype=np.int64),
+                     'score': np.empty(num_examples, dtype=np.float32),
+                     'sentiment': np.empty(num_examples, dtype=object)}
+        if return_probabilities:
+            all_preds['probabilities'] = np.empty((num_examples, self.classifier.model.config.num_labels), dtype=np.float32)
+
+        self.stop.clear()
+        self.errors = []
+        encoded, batches, results = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+        threads = [self.start(self.produce, dataset, encoded),
+                   self.start(self.collate, encoded, batches),
+                   self.start(self.consume, results, all_preds)]
+        try:
+            self.infer(batches, results, return_probabilities)
+        except Stopped:
+            pass
+        except BaseException:
+            self.stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+        return all_preds
+
+
+class BackgroundConsumer:
+    '''
+    This class calls a function on each item put to it in a background thread, in order, so that the caller prepares the next item meanwhile.
+
+    At most max_pending items wait for the function, so put() blocks when the background thread falls behind and memory stays bounded.
+    An exception raised by the function is raised again by the following put() or by close(), and the items put after it are discarded.
+    '''
+    def __init__(self, function, max_pending=None):
+        '''
+        Args:
+            function (callable): the function called on each item.
+            max_pending (int): maximum number of items waiting for the function. Defaults to Config.OVERLAP_QUEUE_SIZE.
+        '''
+        self.function = function
+        self.queue = queue.Queue(maxsize=max_pending or Config.OVERLAP_QUEUE_SIZE)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if self.error is None:
+                try:
+                    self.function(item)
+                except BaseException as e:
+                    self.error = e
+
+    def put(self, item):
+        '''
+        Puts an item for the function, waiting while max_pending items are already waiting.
+
+        Raises:
+            the exception of the function, if it has failed on a previous item.
+        '''
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def join(self):
+        '''
+        Waits until the function has been called on all the items put so far and stops the background thread. Calling it more than once has no effect.
+        '''
+        if not self.closed:
+            self.closed = True
+            self.queue.put(_DONE)
+        self.thread.join()
+
+    def close(self):
+        '''
+        Waits until the function has been called on all the items put so far and stops the background thread.
+
+        Raises:
+            the exception of the function, if it has failed on an item.
+        '''
+        self.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,162 @@
+# llm_sentiment/parallel.py
+
+
+import os
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from transformers import AutoConfig
+from llm_sentiment.config import Config
+from llm_sentiment.cache import PredictionCache
+from llm_sentiment.loading import ensure_bundle, load_config
+from llm_sentiment.instrumentation import Instrumentation
+
+
+_worker_classifier = None  # Classifier instance of the current worker process, created by init_worker()
+_threads_lock = threading.Lock()
+
+
+@contextmanager
+def torch_threads(num_threads):
+    '''
+    Sets the number of torch intra-op threads of the process within the context, and restores the previous number on exit.
+    The number is process-wide, so the contexts of concurrent threads must not overlap: the models run concurrently should use one context around all of them.
+
+    Args:
+        num_threads (int): number of torch intra-op threads. If None, the number is left unchanged.
+    '''
+    if num_threads is None:
+        yield
+        return
+    with _threads_lock:
+        saved_threads = torch.get_num_threads()
+        torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        with _threads_lock:
+            torch.set_num_threads(saved_threads)
+
+
+def split_threads(num_models):
+    '''
+    Returns:
+        int: the number of torch intra-op threads of each of num_models models run concurrently by threads of this process, so that they do not oversubscribe the CPU cores.
+    '''
+    return max(1, torch.get_num_threads() // max(1, num_models))
+
+
+def init_worker(model_choice, num_threads, settings):
+    '''
+    Initializes a worker process of ParallelClassifier.
+
+    - Applies the settings of the parent process, with the prediction cache disabled since it is handled by the parent process,
+      and with tokenization in a single process since the workers already run in parallel
+    - Sets the number of torch intra-op threads of the worker
+    - Loads the model once by creating the Classifier instance used for all the shards processed by the worker
+    '''
+    global _worker_classifier
+    from llm_sentiment.classifier import Classifier
+
+    Config.override(**dict(settings, PREDICTION_CACHE=False, TOKENIZE_NUM_PROC=1))
+    torch.set_num_threads(num_threads)
+    _worker_classifier = Classifier(model_choice)
+
+
+def predict_shard(shard):
+    '''
+    Predicts the sentiment of the examples of a shard with the Classifier instance of the worker process.
+
+    Returns:
+        tuple: A dictionary of arrays with one entry per example of the shard (see Classifier.get_label()), and the stages and counters
+        recorded by the Instrumentation of the worker while predicting the shard (None if it is disabled).
+    '''
+    preds = _worker_classifier.compute_sentiment(shard)
+    return preds, Instrumentation.drain() if Config.INSTRUMENTATION else None
+
+
+class ParallelClassifier:
+    '''
+    This class runs the classifier inference in a pool of worker processes, each one holding its own copy of the model.
+    If Config.MODEL_BUNDLES is True, the workers map the weights of the same local bundle instead (see loading.load_model()), so that an fp32 model on CPU
+    is held once in memory, shared by all the workers through the page cache. With the 'fork' start method, the models already loaded by the parent process
+    are also shared copy-on-write.
+
+    The dataset is split into contiguous shards which are tokenized and predicted by the workers in parallel, and the predictions
+    of the shards are merged back in the original order of the examples. The predictions are cached by the main process, as in Classifier.
+    '''
+
+    def __init__(self, model_choice, num_workers=None, num_threads=None):
+        '''
+        Initializes the ParallelClassifier class.
+
+        - Starts num_workers worker processes (defaults to Config.NUM_WORKERS), each one loading the model once.
+        - Each worker uses num_threads torch intra-op threads, which defaults to Config.WORKER_THREADS, or to the number of CPU cores divided by the number of workers.
+        - If Config.PREDICTION_CACHE is True, a PredictionCache of the classifier predictions is created as self.cache.
+        - If Config.MODEL_BUNDLES is True, the bundle of the model is converted before the workers are started, so that they do not convert it concurrently.
+
+        Args:
+            model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+            num_workers (int): number of worker processes.
+            num_threads (int): number of torch intra-op threads of each worker process.
+        '''
+        self.model_choice = model_choice
+        self.num_workers = num_workers or Config.NUM_WORKERS
+        self.num_threads = num_threads or Config.WORKER_THREADS or max(1, (os.cpu_count() or 1) // self.num_workers)
+        model_path = ensure_bundle(self.model_choice['ID']) if Config.MODEL_BUNDLES else self.model_choice['ID']
+        self.pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                        mp_context=multiprocessing.get_context(Config.MP_START_METHOD),
+                                        initializer=init_worker,
+                                        initargs=(self.model_choice, self.num_threads, Config.snapshot()))
+        # the configuration of a bundle takes its revision from the bundle manifest, as the models loaded by loading.load_model() do
+        model_config = load_config(model_path) if Config.MODEL_BUNDLES else AutoConfig.from_pretrained(model_path)
+        self.cache = PredictionCache(self.model_choice, 'classifier', model_config) if Config.PREDICTION_CACHE else None
+
+    def compute_sentiment(self, dataset):
+        '''
+        - Keeps only the text column of the dataset and splits it into one contiguous shard per worker
+        - Submits the shards to the worker processes and waits for their predictions
+        - Concatenates the predictions of the shards in their original order
+        - Merges the stages and counters recorded by the workers into the Instrumentation of the main process
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Returns:
+            dict: A dictionary of arrays with one entry per example (see Classifier.get_label()).
+        '''
+        dataset = dataset.select_columns([Config.COLUMN_TEXT])
+        num_shards = max(1, min(self.num_workers, len(dataset)))
+        shards = [dataset.shard(num_shards=num_shards, index=i, contiguous=True) for i in range(num_shards)]
+
+        futures = [self.pool.submit(predict_shard, shard) for shard in shards]
+        shard_preds = []
+        for future in futures:
+            preds, instrumentation = future.result()
+            shard_preds.append(preds)
+            if instrumentation is not None:
+                Instrumentation.merge(instrumentation)
+
+        return {name: np.concatenate([preds[name] for preds in shard_preds]) for name in shard_preds[0]}
+
+    def get_sentiment(self, dataset):
+        '''
+        Predicts the sentiment of each example of the dataset with self.compute_sentiment().
+        If self.cache is set, only the examples whose predictions are not found in the cache are passed to self.compute_sentiment().
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Returns:
+            dict: A dictionary of arrays with one entry per example (see Classifier.get_label()).
+        '''
+        if self.cache is not None:
+            return self.cache.get_sentiment(dataset, self.compute_sentiment)
+        return self.compute_sentiment(dataset)
+
+    def close(self):
+        '''
+        Shuts down the worker processes.
+        '''
+        self.pool.shutdown()
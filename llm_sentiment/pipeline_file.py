@@ -1,10 +1,14 @@
 # llm_sentiment/pipeline_file.py
 
 
-import torch
+import numpy as np
 from transformers import pipeline
+from transformers.pipelines.pt_utils import KeyDataset
 from llm_sentiment.config import Config
+from llm_sentiment.cache import PredictionCache
+from llm_sentiment.batching import model_batch_size
 from llm_sentiment.model import ModelManage
+from llm_sentiment.instrumentation import Instrumentation
 
 class PipeLine:
     '''
@@ -16,10 +20,12 @@ class PipeLine:
 
         The self.task to be performed by pipeline is set according to Config.TASK.
         The selected model is obtained from the input provided to PipeLine instance and saved in self.model_choice.
-        An instance of ModelManage is created with the self.model_choice model.
+        An instance of ModelManage is created with the self.model_choice model. The model is shared through the ModelRegistry with any Classifier using the same model.
         The pipeline model is assigned from the model attribute of the ModelManage instance.
         The pipeline tokenizer is assigned from the model attribute of the ModelManage instance.
+        The model is already converted to its precision (fp32, bf16 or int8) by the ModelRegistry, so the pipeline and the Classifier run the same numerics.
         The pipeline generator self.pipe is created according to the settings.
+        If Config.PREDICTION_CACHE is True, a PredictionCache of the pipeline predictions is created as self.cache.
         
         Args:
             model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
@@ -33,29 +39,60 @@ class PipeLine:
         self.pipe = pipeline(self.task,
                         model=self.model,
                         tokenizer=self.tokenizer,
-                        torch_dtype=torch.bfloat16,
                         device_map=Config.DEVICE_MAP)
+        self.cache = PredictionCache(self.model_choice, 'pipeline', self.model.config) if Config.PREDICTION_CACHE else None
 
-    def get_sentiment(self, dataset):
+    def compute_sentiment(self, dataset):
         '''     
         - Customizes the model configuration by applying re_label() method on the ModelManage instance.
-        - Generates a list of sentiments associated with each example of the input dataset by applying self.pipe on 'sentence' column of dataset
-        - The process is run batch-by-batch and results are saved to output_list list.
+        - Generates the sentiment associated with each example of the input dataset by applying self.pipe on 'sentence' column of dataset
+        - The texts are read from the dataset example-by-example through a KeyDataset, so that the column is never copied into a Python list
+        - The pipeline run is timed as the 'pipeline' stage of the Instrumentation if it is enabled
+        - The process is run batch-by-batch and results are written to preallocated arrays of sentiments and scores.
+        - The label ids are obtained by mapping each distinct sentiment to its id once and taking them for all examples.
         
         Args:
             dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
         Returns:
-            list: The list of sentiments of each example of the dataset.
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids'.
         '''
         self.model_manage.re_label() 
-        output_list = []
+        sentiments = np.empty(len(dataset), dtype=object)
+        scores = np.empty(len(dataset), dtype=np.float32)
         
-#         Or you could use self.pipe(KeyDataset(dataset, Config.COLUMN_TEXT),..) after executing from transformers.pipelines.pt_utils import KeyDataset:      
-        for output in self.pipe(dataset[Config.COLUMN_TEXT],
-                                truncation=Config.TRUNCATION,
-                                padding=Config.PADDING,
-                                max_length=Config.MAX_LENGTH,
-                                batch_size=Config.BATCH_SIZE):
-            output_list.append(output)
+        texts = KeyDataset(dataset.select_columns([Config.COLUMN_TEXT]), Config.COLUMN_TEXT)
+        with Instrumentation.stage('pipeline'):
+            for i, output in enumerate(self.pipe(texts,
+                                                 truncation=Config.TRUNCATION,
+                                                 padding=Config.PADDING,
+                                                 max_length=Config.MAX_LENGTH,
+                                                 batch_size=model_batch_size(self.model_choice))):
+                sentiments[i] = output['label']
+                scores[i] = output['score']
+        Instrumentation.count('pipeline_examples', len(dataset))
+
+        labels, inverse = np.unique(sentiments.astype(str), return_inverse=True)
+        label2id = self.model.config.label2id
+        label_ids = np.take(np.array([label2id[label] for label in labels], dtype=np.int64), inverse)
             
-        return output_list
\ No newline at end of file
+        return {'sentiment': sentiments, 'score': scores, 'label_ids': label_ids}
+
+    def get_sentiment(self, dataset):
+        '''
+        Predicts the sentiment of each example of the dataset with self.compute_sentiment().
+        If self.cache is set, only the examples whose predictions are not found in the cache are passed to self.compute_sentiment().
+
+        Args:
+            dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids'.
+        '''
+        if self.cache is not None:
+            return self.cache.get_sentiment(dataset, self.compute_sentiment)
+        return self.compute_sentiment(dataset)
+
+    def close(self):
+        '''
+        Releases the model held by the pipeline in the shared ModelRegistry.
+        '''
+        self.model_manage.release()
@@ -1,8 +1,30 @@
 # llm_sentiment/pre_process.py
 
 
+import os
 from llm_sentiment.config import Config
 from llm_sentiment.model import ModelManage
+from llm_sentiment.encoding import RaggedEncoding, text_hash, tokenizer_fingerprint, evict_encodings
+from llm_sentiment.instrumentation import Instrumentation
+
+
+MAX_TOKENIZE_PROCS = 4  # default maximum number of tokenizer processes of slow tokenizers, each one holding a copy of the tokenizer
+
+
+def tokenize_batch(batch, tokenizer, column, truncation):
+    '''
+    Tokenizes the texts of the column of a batch without padding.
+    This function is mapped to the datasets instead of PreProcess.batch_encoding(), so that the tokenizer processes receive the tokenizer only, not the model held by PreProcess.
+
+    Returns:
+        dict: A dictionary containing the token ids of the input batch with 'input_ids' key.
+    '''
+    return tokenizer(batch[column],
+                     padding=False,
+                     truncation=truncation,
+                     return_attention_mask=False,
+                     return_token_type_ids=False)
+
 
 class PreProcess:
     '''
@@ -17,6 +39,7 @@ class PreProcess:
         An instance of ModelManege is created using self.model_choice.
         the model is assigned from ModelManage instance.
         the tokenizer is assigned from ModelManage instance.
+        the fingerprint of the tokenizer, keying the encoding cache, is computed on first use and saved in self.fingerprint.
 
         Args:
             model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
@@ -25,32 +48,88 @@ class PreProcess:
         self.model_manage = ModelManage(self.model_choice)
         self.tokenizer = self.model_manage.tokenizer
         self.model = self.model_manage.model
+        self.fingerprint = None
 
     def batch_encoding(self, batch):
         '''
         Tokenizes a batch of data.
+
+        The examples are not padded here: padding is applied per inference batch by the Classifier, once examples of similar length have been grouped together.
         
         Args:
             batch (datasets.Dataset): A batch of examples from a Hugging Face dataset.
         Returns:
-            dict: A dictionary containing encoded tensors for the input batch with 'sentence', 'label', 'input_ids', 'attention_mask' keys.               
+            dict: A dictionary containing the token ids of the input batch with 'input_ids' key.               
         '''          
-        encoded_batch = self.tokenizer(batch[Config.COLUMN_TEXT],
-                                        padding=Config.PADDING,
-                                        truncation=Config.TRUNCATION,
-                                        return_tensors="pt")
-        return encoded_batch
+        return tokenize_batch(batch, self.tokenizer, Config.COLUMN_TEXT, Config.TRUNCATION)
+
+    def text_encoding(self, texts):
+        '''
+        Tokenizes a list of texts directly, without mapping a dataset, as the blocks of the overlapped pipeline and the micro-batches of the inference server are.
+        The tokenization is timed as the 'tokenize' stage of the Instrumentation if it is enabled.
+
+        Args:
+            texts (list): the texts to be tokenized.
+        Returns:
+            RaggedEncoding: the token ids and token lengths of the texts.
+        '''
+        with Instrumentation.stage('tokenize'):
+            encoding = RaggedEncoding.from_lists(self.batch_encoding({Config.COLUMN_TEXT: texts})['input_ids'])
+        Instrumentation.count('tokens', len(encoding.input_ids))
+        return encoding
+
+    def num_proc(self, num_examples):
+        '''
+        Returns:
+            int: the number of processes used to tokenize num_examples examples, or None to tokenize in the main process.
+            Fast tokenizers already tokenize each batch with parallel threads, so processes are only used for slow tokenizers,
+            Config.TOKENIZE_NUM_PROC of them (MAX_TOKENIZE_PROCS, at most the number of CPU cores, if None) but no more than the number of batches.
+        '''
+        if self.tokenizer.is_fast:
+            return None
+        num_batches = -(-num_examples // Config.TOKENIZE_BATCH_SIZE)
+        num_proc = min(Config.TOKENIZE_NUM_PROC or min(MAX_TOKENIZE_PROCS, os.cpu_count() or 1), num_batches)
+        return num_proc if num_proc > 1 else None
     
     def encoding(self, dataset):
         '''
-        Maps the self.batch_encoding() method to the dataset.
+        - Looks for the encoding of the dataset in the encoding cache, keyed by the tokenizer fingerprint and the hash of the texts, if Config.ENCODING_CACHE is True
+        - Otherwise maps tokenize_batch() with the tokenizer to the dataset, Config.TOKENIZE_BATCH_SIZE examples at a time and in parallel processes for slow tokenizers
+        - Stores the token ids as a RaggedEncoding, without padding, and saves it to the encoding cache, evicting the least recently used encodings beyond Config.ENCODING_CACHE_MAX_BYTES
+        - The tokenization is timed as the 'tokenize' stage of the Instrumentation if it is enabled
         
         Args:
             dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.  
         Returns:
-            dict: A dictionary containing encoded tensors for the dataset with 'sentence', 'label', 'input_ids', 'attention_mask' keys.               
+            RaggedEncoding: the token ids and token lengths of the examples of the dataset.
         '''
-        encoded_dataset = dataset.map(self.batch_encoding,
-                                      batched=True,
-                                      batch_size=Config.BATCH_SIZE)
-        return encoded_dataset
\ No newline at end of file
+        cache_path = None
+        if Config.ENCODING_CACHE:
+            if self.fingerprint is None:
+                self.fingerprint = tokenizer_fingerprint(self.tokenizer)
+            cache_name = f'{self.fingerprint}-{text_hash(dataset)}.npz'
+            cache_path = os.path.join(Config.CACHE_DIR, 'encodings', cache_name)
+            if os.path.exists(cache_path):
+                Instrumentation.count('encoding_cache_hits')
+                encoding = RaggedEncoding.load(cache_path)
+                # marks the encoding as recently used for evict_encodings()
+                os.utime(cache_path)
+                return encoding
+
+        if len(dataset) == 0:
+            return RaggedEncoding([], [0])
+
+        with Instrumentation.stage('tokenize'):
+            encoded_dataset = dataset.map(tokenize_batch,
+                                          fn_kwargs={'tokenizer': self.tokenizer, 'column': Config.COLUMN_TEXT, 'truncation': Config.TRUNCATION},
+                                          batched=True,
+                                          batch_size=Config.TOKENIZE_BATCH_SIZE,
+                                          num_proc=self.num_proc(len(dataset)),
+                                          remove_columns=dataset.column_names)
+            encoding = RaggedEncoding.from_arrow(encoded_dataset.data.column('input_ids'))
+        Instrumentation.count('tokens', len(encoding.input_ids))
+
+        if cache_path is not None:
+            encoding.save(cache_path)
+            evict_encodings(os.path.dirname(cache_path), Config.ENCODING_CACHE_MAX_BYTES)
+        return encoding
@@ -0,0 +1,134 @@
+# llm_sentiment/precision.py
+
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from llm_sentiment.config import Config, PRECISIONS
+
+
+def model_precision(model_choice):
+    '''
+    Returns:
+        str: the precision of the model, the "PRECISION" key of model_choice if it is set, otherwise Config.PRECISION.
+    '''
+    return model_choice.get('PRECISION') or Config.PRECISION
+
+
+def apply_precision(model, precision, device):
+    '''
+    Converts a model loaded in fp32 to the given precision:
+    - 'fp32': the model is kept in 32-bit floating point
+    - 'bf16': the weights and activations are converted to bfloat16
+    - 'int8': the weights of the Linear layers are quantized to int8 and their activations are quantized dynamically at inference (CPU only)
+
+    Args:
+        model (transformers.PreTrainedModel): the model loaded in fp32.
+        precision (str): 'fp32', 'bf16' or 'int8'.
+        device (torch.device): the device the model is run on.
+    Raises:
+        ValueError, if the precision is not allowed or if 'int8' is used on a GPU.
+    Returns:
+        transformers.PreTrainedModel: the model in the given precision, carried to device.
+    '''
+    if precision == 'fp32':
+        return model.to(device)
+    elif precision == 'bf16':
+        return model.to(device=device, dtype=torch.bfloat16)
+    elif precision == 'int8':
+        if torch.device(device).type != 'cpu':
+            raise ValueError("The 'int8' precision is only available on CPU.")
+        return torch.ao.quantization.quantize_dynamic(model.to('cpu'), {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        raise ValueError(f"Invalid precision '{precision}'. Allowed precisions are:  {',  '.join(PRECISIONS)}.")
+
+
+def precision_drift_report(model_choice, dataset, precisions=('bf16', 'int8')):
+    '''
+    Compares the classifier predictions of the model in each precision with its fp32 predictions on the dataset.
+
+    For each precision it reports the throughput and speedup over fp32, the agreement of the predicted labels with fp32, the mean and maximum
+    absolute difference of the probabilities with fp32 and, if the dataset has a Config.COLUMN_LABEL column, the accuracy and its drift from fp32.
+    The prediction and encoding caches are disabled while the report is computed.
+
+    Args:
+        model_choice (dict): The configuration dictionary of the LLM model to be used from the Config class.
+        dataset (datasets.Dataset): a HuggingFace dataset containing data to be used.
+        precisions (list): the precisions compared with fp32.
+    Returns:
+        dict: A dictionary with the measures of fp32 and of each precision.
+    '''
+    from llm_sentiment.classifier import Classifier
+    from llm_sentiment.dataset_loader import DataSetLoader
+
+    saved_settings = Config.snapshot()
+    Config.override(PREDICTION_CACHE=False, ENCODING_CACHE=False, RETURN_PROBABILITIES=True)
+    true_labels = DataSetLoader.label_names(dataset)
+    report = {'model': model_choice['NAME'], 'rows': len(dataset), 'precisions': {}}
+
+    try:
+        reference = None
+        for precision in ['fp32'] + [p for p in precisions if p != 'fp32']:
+            cl = Classifier(dict(model_choice, PRECISION=precision))
+            start = time.perf_counter()
+            preds = cl.get_sentiment(dataset)
+            elapsed = time.perf_counter() - start
+            cl.close()
+
+            measures = {'seconds': elapsed, 'rows_per_sec': len(dataset) / elapsed}
+            if true_labels is not None:
+                measures['accuracy'] = float(np.mean(preds['sentiment'] == true_labels))
+            if reference is None:
+                reference = dict(preds, rows_per_sec=measures['rows_per_sec'], accuracy=measures.get('accuracy'))
+            else:
+                prob_diff = np.abs(preds['probabilities'] - reference['probabilities'])
+                measures.update(speedup=measures['rows_per_sec'] / reference['rows_per_sec'],
+                                label_agreement=float(np.mean(preds['label_ids'] == reference['label_ids'])),
+                                mean_abs_prob_diff=float(prob_diff.mean()) if prob_diff.size else 0.0,
+                                max_abs_prob_diff=float(prob_diff.max()) if prob_diff.size else 0.0)
+                if true_labels is not None:
+                    measures['accuracy_drift'] = measures['accuracy'] - reference['accuracy']
+            report['precisions'][precision] = measures
+    finally:
+        Config.override(**saved_settings)
+
+    return report
+
+
+def main(argv=None):
+    '''
+    Computes the precision drift report of the selected models on the first rows of Config.DATASET_NAME, prints it and saves it as JSON in Config.OUTPUT_DIR.
+    '''
+    from llm_sentiment.api import resolve_models
+    from llm_sentiment.dataset_loader import DataSetLoader
+
+    parser = argparse.ArgumentParser(description='Report the accuracy drift of reduced precisions against fp32 on the labeled dataset.')
+    parser.add_argument('--models', nargs='+', default=['Both'])
+    parser.add_argument('--precisions', nargs='+', default=['bf16', 'int8'], choices=PRECISIONS)
+    parser.add_argument('--dataset', default=Config.DATASET_NAME)
+    parser.add_argument('--rows', type=int, help='number of examples used, all of them if not set')
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args(argv)
+
+    dataset = DataSetLoader(args.dataset).dataset_load()
+    if args.rows:
+        dataset = dataset.select(range(min(args.rows, len(dataset))))
+
+    reports = [precision_drift_report(model_i, dataset, args.precisions) for model_i in resolve_models(args.models)]
+    for report in reports:
+        print(f"\n{report['model']} ({report['rows']} rows)")
+        for precision, measures in report['precisions'].items():
+            print(f"  {precision:<5} " + '  '.join(f'{k}={v:.4f}' for k, v in measures.items()))
+
+    output_path = args.output or os.path.join(Config.OUTPUT_DIR, 'precision_drift.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(reports, f, indent=2)
+    print(f'\nPrecision drift report has been saved at {output_path}.\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,241 @@
 # llm_sentiment/prediction.py
 
 
-from llm_sentiment.pipeline_file import PipeLine
-from llm_sentiment.classifier import Classifier
+import os
+from concurrent.futures import ThreadPoolExecutor
+from llm_sentiment.config import Config
+from llm_sentiment.instrumentation import Instrumentation
 
 class Prediction:
     '''
     This class predicts the sentiment analysis on the dataset using the models in model_list.
     If the category is 'pipeline_classifier' it will output predictions using both pipeline and classifier for each model.
     If the category is 'classifier_classifier' it will output predictions using a classifier for each model.
+    If the category is 'ensemble' it will output predictions using a classifier for each model, run in one pass by an EnsembleClassifier, and their combined predictions.
+    If the category is 'cascade' it will output the predictions of a Cascade of the classifiers of the models, where each model only predicts the examples the previous ones were not confident about.
+
+    The predictor classes, and torch and transformers with them, are only imported when the first predictor is created.
     '''
     
     def __init__(self, category, model_list, dataset):
         '''
         Initializes the Prediction class.
         
-        - self.category should be either: 1.'pipeline_classifier' or 2. 'classifier_classifier'.
+        - self.category should be either: 1.'pipeline_classifier', 2. 'classifier_classifier', 3. 'ensemble' or 4. 'cascade'.
             if is 'pipeline_classifier', then for each model in model_list a pipeline and a classifier will be used for prediction
-            if is 'classifier_classifier', then for each model in model_list 
+            if is 'classifier_classifier', then for each model in model_list a classifier will be used for prediction
+            if is 'ensemble', then the classifiers of all models in model_list are run together and their predictions combined 
+            if is 'cascade', then the classifiers of the models in model_list are run one after the other on the examples the previous ones were not confident about
         - self.model is the list of models that will be used for prediction
         - self.dataset is the dataset that is used for prediction.            
+        - self.cache_stats holds the prediction cache statistics of each model and path, filled by predict().
+        - self.predictors holds the PipeLine, Classifier and EnsembleClassifier instances created so far, so that models stay loaded when predict() is called on several datasets.
+        - self.ensemble_preds holds the combined predictions of the 'ensemble' category, filled by predict().
+        - self.cascade holds the Cascade of the 'cascade' category, created on first use, and self.cascade_preds its predictions, filled by predict().
+        - self.dedup_stats holds the number of rows and of unique texts predicted so far if Config.DEDUPLICATION is True, filled by predict().
         '''
         self.category = category
         self.model_list = model_list
         self.dataset = dataset
+        self.cache_stats = {}
+        self.predictors = {}
+        self.ensemble_preds = None
+        self.cascade = None
+        self.cascade_preds = None
+        self.dedup_stats = {'rows': 0, 'unique': 0}
+
+    def paths(self):
+        '''
+        Returns:
+            list: The prediction paths used for each model according to self.category, ['pipeline', 'classifier'] or ['classifier'].
+        Raises:
+            ValueError, if a category other than 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade' is passed as input.
+        '''
+        if self.category == 'pipeline_classifier':
+            return ['pipeline', 'classifier']
+        elif self.category in ('classifier_classifier', 'ensemble', 'cascade'):
+            return ['classifier']
+        else:
+            raise ValueError(f"Invalid category '{self.category}'. Allowed categories are:  pipeline_classifier,  classifier_classifier,  ensemble,  cascade.")
+
+    def get_predictor(self, model_i, path_name):
+        '''
+        Returns the PipeLine (path_name 'pipeline') or Classifier (path_name 'classifier') instance of model_i, creating it on first use.
+        If Config.NUM_WORKERS is greater than 1, a ParallelClassifier is used instead of a Classifier. When Config.CONCURRENT_MODELS is True,
+        the CPU cores are split between the workers of all models unless Config.WORKER_THREADS is set.
+        If Config.AUTOTUNE is True, the predictor is created with the tuned profile of the model on this host, tuned on self.dataset if there is none (see autotune.tuned_model()).
+        '''
+        key = (model_i['ID'], model_i.get('PRECISION'), model_i.get('BACKEND'), path_name)
+        if key not in self.predictors:
+            if Config.AUTOTUNE:
+                from llm_sentiment.autotune import tuned_model
+                model_i = tuned_model(model_i, path_name, self.dataset)
+            if path_name == 'pipeline':
+                from llm_sentiment.pipeline_file import PipeLine
+                self.predictors[key] = PipeLine(model_i)
+            elif Config.NUM_WORKERS > 1:
+                num_models = len(self.model_list) if Config.CONCURRENT_MODELS else 1
+                num_threads = Config.WORKER_THREADS or max(1, (os.cpu_count() or 1) // (Config.NUM_WORKERS * num_models))
+                from llm_sentiment.parallel import ParallelClassifier
+                self.predictors[key] = ParallelClassifier(model_i, num_threads=num_threads)
+            else:
+                from llm_sentiment.classifier import Classifier
+                self.predictors[key] = Classifier(model_i)
+        return self.predictors[key]
+
+    def concurrent(self):
+        '''
+        Returns:
+            bool: True if the models of self.model_list are run concurrently in threads of this process, when Config.CONCURRENT_MODELS is True and there is more than one model,
+            except for the 'ensemble' and 'cascade' categories, which run their models themselves.
+        '''
+        return Config.CONCURRENT_MODELS and len(self.model_list) > 1 and self.category not in ('ensemble', 'cascade')
+
+    def record_cache_stats(self, predictor, path_name):
+        '''
+        Saves the prediction cache statistics of a PipeLine or Classifier instance to self.cache_stats, if its cache is enabled.
+        '''
+        if predictor.cache is not None:
+            self.cache_stats[f'{predictor.model_choice["NAME"]}_{path_name}'] = predictor.cache.stats()
         
+    def predict_path(self, model_i, path_name):
+        '''
+        Predicts self.dataset with the PipeLine or Classifier of model_i (see self.get_predictor()) and records its cache statistics.
+        The prediction runs with the number of torch threads of the "TORCH_THREADS" key of the model, if it is set (e.g. by autotune.tuned_model()),
+        unless the models run concurrently, since they then share the threads of the process (see self.predict()).
+
+        Returns:
+            dict: A dictionary of arrays with one entry per example, containing the predicted 'sentiment', 'score' and 'label_ids'.
+        '''
+        from llm_sentiment.parallel import torch_threads
+
+        predictor = self.get_predictor(model_i, path_name)
+        num_threads = None if self.concurrent() else predictor.model_choice.get('TORCH_THREADS')
+        with torch_threads(num_threads), Instrumentation.stage(f'predict.{model_i["NAME"]}.{path_name}'):
+            preds = predictor.get_sentiment(self.dataset)
+        self.record_cache_stats(predictor, path_name)
+        return preds
+
+    def predict_ensemble(self):
+        '''
+        Predicts self.dataset with the EnsembleClassifier of self.model_list, creating it on first use, and saves the combined predictions to self.ensemble_preds.
+
+        Returns:
+            list: A list containing the classifier predictions associated with each model in self.model_list.
+        '''
+        key = ('ensemble',)
+        if key not in self.predictors:
+            from llm_sentiment.ensemble import EnsembleClassifier
+            model_list = self.model_list
+            if Config.AUTOTUNE:
+                from llm_sentiment.autotune import tuned_model
+                model_list = [tuned_model(model_i, 'classifier', self.dataset) for model_i in model_list]
+            self.predictors[key] = EnsembleClassifier(model_list)
+        ensemble = self.predictors[key]
+        member_preds, self.ensemble_preds = ensemble.get_sentiment(self.dataset)
+        self.cache_stats.update(ensemble.stats())
+        return member_preds
+
+    def predict_cascade(self):
+        '''
+        Predicts self.dataset with the Cascade of the classifiers of self.model_list, creating it on first use, and saves its predictions to self.cascade_preds.
+        Each model predicts its subset of the examples as self.predict_path() would, so the prediction cache and the instrumentation stages work as for the other categories.
+
+        Returns:
+            list: An empty list, since the models do not predict every example.
+        '''
+        if self.cascade is None:
+            from llm_sentiment.cascade import Cascade
+            self.cascade = Cascade(self.model_list)
+        dataset = self.dataset
+
+        def predict_stage(model_i, subset):
+            self.dataset = subset
+            return self.predict_path(model_i, 'classifier')
+
+        try:
+            self.cascade_preds = self.cascade.predict(dataset, predict_stage)
+        finally:
+            self.dataset = dataset
+        return []
+
+    def deduplicate(self):
+        '''
+        If Config.DEDUPLICATION is True, replaces self.dataset by the dataset of its unique texts (see TextDeduplicator), timed as the 'dedup' stage,
+        and adds its number of rows and of unique texts to self.dedup_stats.
+
+        Returns:
+            TextDeduplicator: the deduplicator whose expand() fans the predictions of the unique texts back out to every row, or None if Config.DEDUPLICATION is False.
+        '''
+        if not Config.DEDUPLICATION:
+            return None
+        from llm_sentiment.dedup import TextDeduplicator
+
+        with Instrumentation.stage('dedup'):
+            dedup = TextDeduplicator(self.dataset)
+        self.dataset = dedup.unique
+        self.dedup_stats['rows'] += dedup.rows
+        self.dedup_stats['unique'] += dedup.num_unique
+        Instrumentation.count('dedup_rows', dedup.rows)
+        Instrumentation.count('dedup_unique', dedup.num_unique)
+        return dedup
+
     def predict(self):
         '''
         Performs prediction using self.model_list models according to selected category on the self.dataset
+        If Config.CONCURRENT_MODELS is True, the models are run concurrently in separate threads instead of one after the other.
+        The torch threads of the process are then split evenly between the models (see parallel.split_threads()), unless the models run in worker processes.
+        The prediction of each model and path is timed as the 'predict.<NAME>.<path>' stage of the Instrumentation if it is enabled.
+        If Config.DEDUPLICATION is True, only the unique texts of self.dataset are predicted, and their predictions are expanded to every row (see self.deduplicate()).
         
         Args:
             None 
         Raises:
-            ValueError, if a category other than 'pipeline_classifier' or 'classifier_classifier' is passed as input.
+            ValueError, if a category other than 'pipeline_classifier', 'classifier_classifier', 'ensemble' or 'cascade' is passed as input.
         Returns:
             list: A list containing predictions associated with each model in self.model_list using:
                 - both the pipeline and classifier if 'pipeline_classifier' is selected as self.category
-                - a classifier if 'classifier_classifier' is selected as self.category
+                - a classifier if 'classifier_classifier' or 'ensemble' is selected as self.category (see self.predict_ensemble())
+                - no model if 'cascade' is selected as self.category, whose predictions are in self.cascade_preds (see self.predict_cascade())
         '''
-        pred_both = []
-   
-        if self.category == 'pipeline_classifier':
-
-            for model_i in self.model_list:
-        
-                pipe = PipeLine(model_i)
-                pred_pipe = pipe.get_sentiment(self.dataset)
+        paths = self.paths()
+        dataset = self.dataset
+        dedup = self.deduplicate()
 
-                cl = Classifier(model_i)
-                pred_cl = cl.get_sentiment(self.dataset)
+        def predict_model(model_i):
+            preds = [self.predict_path(model_i, path_name) for path_name in paths]
+            return preds if len(paths) > 1 else preds[0]
 
-                pred_both.append([pred_pipe, pred_cl])
-            
-            self.pred_both=pred_both
-            return self.pred_both
+        try:
+            if self.category == 'ensemble':
+                pred_both = self.predict_ensemble()
+            elif self.category == 'cascade':
+                pred_both = self.predict_cascade()
+            elif self.concurrent():
+                from llm_sentiment.parallel import torch_threads, split_threads
+                # the models share the torch threads of the process, while the workers of the parallel classifiers have their own
+                with torch_threads(split_threads(len(self.model_list)) if Config.NUM_WORKERS == 1 else None):
+                    with ThreadPoolExecutor(max_workers=len(self.model_list)) as executor:
+                        pred_both = list(executor.map(predict_model, self.model_list))
+            else:
+                pred_both = [predict_model(model_i) for model_i in self.model_list]
+        finally:
+            self.dataset = dataset
 
-        elif self.category == 'classifier_classifier':
-            
-            for model_i in self.model_list:
+        if dedup is not None:
+            pred_both = [[dedup.expand(p) for p in preds] if isinstance(preds, list) else dedup.expand(preds) for preds in pred_both]
+            if self.ensemble_preds is not None:
+                self.ensemble_preds = dedup.expand(self.ensemble_preds)
+            if self.cascade_preds is not None:
+                self.cascade_preds = dedup.expand(self.cascade_preds)
 
-                cl = Classifier(model_i)               
-                pred_cl = cl.get_sentiment(self.dataset)
-                
-                pred_both.append(pred_cl)
-                
-            self.pred_both=pred_both
-            return self.pred_both
+        self.pred_both=pred_both
+        return self.pred_both
 
-        else:
-            raise ValueError(f"Invalid category '{self.category}'. Allowed categories are:  pipeline_classifier,  classifier_classifier.")
-            
\ No newline at end of file
+    def close(self):
+        '''
+        Releases the models of all the predictors created by self.get_predictor().
+        '''
+        for predictor in self.predictors.values():
+            predictor.close()
+        self.predictors = {}
@@ -0,0 +1,145 @@
+# llm_sentiment/registry.py
+
+
+import threading
+from collections import OrderedDict
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from llm_sentiment.config import Config
+from llm_sentiment.precision import apply_precision
+from llm_sentiment.loading import load_model, load_tokenizer
+
+
+class ModelRegistry:
+    '''
+    This class is a process-wide registry of loaded models and tokenizers, so that a checkpoint is deserialized only once
+    no matter how many PipeLine, PreProcess or Classifier instances use it.
+
+    - Models are keyed by (model ID, precision, device), tokenizers are keyed by model ID.
+    - Every acquire() increments the reference count of the entry and every release() decrements it.
+    - Entries whose reference count drops to zero stay loaded and are evicted in least-recently-used order once there are
+      more than Config.MODEL_REGISTRY_SIZE of them, or once they take more than Config.MODEL_REGISTRY_MAX_BYTES bytes.
+    '''
+    _models = OrderedDict()
+    _tokenizers = {}
+    _lock = threading.RLock()
+
+    @staticmethod
+    def default_device():
+        '''
+        Returns:
+            torch.device: GPU if it is available, otherwise CPU.
+        '''
+        return torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    @staticmethod
+    def model_bytes(model):
+        '''
+        Returns:
+            int: number of bytes taken by the parameters and buffers of the model.
+        '''
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    @classmethod
+    def key(cls, model_id, precision, device):
+        '''
+        Returns:
+            tuple: the registry key associated with the model ID, precision and device.
+        '''
+        return (model_id, str(precision), str(device))
+
+    @classmethod
+    def acquire(cls, model_id, precision=None, device=None):
+        '''
+        Returns the model and tokenizer of model_id, loading them with from_pretrained only if they are not registered yet.
+        If Config.MODEL_BUNDLES is True, they are loaded from the local bundle of the model instead, whose weights are memory-mapped (see loading.load_model()).
+        The model is loaded in fp32 and then converted to precision with apply_precision().
+
+        Args:
+            model_id (str): ID of the model to be loaded from the Hugging Face Hub.
+            precision (str): 'fp32', 'bf16' or 'int8'. Defaults to Config.PRECISION.
+            device (torch.device): device the model is carried to. Defaults to default_device().
+        Returns:
+            tuple: A tuple containing the model and the tokenizer.
+        '''
+        precision = precision or Config.PRECISION
+        device = device or cls.default_device()
+        key = cls.key(model_id, precision, device)
+
+        with cls._lock:
+            entry = cls._models.get(key)
+            if entry is None:
+                if Config.MODEL_BUNDLES:
+                    model = load_model(model_id)
+                else:
+                    model = AutoModelForSequenceClassification.from_pretrained(model_id, torch_dtype=torch.float32)
+                model = apply_precision(model, precision, device)
+                model.eval()
+                entry = {'model': model, 'refs': 0, 'bytes': cls.model_bytes(model)}
+                cls._models[key] = entry
+
+            if model_id not in cls._tokenizers:
+                cls._tokenizers[model_id] = load_tokenizer(model_id) if Config.MODEL_BUNDLES else AutoTokenizer.from_pretrained(model_id)
+
+            entry['refs'] += 1
+            cls._models.move_to_end(key)
+            return entry['model'], cls._tokenizers[model_id]
+
+    @classmethod
+    def release(cls, model_id, precision=None, device=None):
+        '''
+        Decrements the reference count of the model and evicts idle models if the registry limits are exceeded.
+        '''
+        precision = precision or Config.PRECISION
+        device = device or cls.default_device()
+        key = cls.key(model_id, precision, device)
+
+        with cls._lock:
+            entry = cls._models.get(key)
+            if entry is not None and entry['refs'] > 0:
+                entry['refs'] -= 1
+            cls.evict()
+
+    @classmethod
+    def evict(cls):
+        '''
+        Evicts the least recently used models whose reference count is zero until the registry is within
+        Config.MODEL_REGISTRY_SIZE idle models taking at most Config.MODEL_REGISTRY_MAX_BYTES bytes.
+        '''
+        with cls._lock:
+            while True:
+                idle = [k for k, v in cls._models.items() if v['refs'] == 0]
+                if not idle:
+                    break
+                # the models in use are not counted, since they cannot be evicted
+                idle_bytes = sum(cls._models[k]['bytes'] for k in idle)
+                over_size = len(idle) > Config.MODEL_REGISTRY_SIZE
+                over_bytes = Config.MODEL_REGISTRY_MAX_BYTES is not None and idle_bytes > Config.MODEL_REGISTRY_MAX_BYTES
+                if not (over_size or over_bytes):
+                    break
+                del cls._models[idle[0]]
+
+            model_ids = {k[0] for k in cls._models}
+            for model_id in list(cls._tokenizers):
+                if model_id not in model_ids:
+                    del cls._tokenizers[model_id]
+
+    @classmethod
+    def clear(cls):
+        '''
+        Removes all models and tokenizers from the registry regardless of their reference counts.
+        '''
+        with cls._lock:
+            cls._models.clear()
+            cls._tokenizers.clear()
+
+    @classmethod
+    def stats(cls):
+        '''
+        Returns:
+            list: A list of dictionaries with the key, reference count and size in bytes of each registered model.
+        '''
+        with cls._lock:
+            return [{'model_id': k[0], 'precision': k[1], 'device': k[2], 'refs': v['refs'], 'bytes': v['bytes']}
+                    for k, v in cls._models.items()]
@@ -0,0 +1,267 @@
+# llm_sentiment/server.py
+
+
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from llm_sentiment.config import Config
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.api import resolve_models
+from llm_sentiment.instrumentation import Instrumentation
+
+
+class MicroBatcher:
+    '''
+    This class coalesces the concurrent prediction requests of one model into micro-batches.
+
+    Requests are queued, and a batch is run as soon as it holds Config.SERVER_MAX_BATCH_SIZE texts or Config.SERVER_MAX_WAIT_MS milliseconds
+    have passed since its first request. The forward pass runs in a single-thread executor so that the event loop keeps accepting requests.
+    The texts of a batch are tokenized and predicted directly (see Classifier.predict_texts()), without building a dataset or looking up the caches.
+    '''
+    def __init__(self, model_choice, max_batch_size=None, max_wait_ms=None):
+        '''
+        Initializes the MicroBatcher class and loads the Classifier of model_choice, which stays resident for the lifetime of the server.
+        '''
+        self.model_choice = model_choice
+        self.classifier = Classifier(model_choice)
+        self.max_batch_size = max_batch_size or Config.SERVER_MAX_BATCH_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else Config.SERVER_MAX_WAIT_MS) / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = asyncio.Queue()
+        self.metrics = {'requests': 0, 'texts': 0, 'batches': 0, 'errors': 0, 'fill_ratio_sum': 0.0, 'batch_seconds': 0.0}
+
+    def predict(self, texts):
+        '''
+        Predicts the sentiment of a batch of texts with the Classifier.
+
+        Returns:
+            list: A list of dictionaries with the 'sentiment' and 'score' of each text.
+        '''
+        preds = self.classifier.predict_texts(texts, return_probabilities=False)
+        return [{'sentiment': sentiment, 'score': float(score)} for sentiment, score in zip(preds['sentiment'], preds['score'])]
+
+    async def submit(self, texts):
+        '''
+        Queues the texts of a request and waits for their predictions.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        self.metrics['requests'] += 1
+        return await future
+
+    async def run(self):
+        '''
+        - Waits for a request and then collects further requests until the batch is full or the maximum wait time has passed
+        - A request which would overflow the batch is kept for the next batch, a single request larger than the batch is run alone
+        - Runs the batch in the executor and sets the predictions of each request
+        '''
+        loop = asyncio.get_running_loop()
+        carry = None
+        while True:
+            item = carry or await self.queue.get()
+            carry = None
+            batch = [item]
+            size = len(item[0])
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            start_time = time.perf_counter()
+            try:
+                preds = await loop.run_in_executor(self.executor, self.predict, texts)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.metrics['batches'] += 1
+            self.metrics['texts'] += len(texts)
+            self.metrics['fill_ratio_sum'] += min(len(texts) / self.max_batch_size, 1.0)
+            self.metrics['batch_seconds'] += time.perf_counter() - start_time
+
+            start = 0
+            for request_texts, future in batch:
+                if not future.done():
+                    future.set_result(preds[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self):
+        '''
+        Returns:
+            dict: the metrics of the batcher, with its current queue depth and average batch fill ratio.
+        '''
+        batches = self.metrics['batches']
+        return dict(self.metrics,
+                    queue_depth=self.queue.qsize(),
+                    batch_fill_ratio=self.metrics['fill_ratio_sum'] / batches if batches else 0.0)
+
+    def close(self):
+        self.executor.shutdown()
+        self.classifier.close()
+
+
+class SentimentServer:
+    '''
+    This class serves the predictions of resident models over HTTP, on a TCP port or a Unix socket.
+
+    Endpoints:
+        - POST /predict with a JSON body {"texts": [...], "model": "<NAME>"} returns {"model": "<NAME>", "predictions": [{"sentiment": ..., "score": ...}, ...]}.
+          The model is optional and defaults to the first served model.
+        - GET /health returns the status, served models and queue depths.
+        - GET /metrics returns the metrics in the Prometheus text format.
+    '''
+    def __init__(self, model_list):
+        '''
+        Initializes the SentimentServer class with one MicroBatcher per model of model_list.
+        '''
+        self.batchers = {model_i['NAME']: MicroBatcher(model_i) for model_i in model_list}
+        self.default_model = model_list[0]['NAME']
+        self.started = time.time()
+
+    async def handle_predict(self, body):
+        request = json.loads(body or b'{}')
+        texts = request.get('texts')
+        if isinstance(texts, str):
+            texts = [texts]
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {'error': 'The body must contain "texts", a list of strings.'}
+        model_name = request.get('model', self.default_model)
+        if model_name not in self.batchers:
+            return 404, {'error': f"Unknown model '{model_name}'. Served models are: {', '.join(self.batchers)}."}
+        if not texts:
+            return 200, {'model': model_name, 'predictions': []}
+        predictions = await self.batchers[model_name].submit(texts)
+        return 200, {'model': model_name, 'predictions': predictions}
+
+    def health(self):
+        return {'status': 'ok',
+                'uptime_seconds': time.time() - self.started,
+                'models': {name: {'queue_depth': batcher.queue.qsize()} for name, batcher in self.batchers.items()}}
+
+    def prometheus_metrics(self):
+        '''
+        Returns:
+            str: the metrics of all the batchers in the Prometheus text format, followed by the stage timings of the Instrumentation if it is enabled.
+        '''
+        metrics = [('requests_total', 'counter', 'requests', 'Number of prediction requests.'),
+                   ('texts_total', 'counter', 'texts', 'Number of predicted texts.'),
+                   ('batches_total', 'counter', 'batches', 'Number of micro-batches run.'),
+                   ('errors_total', 'counter', 'errors', 'Number of failed micro-batches.'),
+                   ('batch_seconds_total', 'counter', 'batch_seconds', 'Time spent running micro-batches.'),
+                   ('queue_depth', 'gauge', 'queue_depth', 'Number of requests waiting to be batched.'),
+                   ('batch_fill_ratio', 'gauge', 'batch_fill_ratio', 'Average number of texts per micro-batch relative to the maximum batch size.')]
+        stats = {name: batcher.stats() for name, batcher in self.batchers.items()}
+        lines = []
+        for metric, metric_type, key, description in metrics:
+            lines.append(f'# HELP llm_sentiment_{metric} {description}')
+            lines.append(f'# TYPE llm_sentiment_{metric} {metric_type}')
+            for name, model_stats in stats.items():
+                lines.append(f'llm_sentiment_{metric}{{model="{name}"}} {model_stats[key]}')
+        text = '\n'.join(lines) + '\n'
+        if Config.INSTRUMENTATION:
+            text += Instrumentation.prometheus()
+        return text
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Reads one HTTP request from the connection, routes it to its endpoint and writes the response.
+        '''
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            method, path = (request_line + ['', ''])[:2]
+            content_type = 'application/json'
+            try:
+                if method == 'POST' and path == '/predict':
+                    status, payload = await self.handle_predict(body)
+                elif method == 'GET' and path == '/health':
+                    status, payload = 200, self.health()
+                elif method == 'GET' and path == '/metrics':
+                    status, payload, content_type = 200, self.prometheus_metrics(), 'text/plain; version=0.0.4'
+                else:
+                    status, payload = 404, {'error': f'Unknown endpoint {method} {path}.'}
+            except json.JSONDecodeError:
+                status, payload = 400, {'error': 'The body is not valid JSON.'}
+            except Exception as e:
+                status, payload = 500, {'error': str(e)}
+
+            data = (payload if isinstance(payload, str) else json.dumps(payload)).encode('utf-8')
+            reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+            writer.write(f'HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: {content_type}\r\n'
+                         f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + data)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=None, port=None, unix_socket=None):
+        '''
+        Starts the micro-batchers and serves requests on the Unix socket if given, or on host:port (defaults to Config.SERVER_HOST and Config.SERVER_PORT).
+        '''
+        tasks = [asyncio.create_task(batcher.run()) for batcher in self.batchers.values()]
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            print(f'\nServing {", ".join(self.batchers)} on {unix_socket}.\n')
+        else:
+            server = await asyncio.start_server(self.handle_connection, host or Config.SERVER_HOST, port or Config.SERVER_PORT)
+            print(f'\nServing {", ".join(self.batchers)} on http://{host or Config.SERVER_HOST}:{port or Config.SERVER_PORT}.\n')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for batcher in self.batchers.values():
+                batcher.close()
+
+
+def main(argv=None):
+    '''
+    Parses the command line arguments and runs the server until it is interrupted.
+    '''
+    parser = argparse.ArgumentParser(description='Serve sentiment predictions with resident models and request micro-batching.')
+    parser.add_argument('--models', nargs='+', default=[Config.MODEL_1['NAME']], help=f"{Config.MODEL_1['NAME']}, {Config.MODEL_2['NAME']} or Both")
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--unix-socket', help='serve on this Unix socket instead of a TCP port')
+    parser.add_argument('--max-batch-size', type=int, default=Config.SERVER_MAX_BATCH_SIZE, help='maximum number of texts per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=Config.SERVER_MAX_WAIT_MS, help='maximum time a request waits for its micro-batch to fill')
+    args = parser.parse_args(argv)
+
+    # micro-batches are small and short-lived, caching their encodings on disk would only add files
+    Config.override(ENCODING_CACHE=False, SERVER_MAX_BATCH_SIZE=args.max_batch_size, SERVER_MAX_WAIT_MS=args.max_wait_ms)
+    server = SentimentServer(resolve_models(args.models))
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
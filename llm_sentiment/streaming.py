@@ -0,0 +1,188 @@
+# llm_sentiment/streaming.py
+
+
+import os
+import json
+from llm_sentiment.config import Config
+from llm_sentiment.prediction import Prediction
+from llm_sentiment.instrumentation import Instrumentation
+
+
+class StreamingWorkFlow:
+    '''
+    This class handles the workflow of WorkFlow for datasets larger than memory: the dataset is read, predicted and exported chunk-by-chunk.
+
+    Only one chunk of Config.STREAMING_CHUNK_SIZE examples and its predictions are held in memory at a time, and the rows of each chunk are passed to the
+    output writer as soon as they are predicted. The progress is saved after each flushed chunk, so an interrupted run resumes from the last durable rows:
+    the last flushed chunk for CSV and JSON Lines, the last closed partition for Parquet and Arrow (see writers.OutputWriter).
+    '''
+
+    def __init__(self, category, model_list, dataset_name, dataframe_type, output_path=None):
+        '''
+        Initializes the necessary attributes based on the inputs provided to the class object.
+
+        The progress of the run is saved next to the output file, in self.progress_path, and if Config.EVALUATION is True the evaluation report in self.evaluation_path.
+        The progress is only resumed by a run with the same self.signature: the settings the predictions depend on (see checkpoint.prediction_settings()),
+        the dataset, and the settings of the output rows and of the evaluation, so that rows produced under other settings are never appended to the output.
+        '''
+        from llm_sentiment.writers import resolve_output_path
+        from llm_sentiment.checkpoint import prediction_settings
+
+        self.category = category
+        self.model_list = model_list
+        self.dataset_name = dataset_name
+        self.dataframe_type = dataframe_type
+        self.output_path = resolve_output_path(output_path or Config.OUTPUT_DATASET_PATH, Config.OUTPUT_FORMAT, Config.OUTPUT_PARTITION_ROWS)
+        self.progress_path = self.output_path.rstrip(os.sep) + '.progress.json'
+        self.evaluation_path = self.output_path.rstrip(os.sep) + '.evaluation.json'
+        self.evaluator = None
+        self.signature = dict(prediction_settings(category, model_list),
+                              dataset=[dataset_name, Config.DATASET_CONFIG, Config.DATASET_SPLIT, Config.COLUMN_TEXT, Config.COLUMN_LABEL],
+                              dataframe=[dataframe_type, Config.DECIMAL_PLACE, Config.COMPACT_DATAFRAME],
+                              output_format=Config.OUTPUT_FORMAT,
+                              partition_rows=Config.OUTPUT_PARTITION_ROWS,
+                              evaluation=[Config.EVALUATION, Config.EVALUATION_BINS])
+
+    def load_progress(self):
+        '''
+        Returns:
+            dict: The saved progress of an unfinished run with the same settings, with 'rows' (durably exported rows), 'chunks', 'writer' (state of the output writer)
+            and 'evaluation' (the counts of the Evaluator when all the exported rows were durable, and the number of these 'rows') keys.
+            If there is no such run, the progress of a new run is returned.
+        '''
+        progress = {'rows': 0, 'chunks': 0, 'writer': None, 'evaluation': None}
+        if os.path.exists(self.progress_path) and os.path.exists(self.output_path):
+            with open(self.progress_path) as f:
+                saved = json.load(f)
+            if saved.get('signature') == self.signature and not saved.get('completed'):
+                progress = {k: saved[k] for k in progress}
+        return progress
+
+    def save_progress(self, progress, completed=False):
+        '''
+        Saves the progress atomically by writing it to a temporary file which then replaces self.progress_path.
+        '''
+        tmp_path = self.progress_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(progress, signature=self.signature, completed=completed), f)
+        os.replace(tmp_path, self.progress_path)
+
+    def run(self):
+        '''
+        This method:
+        - Loads the progress of an unfinished run and resumes the output writer after its durable rows, or starts a new output
+        - Creates a Prediction object with self.category and self.model_list, whose models stay loaded for all chunks
+        - Iterates over the chunks of the dataset in streaming mode, skipping the examples already exported
+        - Performs predictions on each chunk and builds its MultiIndex or Regular DataFrame according to self.dataframe_type
+        - If Config.EVALUATION is True, adds the predictions of the chunk to the counts of an Evaluator (timed as the 'evaluate' stage), so that the predictions are never held in memory
+        - Writes the rows of the chunk, flushes the writer and saves the progress, which includes the counts of the Evaluator
+        - If Config.OVERLAP_PIPELINE is True, the DataFrame of each chunk is built and written by a BackgroundConsumer thread while the next chunk is predicted,
+          with at most Config.OVERLAP_QUEUE_SIZE chunks waiting to be written
+        - If Config.INSTRUMENTATION is True, the 'load', 'dataframe' and 'save' stages of each chunk are timed, and if Config.PROFILER is set the run is profiled
+
+        Ags:
+            None
+        Raises:
+            ValueError, if a format other than 'csv', 'jsonl', 'parquet' or 'arrow' is set in Config.OUTPUT_FORMAT.
+        Returns:
+            int: the total number of rows exported.
+        '''
+        from llm_sentiment.dataset_loader import DataSetLoader
+        from llm_sentiment.dataframe import DataFrameBuilder
+        from llm_sentiment.evaluation import Evaluator
+        from llm_sentiment.writers import create_writer
+        from llm_sentiment.labels import label_categories
+
+        progress = self.load_progress()
+        writer = create_writer(self.output_path, self.model_list, state=progress['writer'])
+        rows = progress['rows']
+        evaluation = progress['evaluation']
+        if Config.EVALUATION:
+            self.evaluator = Evaluator.from_state(evaluation['counts']) if evaluation else Evaluator(label_categories(self.model_list))
+            missed = rows - (evaluation['rows'] if evaluation else 0)
+            if missed:
+                # columnar outputs are durable per partition, so the counts may have been saved before the last durable rows
+                print(f'The predictions of {missed} rows exported by the interrupted run are not evaluated.')
+
+        predictor = Prediction(self.category, self.model_list, None)
+        dsl = DataSetLoader(self.dataset_name)
+        chunks = dsl.dataset_chunks(Config.STREAMING_CHUNK_SIZE, skip=progress['rows'])
+
+        def export_chunk(item):
+            # the counts of the Evaluator are taken when the chunk is evaluated, since the next chunks may be evaluated before it is written
+            nonlocal rows, evaluation, progress
+            dfb, counts = item
+            with Instrumentation.stage('dataframe'):
+                df = dfb.multi_index() if self.dataframe_type == 'MultiIndex' else dfb.regular()
+                df.index = range(rows, rows + len(df))
+
+            with Instrumentation.stage('save'):
+                writer.write(df)
+                state = writer.flush()
+            rows += len(df)
+            if counts is not None and state['rows'] == rows:
+                evaluation = {'rows': rows, 'counts': counts}
+            progress = {'rows': state['rows'], 'chunks': progress['chunks'] + 1, 'writer': state, 'evaluation': evaluation}
+            self.save_progress(progress)
+
+        consumer = None
+        if Config.OVERLAP_PIPELINE:
+            from llm_sentiment.overlap import BackgroundConsumer
+            consumer = BackgroundConsumer(export_chunk)
+
+        Instrumentation.reset()
+        try:
+            with Instrumentation.profile('streaming'):
+                while True:
+                    with Instrumentation.stage('load'):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    predictor.dataset = chunk
+                    predictor.predict()
+                    counts = None
+                    if self.evaluator is not None:
+                        with Instrumentation.stage('evaluate'):
+                            self.evaluator.evaluate(predictor)
+                            counts = self.evaluator.state()
+                    item = (DataFrameBuilder(predictor), counts)
+                    if consumer is not None:
+                        consumer.put(item)
+                    else:
+                        export_chunk(item)
+                if consumer is not None:
+                    consumer.close()
+                with Instrumentation.stage('save'):
+                    state = writer.close()
+        finally:
+            if consumer is not None:
+                consumer.join()
+            predictor.close()
+
+        self.save_progress({'rows': state['rows'], 'chunks': progress['chunks'], 'writer': state, 'evaluation': evaluation}, completed=True)
+        for name, stats in predictor.cache_stats.items():
+            print(f"Prediction cache of {name}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+        if predictor.dedup_stats['rows']:
+            rows, unique = predictor.dedup_stats['rows'], predictor.dedup_stats['unique']
+            print(f"Deduplication: {unique} unique texts in {rows} rows ({1 - unique / rows:.1%} of the rows not predicted)")
+        if predictor.cascade is not None:
+            stats = predictor.cascade.stats()
+            decided = ', '.join(f"{name} decided {stage['decided']} of {stage['scored']} rows" for name, stage in stats['stages'].items())
+            print(f"Cascade: {decided} ({stats['work_saved']:.1%} of the model work saved)")
+
+        self.rows = state['rows']
+        return self.rows
+
+    def save(self):
+        '''
+        The output rows are exported while running, this method only reports where the output dataset has been saved,
+        exports the evaluation report of the run to self.evaluation_path if Config.EVALUATION is True,
+        and exports the instrumentation report of the run if Config.INSTRUMENTATION is True.
+        '''
+        print(f'\nOutput dataset has been saved at {self.output_path}.\n')
+        if self.evaluator is not None:
+            if self.evaluator.rows:
+                self.evaluator.export(self.evaluation_path)
+            else:
+                print(f"The dataset has no labeled '{Config.COLUMN_LABEL}' column, the predictions are not evaluated.")
+        Instrumentation.export('streaming')
@@ -1,25 +1,40 @@
 # llm_sentiment/workflow.py
 
 
+import os
 from llm_sentiment.config import Config
 from llm_sentiment.prediction import Prediction
-from llm_sentiment.dataframe import DataFrameBuilder
-from llm_sentiment.dataset_loader import DataSetLoader
+from llm_sentiment.instrumentation import Instrumentation
 
 
 class WorkFlow:
     '''
-    This class handles the workflow of loading dataset, making predictions, creating a output DataFrame, and exporting results as CSV file.
+    This class handles the workflow of loading dataset, making predictions, creating a output DataFrame, and exporting results as CSV, JSON Lines, Parquet or Arrow files.
+    The modules of each step, and the libraries they depend on (datasets, pandas, pyarrow, torch, transformers), are imported when the step is run.
     '''
 
-    def __init__(self, category, model_list, dataset_name, dataframe_type):
+    def __init__(self, category, model_list, dataset_name, dataframe_type, output_path=None):
         '''
         Initializes the necessary attributes based on the inputs provided to the class object.
+
+        The output is exported to output_path, or to Config.OUTPUT_DATASET_PATH if it is None, with the extension of Config.OUTPUT_FORMAT
+        (or as a directory of files if Config.OUTPUT_PARTITION_ROWS is set, see resolve_output_path()).
+        If Config.EVALUATION is True, the evaluation report is exported next to the output, to self.evaluation_path.
+        If Config.CHECKPOINT is True, the predictions are checkpointed shard-by-shard next to the output (see RunCheckpoint).
         '''
+        from llm_sentiment.writers import resolve_output_path
+
         self.category = category
         self.model_list = model_list
         self.dataset_name = dataset_name
         self.dataframe_type = dataframe_type
+        self.output_path = resolve_output_path(output_path or Config.OUTPUT_DATASET_PATH, Config.OUTPUT_FORMAT, Config.OUTPUT_PARTITION_ROWS)
+        self.evaluation_path = self.output_path.rstrip(os.sep) + '.evaluation.json'
+        self.evaluator = None
+        self.checkpoint = None
+        if Config.CHECKPOINT:
+            from llm_sentiment.checkpoint import RunCheckpoint
+            self.checkpoint = RunCheckpoint(category, model_list, dataset_name, self.output_path)
 
     def run(self):
         '''
@@ -27,35 +42,84 @@ class WorkFlow:
         - Creates a DataSetLoader object with self.dataset_name as input
         - Loads the dataset by calling dataset_load() on DataSetLoader object
         - Creates a Prediction object with self.category, self.model_list, and dataset passed as inputs
-        - Performs predictions by calling predict() method on Prediction object
+        - Performs predictions by calling predict() method on Prediction object and prints the prediction cache statistics
+          (if Config.CHECKPOINT is True, the predictions are made shard-by-shard by self.checkpoint instead, which resumes an interrupted run)
+        - If Config.EVALUATION is True, evaluates the predictions against the ground truth labels of the dataset with an Evaluator (timed as the 'evaluate' stage),
+          once all of them are made (StreamingWorkFlow evaluates each chunk as soon as it is predicted instead)
         - Passes the Prediction object as input to to DataFrameBuilder class to build an instance
         - If selected self.dataframe_type is 'MultiIndex', then multi_index() method is called on DataFrameBuilder object to create MultiIndex DataFrame of the outputs
         - If selected self.dataframe_type is 'Regular', then regular() method is called on DataFrameBuilder object to create Regular DataFrame of the outputs
         - the created DataFrame self.df is returned
+        - If Config.INSTRUMENTATION is True, the 'load' and 'dataframe' stages are timed, and if Config.PROFILER is set the run is profiled
         
         Ags:
             None
         Returns:
             pd.DataFrame: a multiIndex or regular DataFrame with initial text data, sentiment predictions, scores using for each model.
         '''
-        dsl = DataSetLoader(self.dataset_name)
-        dataset = dsl.dataset_load()
-        predictor = Prediction(self.category, self.model_list, dataset)
-        predictor.predict()
-        dfb = DataFrameBuilder(predictor)
-        if self.dataframe_type == 'MultiIndex':
-            self.df = dfb.multi_index()
-        else:
-            self.df = dfb.regular()
-            
+        from llm_sentiment.dataset_loader import DataSetLoader
+        from llm_sentiment.dataframe import DataFrameBuilder
+        from llm_sentiment.evaluation import Evaluator
+        from llm_sentiment.labels import label_categories
+
+        Instrumentation.reset()
+        with Instrumentation.profile('workflow'):
+            with Instrumentation.stage('load'):
+                dsl = DataSetLoader(self.dataset_name)
+                dataset = dsl.dataset_load()
+            predictor = Prediction(self.category, self.model_list, dataset)
+            if self.checkpoint is not None:
+                self.checkpoint.predict(predictor)
+            else:
+                predictor.predict()
+            predictor.close()
+            if Config.EVALUATION:
+                with Instrumentation.stage('evaluate'):
+                    self.evaluator = Evaluator(label_categories(self.model_list))
+                    if not self.evaluator.evaluate(predictor):
+                        print(f"The dataset has no '{Config.COLUMN_LABEL}' column, the predictions are not evaluated.")
+            for name, stats in predictor.cache_stats.items():
+                print(f"Prediction cache of {name}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+            if predictor.dedup_stats['rows']:
+                rows, unique = predictor.dedup_stats['rows'], predictor.dedup_stats['unique']
+                print(f"Deduplication: {unique} unique texts in {rows} rows ({1 - unique / rows:.1%} of the rows not predicted)")
+            if predictor.cascade is not None:
+                stats = predictor.cascade.stats()
+                decided = ', '.join(f"{name} decided {stage['decided']} of {stage['scored']} rows" for name, stage in stats['stages'].items())
+                print(f"Cascade: {decided} ({stats['work_saved']:.1%} of the model work saved)")
+            with Instrumentation.stage('dataframe'):
+                dfb = DataFrameBuilder(predictor)
+                if self.dataframe_type == 'MultiIndex':
+                    self.df = dfb.multi_index()
+                else:
+                    self.df = dfb.regular()
+
         return self.df
     
     def save(self):
         '''
-        This method exports the output DataFrame self.df to the directory at Config.OUTPUT_DATASET_PATH when called on the self.df
-        '''
-        self.df.to_csv(Config.OUTPUT_DATASET_PATH)
-        print(f'\nOutput dataset has been saved at {Config.OUTPUT_DATASET_PATH}.\n')
-
+        This method exports the output DataFrame self.df to self.output_path with the writer of the Config.OUTPUT_FORMAT format (see writers.create_writer()):
+        - 'csv': CSV files
+        - 'jsonl': JSON Lines files with one object per row, where the levels of MultiIndex columns are joined with '_'
+        - 'parquet': compressed Parquet files with float32 scores and categorical sentiments
+        - 'arrow': Arrow IPC files with float32 scores and categorical sentiments
+        If Config.OUTPUT_PARTITION_ROWS is set, the rows are split into files of Config.OUTPUT_PARTITION_ROWS rows within the self.output_path directory.
+        If Config.EVALUATION is True, the evaluation report of the run is exported to self.evaluation_path.
+        If Config.CHECKPOINT is True, the checkpoint of the run is removed once the output is saved.
+        If Config.INSTRUMENTATION is True, the export is timed as the 'save' stage and the instrumentation report of the run is then exported.
 
+        Raises:
+            ValueError, if a format other than 'csv', 'jsonl', 'parquet' or 'arrow' is set in Config.OUTPUT_FORMAT.
+        '''
+        from llm_sentiment.writers import create_writer
 
+        with Instrumentation.stage('save'):
+            writer = create_writer(self.output_path, self.model_list)
+            writer.write(self.df)
+            writer.close()
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+        print(f'\nOutput dataset has been saved at {self.output_path}.\n')
+        if self.evaluator is not None and self.evaluator.rows:
+            self.evaluator.export(self.evaluation_path)
+        Instrumentation.export()
@@ -0,0 +1,279 @@
+# llm_sentiment/writers.py
+
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from llm_sentiment.config import Config, OUTPUT_FORMATS
+from llm_sentiment.labels import label_categories
+
+
+def flatten_columns(df):
+    '''
+    Returns:
+        pd.DataFrame: the DataFrame whose MultiIndex columns, if any, are flattened by joining their levels with '_'.
+    '''
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = ['_'.join(filter(None, col)) for col in df.columns]
+    return df
+
+
+class OutputWriter:
+    '''
+    This class is the base class of the output writers. A writer accepts the rows of the output DataFrame batch-by-batch with write().
+
+    - If partition_rows is None, all rows are written to the file at path
+    - Otherwise path is a directory and the rows are split into files of partition_rows rows, named part-00000, part-00001, ... with the extension of the format
+    - flush() and close() return the state of the writer: the number of 'rows' durably written, the index of the current file in 'parts', and the 'part_rows' and
+      byte 'offset' of the current file. A writer created with the state of an interrupted writer resumes after its durable rows, removing anything written after them
+    '''
+    extension = None
+    appendable = False
+
+    def __init__(self, path, partition_rows=None, categories=None, state=None):
+        '''
+        Args:
+            path (str): path of the output file, or of the output directory if partition_rows is set.
+            partition_rows (int): maximum number of rows per file.
+            categories (list): the labels of the sentiment columns.
+            state (dict): the state of an interrupted writer to resume, None to start a new output.
+        '''
+        self.path = path
+        self.partition_rows = partition_rows
+        self.categories = categories
+        state = state or {'rows': 0, 'parts': 0, 'part_rows': 0, 'offset': 0}
+        self.part = state['parts']
+        self.part_rows = state['part_rows'] if self.appendable else 0
+        self.offset = state['offset'] if self.appendable else 0
+        self.rows = state['rows'] - self.part_rows  # rows of the closed files
+
+        if partition_rows:
+            os.makedirs(path, exist_ok=True)
+            for part_path in glob.glob(os.path.join(path, f'part-*.{self.extension}*')):
+                part_index = int(os.path.basename(part_path).split('.')[0].split('-')[1])
+                if part_index > self.part or (part_index == self.part and not self.appendable) or part_path.endswith('.tmp'):
+                    os.remove(part_path)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def part_path(self):
+        '''
+        Returns:
+            str: the path of the current file.
+        '''
+        if self.partition_rows:
+            return os.path.join(self.path, f'part-{self.part:05d}.{self.extension}')
+        return self.path
+
+    def prepare(self, df):
+        '''
+        Returns:
+            pd.DataFrame: the DataFrame with flattened columns (see flatten_columns()).
+        '''
+        return flatten_columns(df)
+
+    def write(self, df):
+        '''
+        Writes the rows of the DataFrame, starting a new file each time the current one holds self.partition_rows rows.
+        '''
+        start = 0
+        while start < len(df):
+            stop = len(df) if not self.partition_rows else min(len(df), start + self.partition_rows - self.part_rows)
+            self.write_part(df.iloc[start:stop])
+            self.part_rows += stop - start
+            start = stop
+            if self.partition_rows and self.part_rows >= self.partition_rows:
+                self.next_part()
+
+    def next_part(self):
+        '''
+        Closes the current file and moves on to the next one.
+        '''
+        self.close_part()
+        self.rows += self.part_rows
+        self.part += 1
+        self.part_rows = 0
+        self.offset = 0
+
+    def close(self):
+        '''
+        Closes the current file. A non-partitioned output is written even if it has no rows.
+
+        Returns:
+            dict: the final state of the writer.
+        '''
+        if self.part_rows or not self.partition_rows:
+            self.next_part()
+        return {'rows': self.rows, 'parts': self.part, 'part_rows': 0, 'offset': 0}
+
+
+class RowWriter(OutputWriter):
+    '''
+    This class is the base class of the writers of text row formats, which are appended to after each batch.
+    When resuming, the current file is truncated to the saved offset, since all its rows are durable after each flush().
+    '''
+    appendable = True
+
+    def __init__(self, path, partition_rows=None, categories=None, state=None):
+        super().__init__(path, partition_rows, categories, state)
+        with open(self.part_path(), 'a+b') as f:
+            f.truncate(self.offset)
+
+    def write_part(self, df):
+        data = self.encode(self.prepare(df), header=self.offset == 0)
+        with open(self.part_path(), 'ab') as f:
+            f.write(data)
+            self.offset = f.tell()
+
+    def flush(self):
+        '''
+        Flushes the current file to disk.
+
+        Returns:
+            dict: the state of the writer, whose rows are all durable.
+        '''
+        with open(self.part_path(), 'ab') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        return {'rows': self.rows + self.part_rows, 'parts': self.part, 'part_rows': self.part_rows, 'offset': self.offset}
+
+    def close_part(self):
+        self.flush()
+
+
+class CsvWriter(RowWriter):
+    '''
+    This class writes CSV files with the header of the DataFrame, MultiIndex headers included, at the top of each file and the index as first column.
+    '''
+    extension = 'csv'
+
+    def prepare(self, df):
+        return df
+
+    def encode(self, df, header):
+        return df.to_csv(header=header).encode('utf-8')
+
+
+class JsonlWriter(RowWriter):
+    '''
+    This class writes JSON Lines files with one object per row, where the levels of MultiIndex columns are joined with '_'.
+    '''
+    extension = 'jsonl'
+
+    def encode(self, df, header):
+        return df.to_json(orient='records', lines=True).rstrip('\n').encode('utf-8') + b'\n' if len(df) else b''
+
+
+class ColumnarWriter(OutputWriter):
+    '''
+    This class is the base class of the writers of typed columnar formats: float32 scores, dictionary-encoded sentiments and flattened column names.
+    A columnar file is written to a temporary file which replaces the final file once it is closed, so only the rows of closed files are durable and resumable.
+    '''
+    def __init__(self, path, partition_rows=None, categories=None, state=None):
+        super().__init__(path, partition_rows, categories, state)
+        self.schema = None
+        self.writer = None
+
+    def prepare(self, df):
+        '''
+        Flattens the columns of the DataFrame and converts the score columns to float32 and the sentiment and vote columns to categoricals of self.categories.
+
+        Raises:
+            ValueError, if a sentiment is not one of self.categories.
+        '''
+        df = flatten_columns(df).copy()
+        for col in df.columns:
+            if str(col).endswith('score'):
+                df[col] = df[col].astype(np.float32)
+            elif str(col).endswith(('sentiment', 'vote')) and self.categories is not None:
+                values = df[col]
+                df[col] = pd.Categorical(values, categories=self.categories)
+                if df[col].isna().sum() != values.isna().sum():
+                    unknown = set(values.dropna()) - set(self.categories)
+                    raise ValueError(f"Unknown sentiments {sorted(unknown)} in column '{col}'. Known sentiments are:  {',  '.join(self.categories)}.")
+        return df
+
+    def write_part(self, df):
+        df = self.prepare(df)
+        if self.schema is None:
+            self.schema = pa.Schema.from_pandas(df, preserve_index=False)
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.open_writer(self.part_path() + '.tmp')
+        self.writer.write_table(table)
+
+    def close_part(self):
+        if self.writer is None:
+            # an output without rows has no schema to be written with
+            return
+        self.writer.close()
+        self.writer = None
+        os.replace(self.part_path() + '.tmp', self.part_path())
+
+    def flush(self):
+        '''
+        Returns:
+            dict: the state of the writer, whose durable rows are the rows of the closed files.
+        '''
+        return {'rows': self.rows, 'parts': self.part, 'part_rows': 0, 'offset': 0}
+
+
+class ParquetWriter(ColumnarWriter):
+    '''
+    This class writes Parquet files compressed with Config.PARQUET_COMPRESSION.
+    '''
+    extension = 'parquet'
+
+    def open_writer(self, path):
+        return pq.ParquetWriter(path, self.schema, compression=Config.PARQUET_COMPRESSION)
+
+
+class ArrowWriter(ColumnarWriter):
+    '''
+    This class writes Arrow IPC files, which can be memory-mapped by the readers.
+    '''
+    extension = 'arrow'
+
+    def open_writer(self, path):
+        return pa.ipc.new_file(path, self.schema)
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonlWriter, 'parquet': ParquetWriter, 'arrow': ArrowWriter}
+
+
+def resolve_output_path(path, output_format, partition_rows=None):
+    '''
+    Returns:
+        str: path with the extension of output_format instead of the extension of another output format,
+        or without extension if the output is partitioned since it is then a directory.
+    '''
+    root, extension = os.path.splitext(path)
+    if extension.lstrip('.') in OUTPUT_FORMATS:
+        path = root
+    return path if partition_rows else f'{path}.{output_format}'
+
+
+def create_writer(path, model_list, output_format=None, partition_rows=None, state=None):
+    '''
+    Creates the writer of the output format, by default Config.OUTPUT_FORMAT partitioned every Config.OUTPUT_PARTITION_ROWS rows.
+
+    Args:
+        path (str): path of the output (see resolve_output_path()).
+        model_list (list): the models whose predictions are written, providing the categories of the sentiment columns.
+        output_format (str): 'csv', 'jsonl', 'parquet' or 'arrow'.
+        partition_rows (int): maximum number of rows per file.
+        state (dict): the state of an interrupted writer to resume.
+    Raises:
+        ValueError, if the output format is not allowed.
+    Returns:
+        OutputWriter: the writer.
+    '''
+    output_format = output_format or Config.OUTPUT_FORMAT
+    partition_rows = partition_rows or Config.OUTPUT_PARTITION_ROWS
+    if output_format not in WRITERS:
+        raise ValueError(f"Invalid output format '{output_format}'. Allowed formats are:  {',  '.join(OUTPUT_FORMATS)}.")
+    return WRITERS[output_format](resolve_output_path(path, output_format, partition_rows), partition_rows, label_categories(model_list), state)
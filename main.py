@@ -5,26 +5,34 @@ import sys
 import os
 from llm_sentiment.config import Config
 from llm_sentiment.workflow import WorkFlow
+from llm_sentiment.streaming import StreamingWorkFlow
 from llm_sentiment.menu import Menu
+from llm_sentiment import cli
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 def main():
     '''
     The main function which prompts the user to input required selections and based on the user selection runs inference and saves output dataset in a csv file.
+    If command line arguments are given, the selections are read from them instead of prompting the user (see llm_sentiment/cli.py).
 
     steps:
     1. Prompts user to make selections among options by creating a Menu instance and calling run() method on it.
     2. Collect the user inputs and sets the category, models and DataFrame type.
-    3. Creates WorkFlow instance by passing user selections as inputs.
+    3. Creates WorkFlow instance (or StreamingWorkFlow instance if Config.STREAMING is True) by passing user selections as inputs.
     4. Runs inference by calling run() method on the WorkFlow instance.
     5. Saves the output dataset by calling save() method on the WorkFlow instance.
     '''
+    if len(sys.argv) > 1:
+        cli.main(sys.argv[1:])
+        return
+
     menu = Menu()
     menu.run()
     category = menu.category
     model_list = menu.model_list
     dataframe_type = menu.dataframe_type
-    wf = WorkFlow(category, model_list, Config.DATASET_NAME, dataframe_type)
+    workflow_class = StreamingWorkFlow if Config.STREAMING else WorkFlow
+    wf = workflow_class(category, model_list, Config.DATASET_NAME, dataframe_type)
     wf.run()
     wf.save()
 
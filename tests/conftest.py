@@ -0,0 +1,26 @@
+# tests/conftest.py
+
+
+import pytest
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import build_tiny_model
+
+
+@pytest.fixture(scope='session')
+def tiny_model(tmp_path_factory):
+    '''
+    Returns:
+        dict: the model configuration dictionary of a randomly-initialized tiny model, built offline once per test session (see benchmark.build_tiny_model()).
+    '''
+    return build_tiny_model(str(tmp_path_factory.mktemp('tiny_model')), max_length=64)
+
+
+@pytest.fixture
+def settings(tmp_path):
+    '''
+    Points CACHE_DIR and OUTPUT_DIR to the temporary directory of the test, and restores all the settings after it.
+    '''
+    saved_settings = Config.snapshot()
+    Config.override(CACHE_DIR=str(tmp_path / 'cache'), OUTPUT_DIR=str(tmp_path / 'output'))
+    yield Config
+    Config.override(**saved_settings)
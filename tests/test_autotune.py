@@ -0,0 +1,67 @@
+# tests/test_autotune.py
+
+
+import pytest
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.autotune import Autotuner, tuned_model, load_profile
+
+
+@pytest.fixture
+def dataset(settings):
+    '''
+    Returns:
+        datasets.Dataset: 64 synthetic texts, 16 of which are used by the calibration passes.
+    '''
+    Config.override(AUTOTUNE_ROWS=16)
+    return Dataset.from_dict({Config.COLUMN_TEXT: synthetic_texts(64, mean_words=8, max_words=40, seed=6)})
+
+
+def fit_in_memory(monkeypatch, max_tokens):
+    '''
+    Makes the classifier inference run out of memory whenever its MAX_BATCH_TOKENS is above max_tokens, as an accelerator would.
+    '''
+    inference = Classifier.inference
+
+    def limited_inference(self, encoding, return_probabilities=None):
+        if self.model_choice.get('MAX_BATCH_TOKENS', 0) > max_tokens:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        return inference(self, encoding, return_probabilities)
+
+    monkeypatch.setattr(Classifier, 'inference', limited_inference)
+
+
+def test_out_of_memory_backs_off(tiny_model, dataset, monkeypatch):
+    fit_in_memory(monkeypatch, 2048)
+    tuner = Autotuner(dict(tiny_model, MAX_BATCH_TOKENS=8192), repeats=1)
+    profile = tuner.tune(dataset)
+
+    tried = [trial['MAX_BATCH_TOKENS'] for trial in profile['trials']]
+    out_of_memory = [trial['MAX_BATCH_TOKENS'] for trial in profile['trials'] if trial['out_of_memory']]
+    # the warm-up halves 8192 down to 2048, and the search stops at the first larger budget that does not fit
+    assert tried[:2] == [8192, 4096]
+    assert out_of_memory == [8192, 4096, 4096]
+    assert not any(value > 8192 for value in tried)
+    assert profile['settings']['MAX_BATCH_TOKENS'] in (1024, 2048)
+    assert profile['rows'] == 16 and profile['rows_per_sec'] > 0
+
+
+def test_out_of_memory_with_a_single_example_raises(tiny_model, dataset, monkeypatch):
+    fit_in_memory(monkeypatch, 0)
+    with pytest.raises(MemoryError):
+        Autotuner(dict(tiny_model, MAX_BATCH_TOKENS=4), repeats=1).tune(dataset)
+
+
+def test_tuned_model_saves_the_profile_and_keeps_explicit_settings(tiny_model, dataset):
+    Config.override(NUM_WORKERS=1)
+    tuned = tuned_model(tiny_model, 'classifier', dataset)
+    profile = load_profile(tiny_model, 'classifier')
+    assert profile is not None
+    assert tuned['MAX_BATCH_TOKENS'] == profile['settings']['MAX_BATCH_TOKENS']
+    assert tuned['TORCH_THREADS'] == profile['settings']['TORCH_THREADS']
+
+    # the saved profile is reused without a dataset, and the settings of the model win over it
+    assert tuned_model(tiny_model, 'classifier') == tuned
+    assert tuned_model(dict(tiny_model, MAX_BATCH_TOKENS=512), 'classifier')['MAX_BATCH_TOKENS'] == 512
@@ -0,0 +1,62 @@
+# tests/test_backends.py
+
+
+import os
+import importlib.util
+import pytest
+import torch
+from llm_sentiment.config import Config
+from llm_sentiment.backends import LogitsModule, OnnxBackend, check_backend, example_inputs, load_backend
+from llm_sentiment.registry import ModelRegistry
+
+
+BACKEND_SHAPES = [(1, 5), (4, 23)]  # (batch, sequence) shapes, both different from the exported shape (2, 8)
+
+
+@pytest.fixture
+def tiny_eager_model(tiny_model, settings):
+    model, _ = ModelRegistry.acquire(tiny_model['ID'], 'fp32', torch.device('cpu'))
+    yield model
+    ModelRegistry.release(tiny_model['ID'], 'fp32', torch.device('cpu'))
+
+
+def assert_matches_eager(backend, model):
+    '''
+    Asserts that the logits of the backend match the logits of the eager model for each shape of BACKEND_SHAPES, padding included.
+    '''
+    for seed, (batch_size, seq_length) in enumerate(BACKEND_SHAPES):
+        input_ids, attention_mask = example_inputs(model, batch_size, seq_length, seed=seed)
+        with torch.no_grad():
+            expected = LogitsModule(model)(input_ids, attention_mask)
+            actual = backend(input_ids, attention_mask)
+        assert actual.shape == (batch_size, model.config.num_labels)
+        torch.testing.assert_close(actual.float(), expected.float(), atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize('backend_name', ['eager', 'torchscript'])
+def test_backend_matches_eager(tiny_model, tiny_eager_model, backend_name):
+    backend = load_backend(dict(tiny_model, BACKEND=backend_name), tiny_eager_model, torch.device('cpu'))
+    assert backend.name == backend_name
+    assert_matches_eager(backend, tiny_eager_model)
+
+
+@pytest.mark.skipif(importlib.util.find_spec('onnxruntime') is None or importlib.util.find_spec('onnx') is None,
+                    reason='onnx and onnxruntime are not installed')
+def test_onnx_backend_has_dynamic_batch_and_sequence(tiny_model, tiny_eager_model):
+    backend = load_backend(dict(tiny_model, BACKEND='onnx'), tiny_eager_model, torch.device('cpu'))
+    assert isinstance(backend, OnnxBackend)
+    assert_matches_eager(backend, tiny_eager_model)
+    # one graph is exported, whatever the shapes it is run with
+    assert len(os.listdir(os.path.join(Config.CACHE_DIR, 'artifacts'))) == 1
+
+
+def test_check_backend_rejects_a_diverging_backend(tiny_eager_model):
+    class ShiftedBackend(torch.nn.Module):
+        name = 'shifted'
+
+        def forward(self, input_ids, attention_mask):
+            return LogitsModule(tiny_eager_model)(input_ids, attention_mask) + 0.01
+
+    assert check_backend(ShiftedBackend(), tiny_eager_model, tolerance=0.1) == pytest.approx(0.01, rel=1e-3)
+    with pytest.raises(ValueError, match="'shifted' backend differs from eager"):
+        check_backend(ShiftedBackend(), tiny_eager_model)
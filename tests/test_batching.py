@@ -0,0 +1,43 @@
+# tests/test_batching.py
+
+
+import numpy as np
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.batching import LengthBatcher
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.classifier import Classifier
+
+
+def test_batches_stay_within_the_token_budget():
+    lengths = np.random.default_rng(0).integers(1, 60, size=200)
+    batcher = LengthBatcher(lengths, max_tokens=128)
+
+    indices = [i for batch in batcher for i in batch]
+    assert sorted(indices) == list(range(200))
+    for batch in batcher:
+        assert len(batch) * lengths[batch].max() <= 128
+    # examples are taken in order of token length, so batches do not overlap in length
+    assert all(lengths[a].max() <= lengths[b].min() for a, b in zip(batcher.batches, batcher.batches[1:]))
+
+
+def test_example_above_the_budget_is_batched_alone():
+    batcher = LengthBatcher([3, 500, 4, 2], max_tokens=10)
+    assert batcher.batches == [[3, 0], [2], [1]]
+
+
+def test_predictions_do_not_depend_on_the_token_budget(tiny_model, settings):
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: synthetic_texts(60, mean_words=10, max_words=50, seed=1)})
+    classifier = Classifier(tiny_model)
+    try:
+        encoding = classifier.preprocess_inst.encoding(dataset)
+        Config.override(MAX_BATCH_TOKENS=100000)
+        one_batch = classifier.inference(encoding, return_probabilities=True)
+        Config.override(MAX_BATCH_TOKENS=64)
+        small_batches = classifier.inference(encoding, return_probabilities=True)
+    finally:
+        classifier.close()
+
+    assert len(LengthBatcher(encoding.lengths, 64)) > 10
+    np.testing.assert_array_equal(small_batches['label_ids'], one_batch['label_ids'])
+    np.testing.assert_allclose(small_batches['probabilities'], one_batch['probabilities'], atol=1e-5)
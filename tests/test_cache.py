@@ -0,0 +1,85 @@
+# tests/test_cache.py
+
+
+import os
+import numpy as np
+from datasets import Dataset
+from transformers import AutoConfig
+from llm_sentiment.config import Config
+from llm_sentiment.cache import PredictionCache
+from llm_sentiment.loading import model_revision
+
+
+def test_local_model_revision_follows_its_files(tiny_model, settings):
+    model_config = AutoConfig.from_pretrained(tiny_model['ID'])
+    revision = model_revision(tiny_model, model_config)
+    namespace = PredictionCache(tiny_model, 'classifier', model_config).namespace
+    assert revision is not None
+    assert model_revision(tiny_model, model_config) == revision
+
+    # the weights are overwritten at the same path
+    weights_path = os.path.join(tiny_model['ID'], 'model.safetensors')
+    stat = os.stat(weights_path)
+    os.utime(weights_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        assert model_revision(tiny_model, model_config) != revision
+        assert PredictionCache(tiny_model, 'classifier', model_config).namespace != namespace
+    finally:
+        os.utime(weights_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_revision_key_takes_precedence(tiny_model):
+    model_config = AutoConfig.from_pretrained(tiny_model['ID'])
+    assert model_revision(dict(tiny_model, REVISION='v2'), model_config) == 'v2'
+    assert model_revision({'ID': 'org/model'}, model_config) is None
+
+
+def fake_compute(dataset):
+    '''
+    Returns:
+        dict: deterministic predictions of the texts of the dataset, standing for a model.
+    '''
+    lengths = np.array([len(text) for text in dataset[Config.COLUMN_TEXT]])
+    return {'sentiment': np.where(lengths % 2, 'positive', 'negative').astype(object),
+            'label_ids': lengths % 2,
+            'score': (lengths % 10 / 10).astype(np.float32)}
+
+
+def cache_rows(cache):
+    connection = cache.connect()
+    try:
+        return connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0], PredictionCache.size(connection)
+    finally:
+        connection.close()
+
+
+def test_least_recently_used_predictions_are_evicted(tiny_model, settings):
+    Config.override(PREDICTION_CACHE_MAX_ENTRIES=5)
+    cache = PredictionCache(tiny_model, 'classifier', AutoConfig.from_pretrained(tiny_model['ID']))
+    texts = [f'text {"x" * i}' for i in range(8)]
+
+    cache.get_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: texts[:4]}), fake_compute)
+    assert cache_rows(cache) == (4, 4)
+    # texts 0 and 1 become the most recently used, then 3 new texts evict the 2 least recently used ones, texts 2 and 3
+    cache.get_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: texts[:2]}), fake_compute)
+    cache.get_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: texts[4:7]}), fake_compute)
+    assert cache_rows(cache) == (5, 5)
+
+    cache.hits = cache.misses = 0
+    preds = cache.get_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: texts}), fake_compute)
+    assert cache.stats()['misses'] == 3
+    expected = fake_compute(Dataset.from_dict({Config.COLUMN_TEXT: texts}))
+    for k in expected:
+        np.testing.assert_array_equal(preds[k], expected[k])
+
+
+def test_replaced_predictions_are_not_counted_twice(tiny_model, settings):
+    model_config = AutoConfig.from_pretrained(tiny_model['ID'])
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: ['a', 'bb', 'ccc']})
+    PredictionCache(tiny_model, 'classifier', model_config).get_sentiment(dataset, fake_compute)
+
+    # the cached predictions have no probabilities, so they are predicted again and replaced
+    cache = PredictionCache(tiny_model, 'classifier', model_config, with_probabilities=True)
+    cache.get_sentiment(dataset, lambda ds: dict(fake_compute(ds), probabilities=np.full((len(ds), 2), 0.5, dtype=np.float32)))
+    assert cache.stats()['misses'] == 3
+    assert cache_rows(cache) == (3, 3)
@@ -0,0 +1,69 @@
+# tests/test_cascade.py
+
+
+import numpy as np
+import pytest
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import build_tiny_model, synthetic_texts
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.cascade import Cascade, deciding_stages
+from llm_sentiment.prediction import Prediction
+
+
+@pytest.fixture(scope='module')
+def second_model(tmp_path_factory):
+    '''
+    Returns:
+        dict: the configuration of a second tiny model, initialized with another seed so that its predictions differ from the first one.
+    '''
+    model_i = build_tiny_model(str(tmp_path_factory.mktemp('second_model')), max_length=64, seed=1)
+    return dict(model_i, NAME='Second')
+
+
+def test_each_stage_predicts_the_examples_left_undecided(settings):
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: [f'w{i}' for i in range(6)]})
+    stage_scores = {'A': [0.95, 0.2, 0.8, 0.3, 0.99, 0.5], 'B': [0.1, 0.9, 0.2, 0.6, 0.1, 0.7], 'C': [0.4] * 6}
+    seen = {}
+
+    def predict_model(model_i, subset):
+        rows = [int(text[1:]) for text in subset[Config.COLUMN_TEXT]]
+        seen[model_i['NAME']] = rows
+        return {'sentiment': [model_i['NAME']] * len(rows), 'score': [stage_scores[model_i['NAME']][row] for row in rows]}
+
+    cascade = Cascade([{'NAME': 'A'}, {'NAME': 'B'}, {'NAME': 'C'}], thresholds=[0.9, 0.6])
+    preds = cascade.predict(dataset, predict_model)
+
+    assert seen == {'A': [0, 1, 2, 3, 4, 5], 'B': [1, 2, 3, 5], 'C': [2]}
+    assert list(preds['stage']) == ['A', 'B', 'C', 'B', 'A', 'B']
+    assert list(preds['sentiment']) == list(preds['stage'])
+    np.testing.assert_allclose(preds['score'], [0.95, 0.9, 0.4, 0.6, 0.99, 0.7])
+    stats = cascade.stats()
+    assert stats['stages'] == {'A': {'scored': 6, 'decided': 2}, 'B': {'scored': 4, 'decided': 3}, 'C': {'scored': 1, 'decided': 1}}
+    assert stats['work_saved'] == pytest.approx(1 - 11 / 18)
+    # the stages computed from the predictions of every model agree with the cascade
+    assert list(deciding_stages(list(stage_scores.values()), [0.9, 0.6])) == [0, 1, 2, 1, 0, 1]
+
+
+def test_cascade_routes_on_the_scores_of_the_first_model(tiny_model, second_model, settings):
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: synthetic_texts(40, mean_words=8, max_words=40, seed=4)})
+    full_preds = []
+    for model_i in (tiny_model, second_model):
+        classifier = Classifier(model_i)
+        full_preds.append(classifier.get_sentiment(dataset))
+        classifier.close()
+    threshold = float(np.median(full_preds[0]['score']))
+
+    predictor = Prediction('cascade', [dict(tiny_model, CASCADE_THRESHOLD=threshold), second_model], dataset)
+    assert predictor.predict() == []
+    preds = predictor.cascade_preds
+    predictor.close()
+
+    stage = deciding_stages([p['score'] for p in full_preds], [threshold])
+    assert 0 < np.sum(stage == 0) < len(dataset)
+    assert list(preds['stage']) == [['Tiny', 'Second'][i] for i in stage]
+    expected_sentiment = [full_preds[i]['sentiment'][row] for row, i in enumerate(stage)]
+    expected_score = [full_preds[i]['score'][row] for row, i in enumerate(stage)]
+    assert list(preds['sentiment']) == expected_sentiment
+    np.testing.assert_allclose(preds['score'], expected_score, rtol=1e-5)
+    assert predictor.cascade.stats()['stages']['Second']['scored'] == np.sum(stage == 1)
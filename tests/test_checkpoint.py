@@ -0,0 +1,150 @@
+# tests/test_checkpoint.py
+
+
+import numpy as np
+import pytest
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.prediction import Prediction
+from llm_sentiment.checkpoint import RunCheckpoint, save_preds, load_preds
+
+
+MODELS = [{'ID': 'model-a', 'NAME': 'A', 'ID2LABEL': {0: 'negative', 1: 'positive'}},
+          {'ID': 'model-b', 'NAME': 'B', 'ID2LABEL': {0: 'negative', 1: 'positive'}}]
+
+
+def text_preds(texts, name):
+    '''
+    Returns:
+        dict: deterministic predictions of the texts, which differ between models.
+    '''
+    lengths = np.array([len(text) + len(name) for text in texts])
+    return {'sentiment': np.where(lengths % 2, 'positive', 'negative').astype(object),
+            'score': (lengths % 100 / 100).astype(np.float32),
+            'label_ids': lengths % 2}
+
+
+class FakePrediction(Prediction):
+    '''
+    A Prediction whose models are replaced by text_preds(), recording the rows each (model, path) predicts and failing on demand.
+    '''
+    def __init__(self, category, model_list, dataset, fail_on_call=None):
+        super().__init__(category, model_list, dataset)
+        self.calls = []
+        self.fail_on_call = fail_on_call
+
+    def predict_path(self, model_i, path_name):
+        if self.fail_on_call is not None and len(self.calls) == self.fail_on_call:
+            raise MemoryError('interrupted')
+        texts = self.dataset[Config.COLUMN_TEXT]
+        self.calls.append((model_i['NAME'], path_name, len(texts)))
+        return text_preds(texts, f'{model_i["NAME"]}.{path_name}')
+
+
+@pytest.fixture
+def dataset():
+    return Dataset.from_dict({Config.COLUMN_TEXT: [f'text {i % 6} ' + 'x' * (i % 6) for i in range(25)]})
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    saved_settings = Config.snapshot()
+    Config.override(DEDUPLICATION=False)
+    yield
+    Config.override(**saved_settings)
+
+
+def expected_preds(dataset, category='classifier_classifier'):
+    texts = dataset[Config.COLUMN_TEXT]
+    paths = ['pipeline', 'classifier'] if category == 'pipeline_classifier' else ['classifier']
+    preds = [[text_preds(texts, f'{model_i["NAME"]}.{path_name}') for path_name in paths] for model_i in MODELS]
+    return [p if len(paths) > 1 else p[0] for p in preds]
+
+
+def assert_same_preds(actual, expected):
+    assert actual.keys() == expected.keys()
+    for k in expected:
+        np.testing.assert_array_equal(actual[k], expected[k])
+
+
+def test_save_load_preds_round_trip(tmp_path):
+    preds = text_preds(['a', 'bb', 'ccc'], 'A')
+    save_preds(preds, str(tmp_path / 'preds.npz'))
+    loaded = load_preds(str(tmp_path / 'preds.npz'))
+    assert loaded['sentiment'].dtype == object
+    assert_same_preds(loaded, preds)
+
+
+def test_merge_matches_unsharded_predictions(tmp_path, dataset):
+    predictor = FakePrediction('pipeline_classifier', MODELS, dataset)
+    checkpoint = RunCheckpoint('pipeline_classifier', MODELS, 'data', str(tmp_path / 'out.csv'), shard_rows=10)
+    pred_both = checkpoint.predict(predictor)
+
+    assert predictor.dataset is dataset
+    assert predictor.pred_both is pred_both
+    for actual, expected in zip(pred_both, expected_preds(dataset, 'pipeline_classifier')):
+        for actual_path, expected_path in zip(actual, expected):
+            assert_same_preds(actual_path, expected_path)
+    # 3 shards of 10, 10 and 5 rows, predicted by 2 models and 2 paths
+    assert [rows for _, _, rows in predictor.calls] == [10] * 4 + [10] * 4 + [5] * 4
+
+
+def test_resume_predicts_only_missing_units(tmp_path, dataset):
+    output_path = str(tmp_path / 'out.csv')
+    interrupted = FakePrediction('classifier_classifier', MODELS, dataset, fail_on_call=3)
+    with pytest.raises(MemoryError):
+        RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(interrupted)
+    # the first shard is checkpointed, the second one failed after its first model
+    assert interrupted.calls == [('A', 'classifier', 10), ('B', 'classifier', 10), ('A', 'classifier', 10)]
+    assert interrupted.dataset is dataset
+
+    resumed = FakePrediction('classifier_classifier', MODELS, dataset)
+    pred_both = RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(resumed)
+    assert resumed.calls == [('A', 'classifier', 10), ('B', 'classifier', 10), ('A', 'classifier', 5), ('B', 'classifier', 5)]
+    for actual, expected in zip(pred_both, expected_preds(dataset)):
+        assert_same_preds(actual, expected)
+
+
+def test_changed_shard_texts_are_predicted_again(tmp_path, dataset):
+    output_path = str(tmp_path / 'out.csv')
+    RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(FakePrediction('classifier_classifier', MODELS, dataset))
+
+    texts = list(dataset[Config.COLUMN_TEXT])
+    texts[12] = 'a changed text'
+    changed = Dataset.from_dict({Config.COLUMN_TEXT: texts})
+    predictor = FakePrediction('classifier_classifier', MODELS, changed)
+    pred_both = RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(predictor)
+
+    assert predictor.calls == [('A', 'classifier', 10), ('B', 'classifier', 10)]
+    for actual, expected in zip(pred_both, expected_preds(changed)):
+        assert_same_preds(actual, expected)
+
+
+def test_other_signature_discards_checkpoint(tmp_path, dataset):
+    output_path = str(tmp_path / 'out.csv')
+    RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(FakePrediction('classifier_classifier', MODELS, dataset))
+
+    predictor = FakePrediction('classifier_classifier', MODELS, dataset)
+    RunCheckpoint('classifier_classifier', MODELS, 'other-data', output_path, shard_rows=10).predict(predictor)
+    assert len(predictor.calls) == 6
+
+
+@pytest.mark.parametrize('setting', [{'DEDUP_NORMALIZE': True}, {'PRECISION': 'bf16'}, {'BACKEND': 'torchscript'}, {'RETURN_PROBABILITIES': True}])
+def test_changed_prediction_setting_discards_checkpoint(tmp_path, dataset, setting):
+    output_path = str(tmp_path / 'out.csv')
+    RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(FakePrediction('classifier_classifier', MODELS, dataset))
+
+    Config.override(**setting)
+    predictor = FakePrediction('classifier_classifier', MODELS, dataset)
+    RunCheckpoint('classifier_classifier', MODELS, 'data', output_path, shard_rows=10).predict(predictor)
+    assert len(predictor.calls) == 6
+
+
+def test_deduplicated_shards_are_expanded(tmp_path, dataset):
+    Config.override(DEDUPLICATION=True)
+    predictor = FakePrediction('classifier_classifier', MODELS, dataset)
+    pred_both = RunCheckpoint('classifier_classifier', MODELS, 'data', str(tmp_path / 'out.csv'), shard_rows=10).predict(predictor)
+
+    assert all(rows < 10 for _, _, rows in predictor.calls)
+    for actual, expected in zip(pred_both, expected_preds(dataset)):
+        assert_same_preds(actual, expected)
@@ -0,0 +1,33 @@
+# tests/test_dataset_loader.py
+
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from llm_sentiment.config import Config
+from llm_sentiment.dataset_loader import DataSetLoader
+
+
+TEXTS = [f'text {i}' for i in range(50)]
+
+
+def write_parquet(path):
+    table = pa.table({Config.COLUMN_TEXT: TEXTS, Config.COLUMN_LABEL: [i % 3 for i in range(50)], 'other': list(range(50))})
+    # row groups of 16 rows, so that chunks cross row groups
+    pq.write_table(table, path, row_group_size=16)
+    return path
+
+
+def test_parquet_is_loaded_memory_mapped_with_projected_columns(tmp_path):
+    dataset = DataSetLoader(write_parquet(str(tmp_path / 'data.parquet'))).dataset_load()
+    assert dataset.column_names == [Config.COLUMN_TEXT, Config.COLUMN_LABEL]
+    assert list(dataset[Config.COLUMN_TEXT]) == TEXTS
+    assert dataset.cache_files
+
+
+def test_parquet_chunks_skip_and_cross_row_groups(tmp_path):
+    loader = DataSetLoader(write_parquet(str(tmp_path / 'data.parquet')))
+    chunks = list(loader.dataset_chunks(chunk_size=7, skip=20))
+
+    assert [len(chunk) for chunk in chunks] == [7, 7, 7, 7, 2]
+    assert [text for chunk in chunks for text in chunk[Config.COLUMN_TEXT]] == TEXTS[20:]
+    assert chunks[0].column_names == [Config.COLUMN_TEXT, Config.COLUMN_LABEL]
@@ -0,0 +1,61 @@
+# tests/test_dedup.py
+
+
+import numpy as np
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.dedup import TextDeduplicator
+
+
+TEXTS = ['good', 'bad', 'good', 'fine', 'bad', 'good', '  Good ', 'GOOD']
+
+
+def make_dataset(texts):
+    return Dataset.from_dict({Config.COLUMN_TEXT: texts, 'row': list(range(len(texts)))})
+
+
+def test_unique_texts_in_order_of_first_occurrence():
+    dedup = TextDeduplicator(make_dataset(TEXTS), normalize=False)
+    assert list(dedup.unique[Config.COLUMN_TEXT]) == ['good', 'bad', 'fine', '  Good ', 'GOOD']
+    assert list(dedup.unique['row']) == [0, 1, 3, 6, 7]
+    assert dedup.stats() == {'rows': 8, 'unique': 5, 'dedup_ratio': 1 - 5 / 8}
+
+
+def test_inverse_maps_every_row_to_its_text():
+    dedup = TextDeduplicator(make_dataset(TEXTS), normalize=False)
+    unique_texts = np.array(dedup.unique[Config.COLUMN_TEXT], dtype=object)
+    np.testing.assert_array_equal(unique_texts[dedup.inverse], np.array(TEXTS, dtype=object))
+
+
+def test_expand_matches_predicting_every_row():
+    dedup = TextDeduplicator(make_dataset(TEXTS), normalize=False)
+    unique_texts = list(dedup.unique[Config.COLUMN_TEXT])
+    preds = {'sentiment': np.array([f'label-{text}' for text in unique_texts], dtype=object),
+             'score': np.array([len(text) / 10 for text in unique_texts], dtype=np.float32),
+             'probabilities': np.arange(2 * len(unique_texts), dtype=np.float32).reshape(-1, 2)}
+    expanded = dedup.expand(preds)
+
+    np.testing.assert_array_equal(expanded['sentiment'], np.array([f'label-{text}' for text in TEXTS], dtype=object))
+    np.testing.assert_array_equal(expanded['score'], np.array([len(text) / 10 for text in TEXTS], dtype=np.float32))
+    assert expanded['probabilities'].shape == (len(TEXTS), 2)
+    np.testing.assert_array_equal(expanded['probabilities'][[0, 2, 5]], np.repeat(preds['probabilities'][:1], 3, axis=0))
+
+
+def test_normalize_merges_whitespace_and_case():
+    dedup = TextDeduplicator(make_dataset(TEXTS), normalize=True)
+    assert list(dedup.unique['row']) == [0, 1, 3]
+    np.testing.assert_array_equal(dedup.inverse, [0, 1, 0, 2, 1, 0, 0, 0])
+
+
+def test_no_duplicates_keeps_the_dataset():
+    dataset = make_dataset(['a', 'b', 'c'])
+    dedup = TextDeduplicator(dataset, normalize=False)
+    assert dedup.unique is dataset
+    preds = {'score': np.array([0.1, 0.2, 0.3])}
+    assert dedup.expand(preds) is preds
+
+
+def test_empty_and_null_texts():
+    dedup = TextDeduplicator(make_dataset(['', None, '', None, 'a']), normalize=False)
+    assert dedup.num_unique == 3
+    np.testing.assert_array_equal(dedup.inverse, [0, 1, 0, 1, 2])
@@ -0,0 +1,45 @@
+# tests/test_encoding.py
+
+
+import os
+import numpy as np
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.encoding import evict_encodings
+from llm_sentiment.pre_process import PreProcess
+
+
+def write_encoding(directory, name, size, mtime_ns):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_least_recently_used_encodings_are_evicted(tmp_path):
+    for i, name in enumerate(['a.npz', 'b.npz', 'c.npz', 'd.npz']):
+        write_encoding(str(tmp_path), name, 100, (i + 1) * 10 ** 9)
+    write_encoding(str(tmp_path), 'other.txt', 1000, 0)
+
+    evict_encodings(str(tmp_path), 250)
+    assert sorted(os.listdir(tmp_path)) == ['c.npz', 'd.npz', 'other.txt']
+    # the most recent encoding is kept even if it alone exceeds the limit
+    evict_encodings(str(tmp_path), 10)
+    assert sorted(os.listdir(tmp_path)) == ['d.npz', 'other.txt']
+
+
+def test_cached_encoding_matches_tokenization(tiny_model, settings):
+    Config.override(ENCODING_CACHE=True)
+    preprocess = PreProcess(tiny_model)
+    try:
+        dataset = Dataset.from_dict({Config.COLUMN_TEXT: ['w1 w2 w3', 'w4', 'w5 w6 w7 w8 w9']})
+        encoding = preprocess.encoding(dataset)
+        cache_files = os.listdir(os.path.join(Config.CACHE_DIR, 'encodings'))
+        assert len(cache_files) == 1
+
+        cached = preprocess.encoding(dataset)
+        np.testing.assert_array_equal(cached.input_ids, encoding.input_ids)
+        np.testing.assert_array_equal(cached.lengths, [5, 3, 7])
+    finally:
+        preprocess.model_manage.release()
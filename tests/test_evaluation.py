@@ -0,0 +1,110 @@
+# tests/test_evaluation.py
+
+
+import json
+import numpy as np
+import pytest
+from llm_sentiment.evaluation import Evaluator
+
+
+LABELS = ['negative', 'neutral', 'positive']
+
+
+def random_batch(rng, rows):
+    '''
+    Returns:
+        tuple: the (name, predictions) columns of two models and the true labels of a random batch, some of them missing.
+    '''
+    true_labels = np.array(LABELS, dtype=object)[rng.integers(0, 3, rows)]
+    true_labels[rng.random(rows) < 0.1] = None
+    columns = [(name, {'sentiment': np.array(LABELS, dtype=object)[rng.integers(0, 3, rows)], 'score': rng.random(rows)})
+               for name in ('A_classifier', 'B_classifier')]
+    return columns, true_labels
+
+
+def batches(seed=0, sizes=(40, 25, 35)):
+    rng = np.random.default_rng(seed)
+    return [random_batch(rng, rows) for rows in sizes]
+
+
+def concat_batches(parts):
+    columns = [(name, {k: np.concatenate([part[0][i][1][k] for part in parts]) for k in ('sentiment', 'score')})
+               for i, (name, _) in enumerate(parts[0][0])]
+    return columns, np.concatenate([part[1] for part in parts])
+
+
+def assert_same_counts(actual, expected):
+    '''
+    Asserts that two evaluators hold the same counts, the score sums of the calibration bins up to the floating-point summation order.
+    '''
+    actual_state, expected_state = actual.state(), expected.state()
+    np.testing.assert_allclose(np.array(list(actual_state.pop('calibration').values())), np.array(list(expected_state.pop('calibration').values())))
+    assert actual_state == expected_state
+
+
+def test_metrics_of_a_small_batch():
+    evaluator = Evaluator(LABELS, num_bins=2)
+    evaluator.update([('A', {'sentiment': np.array(['positive', 'negative', 'positive', 'neutral'], dtype=object),
+                             'score': np.array([0.9, 0.8, 0.3, 0.6])})],
+                     np.array(['positive', 'negative', 'negative', None], dtype=object))
+    metrics = evaluator.report()['columns']['A']
+
+    assert metrics['rows'] == 3
+    assert metrics['accuracy'] == pytest.approx(2 / 3)
+    assert metrics['confusion']['matrix'] == [[1, 0, 1], [0, 0, 0], [0, 0, 1]]
+    # bin [0, 0.5): 1 example, wrong, score 0.3; bin [0.5, 1): 2 examples, right, scores 0.9 and 0.8
+    assert metrics['ece'] == pytest.approx((abs(0 - 0.3) + abs(2 - 1.7)) / 3)
+    assert metrics['per_class']['negative'] == {'precision': 1.0, 'recall': 0.5, 'f1': pytest.approx(2 / 3), 'support': 2}
+    assert 'neutral' not in metrics['per_class']
+
+
+def test_batches_accumulate_as_one_pass():
+    parts = batches()
+    incremental = Evaluator(LABELS)
+    for columns, true_labels in parts:
+        incremental.update(columns, true_labels)
+    single = Evaluator(LABELS)
+    single.update(*concat_batches(parts))
+
+    assert_same_counts(incremental, single)
+    assert incremental.report()['columns']['A_classifier']['ece'] == pytest.approx(single.report()['columns']['A_classifier']['ece'])
+    assert incremental.rows == sum(label is not None for _, true_labels in parts for label in true_labels)
+
+
+def test_state_round_trip_resumes_the_counts():
+    parts = batches(seed=1)
+    uninterrupted = Evaluator(LABELS)
+    for columns, true_labels in parts:
+        uninterrupted.update(columns, true_labels)
+
+    interrupted = Evaluator(LABELS)
+    interrupted.update(*parts[0])
+    resumed = Evaluator.from_state(json.loads(json.dumps(interrupted.state())))
+    for columns, true_labels in parts[1:]:
+        resumed.update(columns, true_labels)
+
+    assert resumed.state() == uninterrupted.state()
+    assert resumed.report() == uninterrupted.report()
+
+
+def test_new_ground_truth_label_grows_the_matrices():
+    evaluator = Evaluator(['negative', 'positive'])
+    evaluator.update([('A', {'sentiment': np.array(['positive'], dtype=object), 'score': np.array([0.7])})], np.array(['positive'], dtype=object))
+    evaluator.update([('A', {'sentiment': np.array(['negative', 'positive'], dtype=object), 'score': np.array([0.6, 0.9])})],
+                     np.array(['mixed', 'positive'], dtype=object))
+    metrics = evaluator.metrics('A')
+
+    assert evaluator.labels == ['negative', 'positive', 'mixed']
+    assert metrics['confusion']['matrix'] == [[0, 0, 0], [0, 2, 0], [1, 0, 0]]
+    assert metrics['per_class']['mixed']['recall'] == 0.0
+
+
+def test_agreement_between_columns():
+    evaluator = Evaluator(LABELS)
+    evaluator.update([('A', {'sentiment': np.array(['positive', 'negative', 'neutral'], dtype=object), 'score': np.ones(3)}),
+                      ('B', {'sentiment': np.array(['positive', 'positive', 'neutral'], dtype=object), 'score': np.ones(3)}),
+                      ('C', {'sentiment': np.array(['positive', 'negative', 'negative'], dtype=object), 'score': np.ones(3)})],
+                     np.array(['positive', 'negative', 'neutral'], dtype=object))
+    agreement = evaluator.report()['agreement']
+
+    assert agreement == {'A~B': pytest.approx(2 / 3), 'A~C': pytest.approx(2 / 3), 'B~C': pytest.approx(1 / 3), 'all': pytest.approx(1 / 3)}
@@ -0,0 +1,46 @@
+# tests/test_loading.py
+
+
+import os
+import json
+import torch
+from transformers import AutoModelForSequenceClassification
+from llm_sentiment.cache import PredictionCache
+from llm_sentiment.benchmark import build_tiny_model
+from llm_sentiment.loading import BUNDLE_MANIFEST, ensure_bundle, load_config, load_model
+
+
+def test_bundle_weights_match_the_checkpoint(tiny_model, settings):
+    directory = ensure_bundle(tiny_model['ID'])
+    assert ensure_bundle(tiny_model['ID']) == directory
+    model = load_model(tiny_model['ID'])
+    expected = AutoModelForSequenceClassification.from_pretrained(tiny_model['ID']).eval()
+
+    input_ids = torch.tensor([[0, 5, 6, 7, 2]])
+    with torch.no_grad():
+        torch.testing.assert_close(model(input_ids=input_ids).logits, expected(input_ids=input_ids).logits)
+
+
+def test_bundle_revision_is_read_from_the_manifest(tiny_model, settings):
+    directory = ensure_bundle(tiny_model['ID'])
+    # a bundle converted from a Hub checkpoint records its commit hash in its manifest only
+    manifest_path = os.path.join(directory, BUNDLE_MANIFEST)
+    with open(manifest_path, 'w') as f:
+        json.dump({'model_id': tiny_model['ID'], 'commit_hash': 'abc123'}, f)
+
+    model_config = load_config(directory)
+    assert model_config._commit_hash == 'abc123'
+    assert load_model(tiny_model['ID']).config._commit_hash == 'abc123'
+    # the parallel classifier, which reads the bundle configuration, and the in-process classifier share the cache namespace
+    assert (PredictionCache(tiny_model, 'classifier', model_config).namespace
+            == PredictionCache(tiny_model, 'classifier', load_model(tiny_model['ID']).config).namespace)
+
+
+def test_changed_local_model_is_converted_again(tmp_path, settings):
+    model_choice = build_tiny_model(str(tmp_path / 'model'), max_length=16)
+    directory = ensure_bundle(model_choice['ID'])
+
+    build_tiny_model(model_choice['ID'], max_length=16, seed=1)
+    new_directory = ensure_bundle(model_choice['ID'])
+    assert new_directory != directory
+    assert os.path.exists(os.path.join(directory, BUNDLE_MANIFEST))
@@ -0,0 +1,80 @@
+# tests/test_overlap.py
+
+
+import numpy as np
+import pytest
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.overlap import BackgroundConsumer
+
+
+@pytest.fixture
+def dataset():
+    '''
+    Returns:
+        datasets.Dataset: 150 synthetic texts of varied lengths, tokenized in several blocks.
+    '''
+    return Dataset.from_dict({Config.COLUMN_TEXT: synthetic_texts(150, mean_words=10, max_words=60, seed=5)})
+
+
+def test_overlapped_pipeline_matches_compute_sentiment(tiny_model, settings, dataset):
+    # small blocks and queues, so that the stages wait for each other across several blocks
+    Config.override(TOKENIZE_BATCH_SIZE=32, OVERLAP_QUEUE_SIZE=1, OVERLAP_TOKENIZE_THREADS=2, RETURN_PROBABILITIES=True)
+    classifier = Classifier(tiny_model)
+    try:
+        expected = classifier.compute_sentiment(dataset)
+        Config.override(OVERLAP_PIPELINE=True)
+        preds = classifier.compute_sentiment(dataset)
+    finally:
+        classifier.close()
+
+    assert set(preds) == set(expected)
+    assert list(preds['sentiment']) == list(expected['sentiment'])
+    np.testing.assert_array_equal(preds['label_ids'], expected['label_ids'])
+    np.testing.assert_allclose(preds['score'], expected['score'], rtol=1e-5)
+    np.testing.assert_allclose(preds['probabilities'], expected['probabilities'], rtol=1e-5, atol=1e-6)
+
+
+def test_a_failing_stage_stops_the_pipeline(tiny_model, settings, dataset, monkeypatch):
+    Config.override(TOKENIZE_BATCH_SIZE=32, OVERLAP_QUEUE_SIZE=1, OVERLAP_PIPELINE=True)
+    classifier = Classifier(tiny_model)
+    text_encoding = classifier.preprocess_inst.text_encoding
+    blocks = []
+
+    def failing_encoding(texts):
+        blocks.append(len(texts))
+        if len(blocks) == 3:
+            raise RuntimeError('tokenizer failed')
+        return text_encoding(texts)
+
+    monkeypatch.setattr(classifier.preprocess_inst, 'text_encoding', failing_encoding)
+    try:
+        with pytest.raises(RuntimeError, match='tokenizer failed'):
+            classifier.compute_sentiment(dataset)
+    finally:
+        classifier.close()
+
+
+def test_background_consumer_keeps_the_order_and_raises_errors():
+    items = []
+    consumer = BackgroundConsumer(items.append, max_pending=2)
+    for i in range(20):
+        consumer.put(i)
+    consumer.close()
+    assert items == list(range(20))
+
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError('write failed')
+        items.append(item)
+
+    items.clear()
+    consumer = BackgroundConsumer(fail_on_three, max_pending=1)
+    with pytest.raises(ValueError, match='write failed'):
+        for i in range(10):
+            consumer.put(i)
+        consumer.close()
+    consumer.join()
+    assert items == [0, 1, 2]
@@ -0,0 +1,47 @@
+# tests/test_parallel.py
+
+
+import numpy as np
+import torch
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.parallel import ParallelClassifier, split_threads, torch_threads
+
+
+def test_workers_match_the_single_process_classifier(tiny_model, settings):
+    Config.override(RETURN_PROBABILITIES=True)
+    # 37 examples are split into uneven shards of 19 and 18 examples
+    dataset = Dataset.from_dict({Config.COLUMN_TEXT: synthetic_texts(37, mean_words=12, max_words=60, seed=3)})
+    classifier = Classifier(tiny_model)
+    try:
+        expected = classifier.compute_sentiment(dataset)
+    finally:
+        classifier.close()
+
+    parallel = ParallelClassifier(tiny_model, num_workers=2, num_threads=1)
+    try:
+        preds = parallel.get_sentiment(dataset)
+    finally:
+        parallel.close()
+
+    # the scores differ between examples, so shards merged out of order would not match
+    assert len(np.unique(expected['score'])) > 30
+    assert preds.keys() == expected.keys()
+    np.testing.assert_array_equal(preds['sentiment'], expected['sentiment'])
+    np.testing.assert_array_equal(preds['label_ids'], expected['label_ids'])
+    np.testing.assert_allclose(preds['score'], expected['score'], rtol=1e-5)
+    np.testing.assert_allclose(preds['probabilities'], expected['probabilities'], rtol=1e-5)
+
+
+def test_threads_are_split_and_restored():
+    saved_threads = torch.get_num_threads()
+    with torch_threads(4):
+        assert torch.get_num_threads() == 4
+        assert split_threads(2) == 2
+        assert split_threads(3) == 1
+        assert split_threads(8) == 1
+        with torch_threads(None):
+            assert torch.get_num_threads() == 4
+    assert torch.get_num_threads() == saved_threads
@@ -0,0 +1,66 @@
+# tests/test_registry.py
+
+
+import pytest
+import torch
+from llm_sentiment.config import Config
+from llm_sentiment.registry import ModelRegistry
+from llm_sentiment.model import ModelManage
+
+
+CPU = torch.device('cpu')
+
+
+@pytest.fixture(autouse=True)
+def registry(settings):
+    ModelRegistry.clear()
+    yield ModelRegistry
+    ModelRegistry.clear()
+
+
+def registered(precision=None):
+    return [(entry['precision'], entry['refs']) for entry in ModelRegistry.stats() if precision in (None, entry['precision'])]
+
+
+def test_model_is_loaded_once_and_reference_counted(tiny_model):
+    first = ModelManage(tiny_model)
+    second = ModelManage(tiny_model)
+    assert first.model is second.model
+    assert first.tokenizer is second.tokenizer
+    assert registered() == [('fp32', 2)]
+
+    first.release()
+    first.release()
+    assert registered() == [('fp32', 1)]
+    second.release()
+    # an idle model stays loaded within the registry limits
+    assert registered() == [('fp32', 0)]
+
+
+def test_least_recently_used_idle_model_is_evicted(tiny_model):
+    Config.override(MODEL_REGISTRY_SIZE=1)
+    model, _ = ModelRegistry.acquire(tiny_model['ID'], 'fp32', CPU)
+    ModelRegistry.acquire(tiny_model['ID'], 'bf16', CPU)
+    ModelRegistry.release(tiny_model['ID'], 'fp32', CPU)
+    assert registered() == [('fp32', 0), ('bf16', 1)]
+
+    # both models are idle, the least recently used one is evicted
+    ModelRegistry.release(tiny_model['ID'], 'bf16', CPU)
+    assert registered() == [('bf16', 0)]
+    assert ModelRegistry.acquire(tiny_model['ID'], 'fp32', CPU)[0] is not model
+
+
+def test_byte_limit_only_counts_idle_models(tiny_model):
+    fp32_model, _ = ModelRegistry.acquire(tiny_model['ID'], 'fp32', CPU)
+    bf16_model, _ = ModelRegistry.acquire(tiny_model['ID'], 'bf16', CPU)
+    fp32_bytes, bf16_bytes = ModelRegistry.model_bytes(fp32_model), ModelRegistry.model_bytes(bf16_model)
+    Config.override(MODEL_REGISTRY_SIZE=10, MODEL_REGISTRY_MAX_BYTES=bf16_bytes)
+
+    # the fp32 model in use does not count towards the limit, so the idle bf16 model fits
+    ModelRegistry.release(tiny_model['ID'], 'bf16', CPU)
+    assert registered() == [('fp32', 1), ('bf16', 0)]
+
+    # both idle models take more than the limit, so the least recently acquired one, the fp32 model, is evicted
+    ModelRegistry.release(tiny_model['ID'], 'fp32', CPU)
+    assert registered() == [('bf16', 0)]
+    assert fp32_bytes > bf16_bytes
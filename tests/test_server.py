@@ -0,0 +1,92 @@
+# tests/test_server.py
+
+
+import os
+import json
+import asyncio
+import numpy as np
+from datasets import Dataset
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.classifier import Classifier
+from llm_sentiment.server import SentimentServer
+
+
+async def http_request(socket_path, method, path, body=None):
+    '''
+    Sends one HTTP request to the server listening on socket_path.
+
+    Returns:
+        tuple: the status code and the body of the response, decoded from JSON unless it is the Prometheus text format.
+    '''
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n'.encode('latin-1') + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    status = int(head.split()[1])
+    return status, payload.decode('utf-8') if b'text/plain' in head else json.loads(payload)
+
+
+async def serve_and_run(server, socket_path, requests):
+    '''
+    Serves on socket_path while the requests coroutine runs, then stops the server.
+    '''
+    task = asyncio.create_task(server.serve(unix_socket=socket_path))
+    while not os.path.exists(socket_path):
+        await asyncio.sleep(0.01)
+    try:
+        return await requests()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_concurrent_requests_are_micro_batched(tiny_model, settings, tmp_path):
+    texts = synthetic_texts(24, mean_words=8, max_words=40, seed=2)
+    classifier = Classifier(tiny_model)
+    try:
+        expected = classifier.compute_sentiment(Dataset.from_dict({Config.COLUMN_TEXT: texts}))
+    finally:
+        classifier.close()
+
+    Config.override(SERVER_MAX_BATCH_SIZE=8, SERVER_MAX_WAIT_MS=200)
+    server = SentimentServer([tiny_model])
+    socket_path = str(tmp_path / 'server.sock')
+
+    async def requests():
+        # 12 concurrent requests of 2 texts each
+        responses = await asyncio.gather(*[http_request(socket_path, 'POST', '/predict', {'texts': texts[i:i + 2]}) for i in range(0, 24, 2)])
+        metrics = await http_request(socket_path, 'GET', '/metrics')
+        return responses, metrics
+
+    responses, (metrics_status, metrics) = asyncio.run(serve_and_run(server, socket_path, requests))
+
+    assert all(status == 200 for status, _ in responses)
+    predictions = [prediction for _, response in responses for prediction in response['predictions']]
+    assert [p['sentiment'] for p in predictions] == list(expected['sentiment'])
+    np.testing.assert_allclose([p['score'] for p in predictions], expected['score'], rtol=1e-5)
+    # the requests are coalesced into batches of at most 8 texts
+    stats = server.batchers['Tiny'].stats()
+    assert stats['texts'] == 24 and stats['requests'] == 12
+    assert 3 <= stats['batches'] < 12
+    assert metrics_status == 200 and 'llm_sentiment_requests_total{model="Tiny"} 12' in metrics
+
+
+def test_invalid_requests(tiny_model, settings, tmp_path):
+    server = SentimentServer([tiny_model])
+    socket_path = str(tmp_path / 'server.sock')
+
+    async def requests():
+        return [await http_request(socket_path, 'POST', '/predict', {'texts': 3}),
+                await http_request(socket_path, 'POST', '/predict', {'texts': ['w1'], 'model': 'Other'}),
+                await http_request(socket_path, 'POST', '/predict', {'texts': []}),
+                await http_request(socket_path, 'GET', '/unknown'),
+                await http_request(socket_path, 'GET', '/health')]
+
+    responses = asyncio.run(serve_and_run(server, socket_path, requests))
+    assert [status for status, _ in responses] == [400, 404, 200, 404, 200]
+    assert responses[2][1] == {'model': 'Tiny', 'predictions': []}
+    assert responses[4][1]['models'] == {'Tiny': {'queue_depth': 0}}
@@ -0,0 +1,46 @@
+# tests/test_startup.py
+
+
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['torch', 'transformers', 'datasets', 'pandas', 'numpy', 'pyarrow']  # libraries only imported when a job runs
+IMPORT_BUDGET_MS = 500  # maximum import time of an entry point, on top of the startup of an empty Python process
+
+
+def run(code):
+    '''
+    Runs code in a new Python process with the package importable.
+
+    Returns:
+        tuple: the best wall time of 3 runs in milliseconds, and the standard output of the last run.
+    '''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    durations = []
+    for _ in range(3):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env, cwd=ROOT).stdout
+        durations.append(time.perf_counter() - start)
+    return min(durations) * 1000, output
+
+
+@pytest.mark.parametrize('code', ['from llm_sentiment import cli; cli.build_parser()',
+                                  'from llm_sentiment.menu import Menu; from llm_sentiment.workflow import WorkFlow; Menu()',
+                                  'import llm_sentiment.streaming'])
+def test_startup_imports_no_heavy_module(code):
+    _, output = run(code + f"; import sys, json; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    assert json.loads(output.strip().splitlines()[-1]) == []
+
+
+@pytest.mark.parametrize('code', ['from llm_sentiment import cli; cli.build_parser()',
+                                  'from llm_sentiment.menu import Menu; Menu()'])
+def test_startup_within_budget(code):
+    baseline_ms, _ = run('pass')
+    elapsed_ms, _ = run(code)
+    assert elapsed_ms - baseline_ms <= IMPORT_BUDGET_MS
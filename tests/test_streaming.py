@@ -0,0 +1,95 @@
+# tests/test_streaming.py
+
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from llm_sentiment.config import Config
+from llm_sentiment.benchmark import synthetic_texts
+from llm_sentiment.prediction import Prediction
+from llm_sentiment.streaming import StreamingWorkFlow
+
+
+NUM_ROWS = 45
+
+
+@pytest.fixture
+def dataset_path(tmp_path):
+    path = str(tmp_path / 'data.parquet')
+    pq.write_table(pa.table({Config.COLUMN_TEXT: synthetic_texts(NUM_ROWS, mean_words=8, max_words=40, seed=5)}), path, row_group_size=16)
+    return path
+
+
+@pytest.fixture
+def predicted_chunks(monkeypatch):
+    '''
+    Records the number of examples of each chunk predicted by Prediction.predict(), and interrupts the run when the number of recorded chunks reaches .fail_at.
+    '''
+    predict = Prediction.predict
+
+    class Chunks(list):
+        fail_at = None
+
+    chunks = Chunks()
+
+    def recording_predict(self):
+        if len(chunks) == chunks.fail_at:
+            raise MemoryError('interrupted')
+        chunks.append(len(self.dataset))
+        return predict(self)
+
+    monkeypatch.setattr(Prediction, 'predict', recording_predict)
+    return chunks
+
+
+def run_streaming(tiny_model, dataset_path, output_path):
+    workflow = StreamingWorkFlow('classifier_classifier', [tiny_model], dataset_path, 'Regular', output_path)
+    return workflow.run(), workflow.output_path
+
+
+def read_text(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('overlap', [False, True])
+def test_interrupted_run_resumes_to_the_same_output(tiny_model, settings, dataset_path, predicted_chunks, tmp_path, overlap):
+    Config.override(STREAMING_CHUNK_SIZE=10, OVERLAP_PIPELINE=overlap)
+    rows, reference_path = run_streaming(tiny_model, dataset_path, str(tmp_path / 'reference.csv'))
+    assert rows == NUM_ROWS
+    assert predicted_chunks == [10, 10, 10, 10, 5]
+
+    output_path = str(tmp_path / 'output.csv')
+    del predicted_chunks[:]
+    predicted_chunks.fail_at = 3
+    with pytest.raises(MemoryError):
+        run_streaming(tiny_model, dataset_path, output_path)
+
+    del predicted_chunks[:]
+    predicted_chunks.fail_at = None
+    rows, output_path = run_streaming(tiny_model, dataset_path, output_path)
+    assert rows == NUM_ROWS
+    # the 3 chunks written before the interruption are not predicted again
+    assert predicted_chunks == [10, 5]
+    assert read_text(output_path) == read_text(reference_path)
+
+
+@pytest.mark.parametrize('setting', [{'DEDUP_NORMALIZE': True}, {'PRECISION': 'bf16'}, {'CASCADE_THRESHOLD': 0.5}, {'DECIMAL_PLACE': 4}])
+def test_changed_setting_restarts_the_output(tiny_model, settings, dataset_path, predicted_chunks, tmp_path, setting):
+    Config.override(STREAMING_CHUNK_SIZE=10, DEDUPLICATION=True)
+    output_path = str(tmp_path / 'output.csv')
+    predicted_chunks.fail_at = 2
+    with pytest.raises(MemoryError):
+        run_streaming(tiny_model, dataset_path, output_path)
+
+    Config.override(**setting)
+    del predicted_chunks[:]
+    predicted_chunks.fail_at = None
+    rows, output_path = run_streaming(tiny_model, dataset_path, output_path)
+    assert rows == NUM_ROWS
+    if 'CASCADE_THRESHOLD' in setting:
+        # the thresholds only matter to the 'cascade' category
+        assert predicted_chunks == [10, 10, 5]
+    else:
+        assert predicted_chunks == [10, 10, 10, 10, 5]
+    assert len(read_text(output_path).splitlines()) == NUM_ROWS + 1
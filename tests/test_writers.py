@@ -0,0 +1,87 @@
+# tests/test_writers.py
+
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+from llm_sentiment.writers import CsvWriter, JsonlWriter, ParquetWriter
+
+
+LABELS = ['negative', 'neutral', 'positive']
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'sentence': [f'text {i}' for i in range(rows)],
+                         'A_classifier_sentiment': np.array(LABELS, dtype=object)[rng.integers(0, 3, rows)],
+                         'A_classifier_score': rng.random(rows).round(4)})
+
+
+def batches(df, size):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def output_files(path, partition_rows):
+    if partition_rows:
+        return sorted(glob.glob(os.path.join(path, 'part-*')))
+    return [path]
+
+
+def read_bytes(path, partition_rows):
+    return [open(file_path, 'rb').read() for file_path in output_files(path, partition_rows)]
+
+
+@pytest.mark.parametrize('writer_class', [CsvWriter, JsonlWriter])
+@pytest.mark.parametrize('partition_rows', [None, 7])
+def test_resume_truncates_rows_written_after_the_last_flush(tmp_path, writer_class, partition_rows):
+    df = make_frame(30)
+    parts = batches(df, 4)
+    reference_path = str(tmp_path / f'reference.{writer_class.extension}')
+    path = str(tmp_path / f'output.{writer_class.extension}')
+
+    writer = writer_class(reference_path, partition_rows, LABELS)
+    for part in parts:
+        writer.write(part)
+    writer.close()
+
+    # the run is killed after writing batch 5, whose rows were not flushed
+    writer = writer_class(path, partition_rows, LABELS)
+    for part in parts[:4]:
+        writer.write(part)
+    state = writer.flush()
+    writer.write(parts[4])
+    assert state['rows'] == 16
+
+    writer = writer_class(path, partition_rows, LABELS, state=state)
+    for part in parts[4:]:
+        writer.write(part)
+    final_state = writer.close()
+
+    assert final_state['rows'] == len(df)
+    assert read_bytes(path, partition_rows) == read_bytes(reference_path, partition_rows)
+
+
+def test_parquet_resume_rewrites_the_current_part(tmp_path):
+    df = make_frame(30)
+    parts = batches(df, 4)
+    path = str(tmp_path / 'output')
+
+    writer = ParquetWriter(path, 10, LABELS)
+    for part in parts[:4]:
+        writer.write(part)
+    state = writer.flush()
+    writer.write(parts[4])
+    # the 10 rows of the first part are durable, the 6 rows of the open second part are not
+    assert state == {'rows': 10, 'parts': 1, 'part_rows': 0, 'offset': 0}
+
+    writer = ParquetWriter(path, 10, LABELS, state=state)
+    for part in batches(df.iloc[state['rows']:], 4):
+        writer.write(part)
+    writer.close()
+
+    result = pd.concat([pd.read_parquet(file_path) for file_path in output_files(path, 10)], ignore_index=True)
+    assert len(output_files(path, 10)) == 3
+    pd.testing.assert_frame_equal(result[['sentence', 'A_classifier_sentiment']].astype(str), df[['sentence', 'A_classifier_sentiment']].astype(str))
+    np.testing.assert_allclose(result['A_classifier_score'], df['A_classifier_score'], rtol=1e-6)